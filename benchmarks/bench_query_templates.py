@@ -0,0 +1,79 @@
+"""
+Benchmark of building and hashing the weather request of every row, rebuilding and compiling its queries per row
+against sharing one QueryTemplate per best domain triple. The best domains are those of the default mbe.ini.
+
+python benchmarks/bench_query_templates.py [--rows 100000]
+"""
+import argparse
+import contextlib
+import os
+from datetime import date, timedelta
+
+import numpy as np
+
+from common import Timer, print_table
+from meteobe import configurator, constants, query_compiler
+from meteobe.configurator import ConfigUtil
+from meteobe.meteoblue_data_extractor import MeteoBlueConnector
+
+COUNTRY_CODES = ['US', 'BR', 'CA', 'CN', 'AR', 'FR']
+
+
+def synthetic_rows(row_count: int) -> list:
+    """
+    Builds rows with random coordinates and dates, spread over COUNTRY_CODES.
+    :return: A list of (country code, lat, lon, start date, end date) tuples.
+    """
+    rng = np.random.default_rng(0)
+    rows: list = []
+    for i in range(row_count):
+        start_date = date(2020, 1, 1) + timedelta(days=int(rng.integers(0, 365)))
+        rows.append((COUNTRY_CODES[i % len(COUNTRY_CODES)], round(float(rng.uniform(-60, 60)), 4),
+                     round(float(rng.uniform(-180, 180)), 4), start_date, start_date + timedelta(days=180)))
+    return rows
+
+
+def hash_with_rebuild(mb: MeteoBlueConnector, rows: list, domains: tuple) -> list:
+    hashes: list = []
+    for country_code, lat, lon, start_date, end_date in rows:
+        queries: list = query_compiler.compile_queries(mb.build_weather_data_query_best_dataset(country_code,
+                                                                                              *domains)).queries
+        hashes.append(mb.hash_request(lat, lon, start_date, end_date, queries))
+    return hashes
+
+
+def hash_with_templates(mb: MeteoBlueConnector, rows: list, domains: tuple) -> list:
+    return [mb.weather_query_template(country_code, *domains).hash_request(lat, lon, start_date, end_date)
+            for country_code, lat, lon, start_date, end_date in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    # the connector and the ini file print what they load, and the rebuild prints a line per row as it did, all of
+    # which is discarded rather than timed on a terminal
+    results: dict = {}
+    table: list = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        config = ConfigUtil(constants.INI_FILE)
+        domains: tuple = tuple(config.get_all_keys_properties(section) for section in
+                               [constants.BEST_PRECIPITATION_DOMAINS, constants.BEST_TEMPERATURE_DOMAINS,
+                                constants.BEST_WIND_DOMAINS])
+        rows: list = synthetic_rows(args.rows)
+        for method, hash_rows in [('per-row rebuild', hash_with_rebuild), ('templates', hash_with_templates)]:
+            mb = MeteoBlueConnector('key', 'id', 'lat', 'lon', 'country_code',
+                                    configurator.normalise_file_path(constants.CODE_JSON))
+            with Timer() as timer:
+                results[method] = hash_rows(mb, rows, domains)
+            table.append([method, timer.seconds, timer.seconds / args.rows * 1e6, len(mb.query_templates)])
+            mb.close()
+
+    assert results['per-row rebuild'] == results['templates'], 'the templates must hash like the full payloads'
+    print(f'{args.rows} rows across {len(COUNTRY_CODES)} countries')
+    print_table(['method', 'seconds', 'us/row', 'templates'], table)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark of decoding responses into GeometryBlock arrays against copying their repeated data fields into lists.
+Every variant runs in its own interpreter and reports the growth of the peak RSS while all decoded responses are kept.
+
+python benchmarks/bench_response_decoder.py [--responses 1000] [--geometries 5] [--codes 6] [--days 365]
+"""
+import argparse
+import json
+import sys
+
+import numpy as np
+from meteoblue_dataset_sdk.protobuf.dataset_pb2 import DatasetApiProtobuf
+
+from common import Timer, peak_rss_mb, print_table, run_isolated
+from meteobe.response_decoder import decode_blocks
+
+VARIANTS = {'lists': None, 'float64': np.float64, 'float32': np.float32}
+
+
+def build_responses(response_count: int, geometry_count: int, code_count: int, day_count: int) -> list:
+    """
+    Builds distinct single location responses by parsing the same serialised response again and again.
+    :return: A list of DatasetApiProtobuf objects.
+    """
+    rng = np.random.default_rng(0)
+    response = DatasetApiProtobuf()
+    for geometry_index in range(geometry_count):
+        geometry = response.geometries.add(domain=f'DOMAIN{geometry_index}', lats=[47.5], lons=[7.6])
+        geometry.timeIntervals.add(start=1577836800, end=1577836800 + day_count * 86400, stride=86400)
+        for code in range(code_count):
+            geometry.codes.add(code=code, level='2 m above gnd', aggregation='mean', unit='x').timeIntervals.add(
+                data=rng.random(day_count).round(2).tolist())
+    payload: bytes = response.SerializeToString()
+    return [DatasetApiProtobuf.FromString(payload) for _ in range(response_count)]
+
+
+def decode_to_lists(response: DatasetApiProtobuf) -> list:
+    return [[list(code.timeIntervals[0].data) for code in geometry.codes] for geometry in response.geometries]
+
+
+def run_variant(args):
+    responses: list = build_responses(args.responses, args.geometries, args.codes, args.days)
+    rss_before: float = peak_rss_mb()
+    dtype = VARIANTS[args.variant]
+    with Timer() as timer:
+        if dtype is None:
+            decoded: list = [decode_to_lists(response) for response in responses]
+        else:
+            decoded = [decode_blocks(response, dtype) for response in responses]
+    assert len(decoded) == len(responses)
+    print(json.dumps({'seconds': timer.seconds, 'rss_growth_mb': peak_rss_mb() - rss_before}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--responses', type=int, default=1000)
+    parser.add_argument('--geometries', type=int, default=5)
+    parser.add_argument('--codes', type=int, default=6)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--variant', choices=list(VARIANTS), help='runs a single variant in this interpreter')
+    args = parser.parse_args()
+    if args.variant is not None:
+        run_variant(args)
+        return
+
+    sizes: list = ['--responses', str(args.responses), '--geometries', str(args.geometries), '--codes',
+                   str(args.codes), '--days', str(args.days)]
+    rows: list = []
+    for variant in VARIANTS:
+        measurements: dict = run_isolated(__file__, sizes + ['--variant', variant])
+        rows.append([variant, measurements['seconds'], measurements['rss_growth_mb']])
+
+    print(f'{args.responses} responses of {args.geometries} geometries x {args.codes} codes x {args.days} days')
+    print_table(['variant', 'seconds', 'peak RSS growth MB'], rows)
+
+
+if __name__ == '__main__':
+    main()
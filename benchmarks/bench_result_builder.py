@@ -0,0 +1,74 @@
+"""
+Benchmark of accumulating decoded locations with ResultBuilder against appending one dataframe per location, which is
+what DataFrame.append did before pandas 2 removed it.
+
+python benchmarks/bench_result_builder.py [--locations 1000 4000 16000] [--append-locations 250 500 1000]
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from common import Timer, print_table
+from meteobe.result_builder import ResultBuilder
+
+VARIABLE_COUNT = 10
+DAY_COUNT = 365
+
+
+def location_dicts(location_count: int) -> list:
+    """
+    Builds the response dictionaries of the weather decoder for synthetic locations.
+    param location_count: The number of locations.
+    :return: One dictionary per location with an ID, its coordinates, DAY_COUNT dates and VARIABLE_COUNT variables.
+    """
+    rng = np.random.default_rng(0)
+    # the decoder's time axis is datetime64[s], see response_decoder.build_time_axis
+    dates: np.ndarray = (np.datetime64('2020-01-01') + np.arange(DAY_COUNT)).astype('datetime64[s]')
+    dicts: list = []
+    for location in range(location_count):
+        response_dict: dict = {'ID': f'plot-{location}', 'lat': rng.uniform(-60, 60), 'lon': rng.uniform(-180, 180),
+                               'Date': dates}
+        for variable in range(VARIABLE_COUNT):
+            response_dict[f'Variable_{variable}'] = rng.random(DAY_COUNT)
+        dicts.append(response_dict)
+    return dicts
+
+
+def build_with_result_builder(dicts: list) -> pd.DataFrame:
+    builder = ResultBuilder()
+    for response_dict in dicts:
+        builder.add(response_dict)
+    return builder.to_dataframe()
+
+
+def build_with_append(dicts: list) -> pd.DataFrame:
+    df = pd.DataFrame()
+    for response_dict in dicts:
+        df = pd.concat([df, pd.DataFrame(response_dict)], ignore_index=True)
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--locations', type=int, nargs='+', default=[1000, 4000, 16000])
+    parser.add_argument('--append-locations', type=int, nargs='+', default=[250, 500, 1000],
+                        help='the append loop is quadratic, keep these small')
+    args = parser.parse_args()
+
+    rows: list = []
+    for method, build, counts in [('ResultBuilder', build_with_result_builder, args.locations),
+                                  ('append', build_with_append, args.append_locations)]:
+        for location_count in counts:
+            dicts: list = location_dicts(location_count)
+            with Timer() as timer:
+                df: pd.DataFrame = build(dicts)
+            assert len(df) == location_count * DAY_COUNT
+            rows.append([method, location_count, timer.seconds, timer.seconds / location_count * 1e6])
+
+    print(f'{VARIABLE_COUNT} variables x {DAY_COUNT} days per location')
+    print_table(['method', 'locations', 'seconds', 'us/location'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark of writing weather results through the CSV, Parquet and partitioned Parquet result sinks, and of reading
+the output back with pandas.
+
+python benchmarks/bench_result_sink.py [--locations 2630] [--days 365] [--variables 30] [--output-dir DIR]
+"""
+import argparse
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from common import Timer, print_table
+from meteobe.meteoblue_data_extractor import DATES, DATES_FORMAT
+from meteobe.result_sink import CSV_FORMAT, DEFAULT_FLUSH_ROWS, PARQUET_FORMAT, YEAR_PARTITION, ParquetOptions, \
+    open_result_sink
+
+COUNTRY_CODES = ['US', 'BR', 'CA', 'CN', 'AR', 'FR']
+# (name, output format, partition columns)
+VARIANTS = [('csv', CSV_FORMAT, []), ('parquet', PARQUET_FORMAT, []),
+            ('partitioned', PARQUET_FORMAT, ['country_code', YEAR_PARTITION])]
+
+
+def location_dicts(location_count: int, day_count: int, variable_count: int):
+    """
+    Yields the response dictionaries of synthetic locations, with measurements rounded to 2 decimals like Meteoblue's.
+    """
+    rng = np.random.default_rng(0)
+    for location in range(location_count):
+        start = np.datetime64('2019-01-01') + int(rng.integers(0, 365))
+        response_dict: dict = {'ID': f'plot-{location}', 'lat': rng.uniform(-60, 60), 'lon': rng.uniform(-180, 180),
+                               'country_code': COUNTRY_CODES[location % len(COUNTRY_CODES)],
+                               DATES: (start + np.arange(day_count)).astype('datetime64[s]')}
+        for variable in range(variable_count):
+            response_dict[f'Variable_{variable}'] = (rng.random(day_count) * 100).round(2)
+        yield response_dict
+
+
+def path_size_mb(path: str) -> float:
+    if os.path.isfile(path):
+        return os.path.getsize(path) / 1024 ** 2
+    return sum(os.path.getsize(os.path.join(directory, file)) for directory, _, files in os.walk(path)
+               for file in files) / 1024 ** 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--locations', type=int, default=2630)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--variables', type=int, default=30)
+    parser.add_argument('--output-dir', help='a temporary directory if it is not given')
+    args = parser.parse_args()
+
+    rows: list = []
+    with tempfile.TemporaryDirectory(dir=args.output_dir) as output_dir:
+        for name, output_format, partition_cols in VARIANTS:
+            options = ParquetOptions(float64_columns=['lat', 'lon'], dates_col=DATES, partition_cols=partition_cols)
+            sink = open_result_sink(output_format, os.path.join(output_dir, name), DEFAULT_FLUSH_ROWS,
+                                    date_format=DATES_FORMAT, parquet_options=options)
+            with Timer() as write_timer:
+                for response_dict in location_dicts(args.locations, args.days, args.variables):
+                    sink.add(response_dict)
+                row_count: int = sink.close()
+            with Timer() as read_timer:
+                df: pd.DataFrame = pd.read_csv(sink.file_path) if output_format == CSV_FORMAT else \
+                    pd.read_parquet(sink.file_path)
+            assert len(df) == row_count == args.locations * args.days
+            rows.append([name, write_timer.seconds, path_size_mb(sink.file_path), read_timer.seconds])
+
+    print(f'{args.locations * args.days} rows x {5 + args.variables} columns')
+    print_table(['output', 'write seconds', 'MB', 'read seconds'], rows)
+
+
+if __name__ == '__main__':
+    main()
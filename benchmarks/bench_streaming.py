@@ -0,0 +1,142 @@
+"""
+Benchmark of extract reading the whole input file against streaming it in chunks, on a synthetic CSV file and a mock
+Meteoblue that answers every query at once. Every chunk size runs in its own interpreter and reports when the first
+request was sent, the peak RSS and the duration of the run. The results of all runs are compared at the end.
+
+python benchmarks/bench_streaming.py [--records 300000] [--columns 157] [--chunk-rows 0 50000 10000] [--work-dir DIR]
+"""
+import argparse
+import builtins
+import contextlib
+import io
+import json
+import os
+import re
+import tempfile
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from meteoblue_dataset_sdk.protobuf.dataset_pb2 import DatasetApiProtobuf
+
+from common import Timer, peak_rss_mb, print_table, run_isolated
+from meteobe import configurator, constants, meteoblue_data_extractor
+from meteobe.client_pool import MeteoBlueClientPool
+
+COUNTRY_CODES = ['US', 'BR', 'CA', 'CN', 'AR', 'FR']
+KEY_COLUMNS = ['plot_id', 'lat', 'lon', 'country_code', 'planting', 'harvest']
+INPUT_FILE = 'trials.csv'
+WEATHER_FILE = 'trials_weather_data_only_best_domains.parquet'
+
+
+def write_input_file(file_path: str, record_count: int, column_count: int):
+    """
+    Writes a CSV file of trials with the key columns and filler columns, in blocks to keep the memory low.
+    param file_path: The path of the CSV file.
+    param record_count: The number of records.
+    param column_count: The number of columns, the filler columns alternate between numbers and text.
+    :return: None
+    """
+    rng = np.random.default_rng(0)
+    block_rows = 10000
+    for first in range(0, record_count, block_rows):
+        row_count: int = min(block_rows, record_count - first)
+        planting = pd.Timestamp('2021-03-01') + pd.to_timedelta(rng.integers(0, 180, row_count), unit='D')
+        block: dict = {'plot_id': [f'plot-{n}' for n in range(first, first + row_count)],
+                       'lat': rng.uniform(-50, 60, row_count).round(4),
+                       'lon': rng.uniform(-120, 140, row_count).round(4),
+                       'country_code': [COUNTRY_CODES[n % len(COUNTRY_CODES)] for n in range(first, first + row_count)],
+                       'planting': planting.strftime('%Y-%m-%d'),
+                       'harvest': (planting + pd.Timedelta(days=20)).strftime('%Y-%m-%d')}
+        for column in range(column_count - len(KEY_COLUMNS)):
+            block[f'attribute_{column}'] = rng.random(row_count).round(5) if column % 2 == 0 else \
+                [f'v{n % 997}' for n in range(first, first + row_count)]
+        pd.DataFrame(block).to_csv(file_path, mode='a' if first > 0 else 'w', header=first == 0, index=False)
+
+
+async def query_all_codes(pool, params: dict) -> DatasetApiProtobuf:
+    """A daily response for every query and location, whose values depend on the latitude, day and code"""
+    first_day, last_day = [datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+                           for day in re.findall(r'\d{4}-\d{2}-\d{2}', params['timeIntervals'][0])]
+    start: int = int(first_day.timestamp())
+    day_count: int = (last_day - first_day).days + 1
+    lats: list = [lat for lon, lat in params['geometry']['coordinates']]
+    lons: list = [lon for lon, lat in params['geometry']['coordinates']]
+    days: np.ndarray = np.arange(day_count)
+    response = DatasetApiProtobuf()
+    for query in params['queries']:
+        geometry = response.geometries.add(domain=query['domain'], lats=lats, lons=lons)
+        geometry.timeIntervals.add(start=start, end=start + day_count * 86400, stride=86400)
+        for code in query['codes']:
+            data: np.ndarray = (np.asarray(lats)[:, None] + days[None, :] + code['code'] / 1000).ravel()
+            geometry.codes.add(code=code['code'], level=code.get('level', ''), aggregation=code.get('aggregation', ''),
+                               unit='x').timeIntervals.add(data=data.tolist())
+    return response
+
+
+def run_variant(work_dir: str, chunk_rows: int):
+    """
+    Runs extract against query_all_codes and prints its measurements as JSON.
+    param work_dir: The directory of the input file, the output is written to a directory named after chunk_rows.
+    param chunk_rows: input_chunk_rows, 0 to read the whole file.
+    :return: None
+    """
+    properties: dict = {'input_file_dir': work_dir, 'output_file_dir': os.path.join(work_dir, f'chunks-{chunk_rows}'),
+                        'source_data_filename': INPUT_FILE, 'input_chunk_rows': chunk_rows, 'output_format': 'parquet',
+                        'api_key': 'key', 'id_col': 'plot_id', 'latitude_col': 'lat', 'longitude_col': 'lon',
+                        'country_code_col': 'country_code', 'user_interested_date_columns': 'planting,harvest',
+                        'requests_per_second': 0}
+    with open(configurator.normalise_file_path(constants.INI_FILE)) as f:
+        ini: str = f.read()
+    for key, value in properties.items():
+        ini = re.sub(rf'^{key} = .*$', f'{key} = {value}', ini, flags=re.MULTILINE)
+    ini_file: str = os.path.join(work_dir, f'mbe-{chunk_rows}.ini')
+    with open(ini_file, 'w') as f:
+        f.write(ini)
+
+    meteoblue_data_extractor.constants.INI_FILE = ini_file
+    MeteoBlueClientPool.query = query_all_codes
+    # answers n to the prompts loading the request JSON files
+    builtins.input = lambda prompt: 'n'
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output), Timer() as timer:
+        meteoblue_data_extractor.extract()
+    first_request = re.search(r'The first request was sent <([\d.]+)> seconds', output.getvalue())
+    print(json.dumps({'first_request_seconds': float(first_request.group(1)) if first_request else None,
+                      'peak_rss_mb': peak_rss_mb(), 'seconds': timer.seconds}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=300000)
+    parser.add_argument('--columns', type=int, default=157)
+    parser.add_argument('--chunk-rows', type=int, nargs='+', default=[0, 50000, 10000],
+                        help='input_chunk_rows of each run, 0 to read the whole file')
+    parser.add_argument('--work-dir', help='a temporary directory if it is not given')
+    parser.add_argument('--variant', type=int, help='runs a single chunk size in this interpreter on --work-dir')
+    args = parser.parse_args()
+    if args.variant is not None:
+        run_variant(args.work_dir, args.variant)
+        return
+
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as work_dir:
+        input_file: str = os.path.join(work_dir, INPUT_FILE)
+        write_input_file(input_file, args.records, args.columns)
+        rows: list = []
+        for chunk_rows in args.chunk_rows:
+            measurements: dict = run_isolated(__file__, ['--work-dir', work_dir, '--variant', str(chunk_rows)])
+            rows.append([chunk_rows or 'whole file', measurements['first_request_seconds'],
+                         measurements['peak_rss_mb'], measurements['seconds']])
+
+        outputs: list = [pd.read_parquet(os.path.join(work_dir, f'chunks-{chunk_rows}', WEATHER_FILE))
+                         for chunk_rows in args.chunk_rows]
+        for output in outputs[1:]:
+            pd.testing.assert_frame_equal(output, outputs[0])
+        print(f'{os.path.getsize(input_file) / 1024 ** 2:.0f} MB CSV file with {args.records} records and '
+              f'{args.columns} columns, {len(outputs[0])} weather rows, the same in every run')
+
+    print_table(['input_chunk_rows', 'first request seconds', 'peak RSS MB', 'seconds'], rows)
+
+
+if __name__ == '__main__':
+    main()
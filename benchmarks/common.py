@@ -0,0 +1,58 @@
+"""Helpers shared by the benchmark scripts, which are run on their own, e.g. python benchmarks/bench_streaming.py"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the same import paths as the tests, see [tool.pytest.ini_options] in pyproject.toml
+sys.path[:0] = [os.path.join(ROOT_DIR, 'src'), os.path.join(ROOT_DIR, 'src', 'meteobe')]
+
+
+class Timer:
+    """Context manager measuring the wall clock seconds of its block"""
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        self.seconds = 0.0
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self.started_at
+
+
+def peak_rss_mb() -> float:
+    """
+    Gets the peak resident set size of the current process.
+    :return: Megabytes, ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    """
+    peak: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_isolated(script: str, args: list) -> dict:
+    """
+    Runs one variant of a benchmark in a new interpreter, so that its peak RSS is not inflated by the other variants.
+    The variant prints its measurements as a JSON object on its last line of output.
+    param script: The path of the benchmark script.
+    param args: The command line arguments selecting the variant.
+    :return: The measurements of the variant.
+    """
+    completed = subprocess.run([sys.executable, script, *args], check=True, capture_output=True, text=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def print_table(header: list, rows: list):
+    """
+    Prints rows of measurements as an aligned table.
+    param header: The column titles.
+    param rows: Lists of values, floats are printed with two decimals.
+    :return: None
+    """
+    cells: list = [header] + [[f'{value:.2f}' if isinstance(value, float) else str(value) for value in row]
+                              for row in rows]
+    widths: list = [max(len(row[i]) for row in cells) for i in range(len(header))]
+    for row in cells:
+        print('  '.join(cell.rjust(width) for cell, width in zip(row, widths)))
@@ -0,0 +1,160 @@
+"""Module to record completed Meteoblue requests so that an interrupted run can be resumed"""
+__package__ = 'meteobe'
+
+import json
+import os
+import time
+
+import numpy as np
+
+ID = 'id'
+REQUEST_HASH = 'request_hash'
+RESULT = 'result'
+FAILED_QUERIES = 'failed_queries'
+
+# Number of records written between two syncs of the journal file to disk
+SYNC_EVERY = 100
+
+
+def to_json_value(value):
+    """Converts values that json can not serialise, e.g. NumPy arrays and scalars and protobuf repeated fields"""
+    if isinstance(value, np.ndarray) and value.dtype.kind == 'M':
+        return np.datetime_as_string(value).tolist()
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    if hasattr(value, '__iter__'):
+        return list(value)
+    return str(value)
+
+
+class CheckpointJournal:
+    """
+    Append-only JSON lines journal of completed (id, request hash) units and their decoded results. On resume only the
+    position of each unit in the journal is kept in memory, its result is read from the journal when it is needed.
+    """
+
+    def __init__(self, journal_file: str, resume: bool) -> None:
+        """
+        Instance of a CheckpointJournal.
+        param journal_file: The JSON lines file of the journal.
+        param resume: Reloads the completed units from the journal if True, otherwise starts a new journal and keeps
+        the journal of the previous run under a backup name, see backup_journal.
+        """
+        self.journal_file = journal_file
+        self.offsets: dict = {}
+        self.failed_queries: dict = {}
+        self.unsynced_count = 0
+        self.reader = None
+
+        if resume and os.path.exists(journal_file):
+            valid_size: int = self.load_offsets()
+            if valid_size < os.path.getsize(journal_file):
+                # the last line is incomplete if the previous run stopped while writing it, the next record must not
+                # be appended to it
+                print(f'Skipping an incomplete record at the end of {journal_file}')
+                os.truncate(journal_file, valid_size)
+            print(f'Resuming from <{len(self.offsets)}> completed records in {journal_file}')
+            self.file = open(journal_file, 'a', encoding='UTF-8')
+        else:
+            self.backup_journal()
+            self.file = open(journal_file, 'w', encoding='UTF-8')
+
+    def load_offsets(self) -> int:
+        """
+        Reads the position of every unit in the journal and the queries that failed for it, a later record of the
+        same unit replaces an earlier one.
+        :return: The size of the journal up to the end of its last complete line.
+        """
+        offset: int = 0
+        with open(self.journal_file, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record: dict = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f'Skipping an unreadable record in {self.journal_file}')
+                    offset += len(line)
+                    continue
+                key = (str(record[ID]), record[REQUEST_HASH])
+                self.offsets[key] = offset
+                if record.get(FAILED_QUERIES):
+                    self.failed_queries[key] = record[FAILED_QUERIES]
+                else:
+                    self.failed_queries.pop(key, None)
+                offset += len(line)
+        return offset
+
+    def backup_journal(self):
+        """
+        Renames the journal of a previous run, e.g. trials_weather_checkpoint.jsonl to
+        trials_weather_checkpoint.jsonl.20240131-120000 after its last modification, so that forgetting --resume does
+        not throw its progress away. It can be renamed back to resume from it.
+        :return: None
+        """
+        if not os.path.exists(self.journal_file) or os.path.getsize(self.journal_file) == 0:
+            return
+        modified_at: str = time.strftime('%Y%m%d-%H%M%S', time.localtime(os.path.getmtime(self.journal_file)))
+        backup_file: str = f'{self.journal_file}.{modified_at}'
+        os.replace(self.journal_file, backup_file)
+        print(f'Started a new journal, the journal of the previous run is kept as {backup_file}')
+
+    def is_completed(self, id_value, request_hash: str) -> bool:
+        """
+        Tells whether a unit was completed by the previous run, without reading its result.
+        param id_value: The value of the unique ID.
+        param request_hash: The hash of the request payload of the unit.
+        :return: True if the unit is in the journal.
+        """
+        return (str(id_value), request_hash) in self.offsets
+
+    def get(self, id_value, request_hash: str):
+        """
+        Reads the decoded result of a completed unit from the journal.
+        param id_value: The value of the unique ID.
+        param request_hash: The hash of the request payload of the unit.
+        :return: The decoded result, or None if the unit has not been completed.
+        """
+        offset = self.offsets.get((str(id_value), request_hash))
+        if offset is None:
+            return None
+        if self.reader is None:
+            self.reader = open(self.journal_file, 'rb')
+        self.reader.seek(offset)
+        return json.loads(self.reader.readline())[RESULT]
+
+    def get_failed_queries(self, id_value, request_hash: str) -> list:
+        """
+        Gets the queries that failed when a unit was completed with partial results.
+        param id_value: The value of the unique ID.
+        param request_hash: The hash of the request payload of the unit.
+        :return: A list of query hashes, empty if every query succeeded or the unit has not been completed.
+        """
+        return self.failed_queries.get((str(id_value), request_hash), [])
+
+    def record(self, id_value, request_hash: str, result: dict, failed_queries: list = None):
+        """
+        Appends a completed unit and its decoded result to the journal, a later record of the same unit replaces it.
+        param id_value: The value of the unique ID.
+        param request_hash: The hash of the request payload of the unit.
+        param result: The decoded result of the unit.
+        param failed_queries: The hashes of the queries missing from the result, fetched again on resume.
+        :return: None
+        """
+        record: dict = {ID: id_value, REQUEST_HASH: request_hash, RESULT: result}
+        if failed_queries:
+            record[FAILED_QUERIES] = failed_queries
+        self.file.write(json.dumps(record, default=to_json_value) + '\n')
+        self.file.flush()
+
+        self.unsynced_count += 1
+        if self.unsynced_count >= SYNC_EVERY:
+            os.fsync(self.file.fileno())
+            self.unsynced_count = 0
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
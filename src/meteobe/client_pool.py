@@ -0,0 +1,201 @@
+"""Module to share one keep-alive HTTP session between all Meteoblue requests of a run"""
+__package__ = 'meteobe'
+
+import asyncio
+import copy
+import email.utils
+import threading
+from datetime import datetime, timezone
+
+import aiohttp
+from meteoblue_dataset_sdk.client import ApiError
+from meteoblue_dataset_sdk.protobuf.dataset_pb2 import DatasetApiProtobuf
+
+from .retry_policy import HttpStatusError
+
+DEFAULT_POOL_SIZE = 16
+KEEPALIVE_TIMEOUT_SECONDS = 60
+
+# Meteoblue dataset API, the query URL takes the API key and the job queue URLs the job id
+QUERY_URL = 'https://my.meteoblue.com/dataset/query?apikey={}'
+JOB_STATUS_URL = 'https://my.meteoblue.com/queue/status/{}'
+JOB_RESULT_URL = 'https://queueresults.meteoblue.com/{}'
+# Error message of a query too large to be answered straight away, which is sent again to run on a job queue
+JOB_QUEUE_REQUIRED = 'This job must be executed on a job-queue'
+JOB_QUEUE_POLL_SECONDS = 5
+
+# Job queue statuses
+JOB_FINISHED = 'finished'
+JOB_DELETED = 'deleted'
+JOB_ERROR = 'error'
+
+
+async def raise_for_status(response: aiohttp.ClientResponse):
+    """
+    Raises an HttpStatusError for a response that is not successful, so that the retry policy decides whether and when
+    to send the request again.
+    param response: The response of a request.
+    :return: None
+    """
+    if 200 <= response.status <= 299:
+        return
+    # meteoblue APIs return a JSON encoded error message, other errors e.g. from a proxy may not
+    try:
+        json_response = await response.json(content_type=None)
+        error_message = json_response.get('error_message', json_response.get('reason', ''))
+    except (ValueError, AttributeError, aiohttp.ClientError):
+        error_message = response.reason or ''
+    raise HttpStatusError(response.status, error_message, parse_retry_after(response.headers.get('Retry-After')))
+
+
+def parse_retry_after(value: str):
+    """
+    Parses the Retry-After header of a throttled or unavailable response.
+    param value: A number of seconds or an HTTP date, None if the response has no such header.
+    :return: The number of seconds to wait, None if there is no header or it can not be parsed.
+    """
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at: datetime = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def parse_dataset(data: bytes) -> DatasetApiProtobuf:
+    result = DatasetApiProtobuf()
+    result.ParseFromString(data)
+    return result
+
+
+class MeteoBlueClientPool:
+    """
+    Event loop thread and keep-alive HTTP session shared by all Meteoblue requests, in sync and async mode. Queries are
+    sent and their protobuf responses decoded here rather than by the meteoblue_dataset_sdk client, which opens a
+    session per query and retries on its own.
+    """
+
+    def __init__(self, api_key: str, pool_size: int = DEFAULT_POOL_SIZE) -> None:
+        """
+        Instance of a MeteoBlueClientPool, its event loop runs in a daemon thread until close() is called.
+        param api_key: The Meteoblue API key.
+        param pool_size: The maximum number of open connections to Meteoblue.
+        """
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.session = None
+        self.query_url = QUERY_URL
+        self.job_status_url = JOB_STATUS_URL
+        self.job_result_url = JOB_RESULT_URL
+
+        self.http_requests = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='meteoblue-client-pool', daemon=True)
+        self.thread.start()
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None:
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_request_start.append(self.on_request_start)
+            trace_config.on_connection_create_end.append(self.on_connection_create_end)
+            trace_config.on_connection_reuseconn.append(self.on_connection_reuseconn)
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=KEEPALIVE_TIMEOUT_SECONDS)
+            self.session = aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
+        return self.session
+
+    async def on_request_start(self, session, context, params):
+        self.http_requests += 1
+
+    async def on_connection_create_end(self, session, context, params):
+        self.connections_created += 1
+
+    async def on_connection_reuseconn(self, session, context, params):
+        self.connections_reused += 1
+
+    def run(self, coroutine):
+        """
+        Runs a coroutine on the event loop of the pool and waits for its result, e.g. a batch of concurrent queries.
+        param coroutine: The coroutine to run.
+        :return: The result of the coroutine.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def query(self, params: dict):
+        """
+        Queries the Meteoblue dataset API for a protobuf response through the shared session, must be awaited on the
+        event loop of the pool. A query Meteoblue only runs on a job queue is sent again to a job queue and its result
+        is fetched once the job is finished.
+        param params: The Meteoblue REST JSON payload.
+        :return: DatasetApiProtobuf object
+        """
+        # the payload may be shared with other requests, e.g. by the response cache
+        params = copy.copy(params)
+        params['format'] = 'protobuf'
+        params.setdefault('runOnJobQueue', False)
+        session: aiohttp.ClientSession = await self.get_session()
+        url: str = self.query_url.format(self.api_key)
+        if not params.get('runOnJobQueue'):
+            try:
+                async with session.post(url, json=params) as response:
+                    await raise_for_status(response)
+                    return parse_dataset(await response.read())
+            except HttpStatusError as error:
+                if error.message != JOB_QUEUE_REQUIRED:
+                    raise
+        return await self.query_on_job_queue(session, url, params)
+
+    async def query_on_job_queue(self, session: aiohttp.ClientSession, url: str, params: dict):
+        """
+        Starts a query on a Meteoblue job queue, waits until the job is finished and fetches its result.
+        param session: The shared session.
+        param url: The query URL.
+        param params: The Meteoblue REST JSON payload.
+        :return: DatasetApiProtobuf object
+        """
+        params['runOnJobQueue'] = True
+        async with session.post(url, json=params) as response:
+            await raise_for_status(response)
+            job_id = (await response.json(content_type=None))['id']
+
+        while True:
+            async with session.get(self.job_status_url.format(job_id)) as response:
+                await raise_for_status(response)
+                status: dict = await response.json(content_type=None)
+            if status['status'] == JOB_FINISHED:
+                break
+            if status['status'] == JOB_DELETED:
+                raise ApiError('Job was canceled')
+            if status['status'] == JOB_ERROR:
+                raise ApiError(status.get('error_message', 'Job failed'))
+            await asyncio.sleep(JOB_QUEUE_POLL_SECONDS)
+
+        async with session.get(self.job_result_url.format(job_id)) as response:
+            await raise_for_status(response)
+            return parse_dataset(await response.read())
+
+    def query_sync(self, params: dict):
+        """
+        Queries Meteoblue from any thread and waits for the response.
+        param params: The Meteoblue REST JSON payload.
+        :return: DatasetApiProtobuf object
+        """
+        return self.run(self.query(params))
+
+    def close(self):
+        if self.session is not None:
+            self.run(self.session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        print(f'<{self.http_requests}> HTTP requests opened <{self.connections_created}> connections and reused '
+              f'connections <{self.connections_reused}> times')
@@ -0,0 +1,180 @@
+"""Module to index the Meteoblue codes JSON file and name the output columns of each code"""
+__package__ = 'meteobe'
+
+import functools
+import json
+import zlib
+
+# Soil level of the codes aggregated between a start and an end depth
+LVL_AGGREGATE = 'aggregated'
+
+WEATHER_LAYOUT = 'weather'
+SOIL_LAYOUT = 'soil'
+
+
+class CodeRegistry:
+    """Indexed codes JSON with memoised column names and a stable integer schema id per column"""
+
+    def __init__(self, codes_lst: list) -> None:
+        """
+        Instance of a CodeRegistry.
+        param codes_lst: The content of the codes JSON file, a list of code, variable and defaultUnit dictionaries.
+        """
+        self.codes_lst = codes_lst
+        self.variables: dict = {}
+        self.default_units: dict = {}
+        for d in codes_lst:
+            self.variables[d['code']] = d['variable']
+            self.default_units[d['code']] = d.get('defaultUnit', '')
+
+        self.column_names: dict = {}
+        # the layout and code of each column name, to describe the columns in the schema of the long layout
+        self.column_codes: dict = {}
+        self.schema_ids: dict = {}
+        self.schema_columns: dict = {}
+
+    def lookup_variable(self, code: int) -> str:
+        return self.variables.get(code, '')
+
+    def column_stem(self, code: int, qualifier: str = None) -> str:
+        """
+        Gets a column name without its unit, which is only known from the response, e.g. Temperature_(Max).
+        param code: The Meteoblue code.
+        param qualifier: The aggregation of a weather code or the depth of a soil code, None for the variable only.
+        :return: The column name without its unit.
+        """
+        variable: str = self.lookup_variable(code).replace(' ', '_')
+        return variable if qualifier is None else variable + '_(' + qualifier + ')'
+
+    def weather_column_name(self, code_info) -> str:
+        """
+        Gets the weather column name of a code, e.g. Temperature_(Max)_(°C).
+        param code_info: A response_decoder.CodeInfo.
+        :return: The column name.
+        """
+        key = (WEATHER_LAYOUT, code_info)
+        column_name = self.column_names.get(key)
+        if column_name is None:
+            column_name = self.column_stem(code_info.code, capitalise(code_info.aggregation)) + '_(' + \
+                code_info.unit + ')'
+            self.column_names[key] = column_name
+            self.column_codes[column_name] = key
+        return column_name
+
+    def soil_column_name(self, code_info) -> str:
+        """
+        Gets the soil column name of a code, e.g. Bulk_Density_(0-30)_(cg/cm³).
+        param code_info: A response_decoder.CodeInfo.
+        :return: The column name.
+        """
+        key = (SOIL_LAYOUT, code_info)
+        column_name = self.column_names.get(key)
+        if column_name is None:
+            if code_info.level == LVL_AGGREGATE:
+                column_name = self.column_stem(code_info.code, str(code_info.start_depth) + '-' + str(
+                    code_info.end_depth)) + '_(' + code_info.unit + ')'
+            else:
+                column_name = self.column_stem(code_info.code, code_info.level) + '_(' + code_info.unit + ')'
+            self.column_names[key] = column_name
+            self.column_codes[column_name] = key
+        return column_name
+
+    def schema_id(self, column_name: str) -> int:
+        """
+        Gets the schema id of a column, which only depends on the column name so it is the same in every run.
+        param column_name: The column name.
+        :return: A non-negative 32-bit integer.
+        """
+        schema_id = self.schema_ids.get(column_name)
+        if schema_id is None:
+            schema_id = zlib.crc32(column_name.encode('utf-8')) & 0x7fffffff
+            if schema_id in self.schema_columns:
+                raise ValueError(f'Columns <{column_name}> and <{self.schema_columns[schema_id]}> have the same '
+                                 f'schema id {schema_id}')
+            self.schema_ids[column_name] = schema_id
+            self.schema_columns[schema_id] = column_name
+        return schema_id
+
+    def describe_column(self, column_name: str) -> dict:
+        """
+        Describes a column by its schema id, code, variable, level, aggregation, depths and unit.
+        param column_name: The column name.
+        :return: A dictionary, only the schema id and the column name are known for a column that was not named in
+        this run, e.g. one loaded from a checkpoint journal.
+        """
+        description: dict = {'schema_id': self.schema_id(column_name), 'column': column_name}
+        key = self.column_codes.get(column_name)
+        if key is not None:
+            layout, code_info = key
+            description.update({'layout': layout, 'code': code_info.code,
+                                'variable': self.lookup_variable(code_info.code), 'level': code_info.level,
+                                'aggregation': code_info.aggregation, 'start_depth': code_info.start_depth,
+                                'end_depth': code_info.end_depth, 'unit': code_info.unit,
+                                'default_unit': self.default_units.get(code_info.code, '')})
+        return description
+
+
+class ColumnOrder:
+    """
+    Order of the output columns, taken from the codes of the queries rather than from whichever record arrives first,
+    so that a record missing a failed domain or loaded from a checkpoint journal does not change the header
+    """
+
+    def __init__(self, code_registry: CodeRegistry, layout: str, key_columns: list) -> None:
+        """
+        Instance of a ColumnOrder.
+        param code_registry: The CodeRegistry naming the columns.
+        param layout: WEATHER_LAYOUT or SOIL_LAYOUT.
+        param key_columns: The columns before the codes, e.g. the ID, the coordinates and the dates.
+        """
+        self.code_registry = code_registry
+        self.layout = layout
+        # the rank of each key column, code column name without its unit and code variable
+        self.ranks: dict = {column: rank for rank, column in enumerate(key_columns)}
+
+    def add_queries(self, queries: list):
+        """
+        Ranks the codes of queries after the codes already ranked, in the order they are requested.
+        param queries: A list of domain and codes dictionaries, as sent to Meteoblue.
+        :return: None
+        """
+        for query in queries:
+            aggregation: str = next((transformation.get('aggregation') for transformation in
+                                     query.get('transformations') or [] if transformation.get('aggregation')), None)
+            for code in query.get('codes', []):
+                if self.layout == SOIL_LAYOUT:
+                    qualifier = f"{code.get('startDepth')}-{code.get('endDepth')}" \
+                        if code.get('level') == LVL_AGGREGATE else code.get('level')
+                else:
+                    qualifier = capitalise(code.get('aggregation') or aggregation)
+                for key in [self.code_registry.column_stem(code['code'], qualifier),
+                            self.code_registry.column_stem(code['code'])]:
+                    self.ranks.setdefault(key, len(self.ranks))
+
+    def rank(self, column_name: str) -> int:
+        """
+        Gets the rank of a column, by its name, its name without unit or, e.g. for a code requested without
+        aggregation, its variable.
+        param column_name: The column name.
+        :return: The rank, columns of codes that were not requested rank last.
+        """
+        for key in [column_name, column_name.rsplit('_(', 1)[0], column_name.rsplit('_(', 2)[0]]:
+            rank = self.ranks.get(key)
+            if rank is not None:
+                return rank
+        return len(self.ranks)
+
+
+def capitalise(aggregation: str):
+    return aggregation if not aggregation else aggregation[0].upper() + aggregation[1:]
+
+
+@functools.lru_cache(maxsize=None)
+def load_code_registry(codes_filename: str) -> CodeRegistry:
+    """
+    Loads the codes JSON file once per process.
+    param codes_filename: The path of the codes JSON file.
+    :return: A CodeRegistry.
+    """
+    with open(codes_filename) as file:
+        return CodeRegistry(json.load(file))
@@ -18,11 +18,12 @@ class ConfigUtil:
         self.config = configparser.ConfigParser()
         self.config.read(self.ini_file_name)
 
-    def get_property(self, section: str, key: str) -> str:
+    def get_property(self, section: str, key: str, default: str = None) -> str:
         """
         Gets a property value from the ini file.
         param section: The section name.
         param key: The key name withing the section
+        param default: The value to use if the key is not in the ini file, e.g. an ini file from an older version.
         :return: The value of the given section and key.
         """
         if not self.config.has_section(section):
@@ -30,6 +31,10 @@ class ConfigUtil:
                 f'Config file does not have section {section}, please check the name of section or api key file '
                 f'existence')
 
+        if default is not None and not self.config.has_option(section, key):
+            print(f'Property <{key}> is not set, use default value {default}')
+            return default
+
         key_value: str = self.config[section][key]
         print(f'Property value <{key}> = {key_value}')
         return key_value
@@ -48,6 +53,20 @@ class ConfigUtil:
 
         return find_sections
 
+    def get_section_properties(self, section: str) -> dict:
+        """
+        Gets all the key value pairs of a section, e.g. the time to live of each domain.
+        param section: The section name.
+        :return: A dictionary with the keys and values of the section, empty if the section does not exist.
+        """
+        if not self.config.has_section(section):
+            print(f'Config file does not have section {section}, no properties are loaded from it')
+            return {}
+
+        properties: dict = dict(self.config[section].items())
+        print(f'Properties in section <{section}> are {properties}')
+        return properties
+
     def get_all_keys_properties(self, section: str) -> dict:
         """
         Gets Key values by scanning the values. An example is to get the best domain based on country code
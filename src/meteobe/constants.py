@@ -12,12 +12,28 @@ METEOBLUE_SECTION = 'MeteoBlue'
 BEST_PRECIPITATION_DOMAINS = 'Best_Precipitation_Domains'
 BEST_TEMPERATURE_DOMAINS = 'Best_Temperature_Domains'
 BEST_WIND_DOMAINS = 'Best_Wind_Domains'
+DOMAIN_GRID_RESOLUTIONS = 'Domain_Grid_Resolutions'
+
+RESPONSE_CACHE_SECTION = 'Response_Cache'
+TILE_CACHE_SECTION = 'Tile_Cache'
+CACHE_TTL_DAYS = 'Cache_TTL_Days'
+RETRY_SECTION = 'Retry'
+RATE_LIMIT_SECTION = 'Rate_Limit'
 
 # Property names
 INPUT_FILE_DIR = 'input_file_dir'
 OUTPUT_FILE_DIR = 'output_file_dir'
 SOURCE_DATA_FILENAME = 'source_data_filename'
 SHEET_NAME = 'sheet_name'
+INPUT_CHUNK_ROWS = 'input_chunk_rows'
+INPUT_CACHE = 'input_cache'
+OUTPUT_FORMAT = 'output_format'
+OUTPUT_LAYOUT = 'output_layout'
+FLUSH_ROWS = 'flush_rows'
+FLUSH_SECONDS = 'flush_seconds'
+PARQUET_COMPRESSION = 'parquet_compression'
+PARQUET_FLOAT32 = 'parquet_float32'
+PARTITION_BY = 'partition_by'
 API_KEY = 'api_key'
 
 LATITUDE_COL = 'latitude_col'
@@ -29,3 +45,27 @@ USER_INTERESTED_DATE_COLS = 'user_interested_date_columns'
 
 START_DATE_OFFSET = 'start_date_offset'
 END_DATE_OFFSET = 'end_date_offset'
+
+EXECUTION_MODE = 'execution_mode'
+MAX_CONCURRENT_REQUESTS = 'max_concurrent_requests'
+MAX_POINTS_PER_REQUEST = 'max_points_per_request'
+COORDINATE_PRECISION = 'coordinate_precision'
+CONNECTION_POOL_SIZE = 'connection_pool_size'
+GRID_SNAPPING = 'grid_snapping'
+SPLIT_QUERIES_BY_DOMAIN = 'split_queries_by_domain'
+
+CACHE_ENABLED = 'enabled'
+CACHE_FILE = 'cache_file'
+CACHE_MAX_SIZE_MB = 'max_size_mb'
+
+RETRY_MAX_ATTEMPTS = 'max_attempts'
+RETRY_BASE_DELAY_SECONDS = 'base_delay_seconds'
+RETRY_MAX_DELAY_SECONDS = 'max_delay_seconds'
+REQUEST_DEADLINE_SECONDS = 'request_deadline_seconds'
+
+REQUESTS_PER_SECOND = 'requests_per_second'
+BURST = 'burst'
+ADAPTIVE_CONCURRENCY = 'adaptive_concurrency'
+INITIAL_CONCURRENT_REQUESTS = 'initial_concurrent_requests'
+MIN_CONCURRENT_REQUESTS = 'min_concurrent_requests'
+LATENCY_SPIKE_FACTOR = 'latency_spike_factor'
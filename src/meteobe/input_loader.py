@@ -0,0 +1,326 @@
+"""Module to read the columns of the input file needed to request Meteoblue, at once or in chunks of rows"""
+__package__ = 'meteobe'
+
+import hashlib
+import json
+import os
+import pathlib
+
+import pandas as pd
+
+from .result_sink import import_pyarrow
+
+CSV_SUFFIX = '.csv'
+PARQUET_SUFFIX = '.parquet'
+FEATHER_SUFFIX = '.feather'
+# Workbooks read row by row with openpyxl in read-only mode, other Excel files are read at once by pandas
+OPENPYXL_SUFFIXES = ['.xlsx', '.xlsm']
+
+# Number of input rows read at once in streaming mode, 0 reads the whole file before requesting Meteoblue
+DEFAULT_INPUT_CHUNK_ROWS = 0
+
+# Metadata of the Parquet conversion of an Excel sheet, identifying the workbook and sheet it was converted from
+CACHE_SOURCE_SIZE = b'meteobe.source_size'
+CACHE_SOURCE_MTIME = b'meteobe.source_mtime_ns'
+CACHE_SOURCE_SHA256 = b'meteobe.source_sha256'
+CACHE_SHEET_NAME = b'meteobe.sheet_name'
+CACHE_COLUMNS = b'meteobe.columns'
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def input_file_path(input_file_dir: str, source_data_filename: str) -> pathlib.Path:
+    return pathlib.Path(__file__).resolve().parent.parent.joinpath(input_file_dir).joinpath(source_data_filename)
+
+
+def optional_pyarrow():
+    """
+    Imports PyArrow if it is installed, CSV files are parsed by pandas otherwise.
+    :return: The pyarrow module, or None.
+    """
+    try:
+        return import_pyarrow()
+    except ImportError:
+        return None
+
+
+def hash_file(file_path: pathlib.Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def header_names(header: tuple) -> list:
+    # as named by pandas.read_excel
+    return [f'Unnamed: {i}' if name is None else str(name) for i, name in enumerate(header)]
+
+
+def read_column_names(file_path: pathlib.Path, sheet: str) -> list:
+    """
+    Reads the header of the input file without its rows.
+    param file_path: The path of the input CSV, Excel, Parquet or Feather file.
+    param sheet: The sheet of an Excel file, the first sheet if it is empty.
+    :return: A list of column names.
+    """
+    suffix: str = file_path.suffix.lower()
+    if suffix == CSV_SUFFIX:
+        return pd.read_csv(file_path, nrows=0).columns.tolist()
+    if suffix == PARQUET_SUFFIX:
+        return import_pyarrow().parquet.read_schema(file_path).names
+    if suffix == FEATHER_SUFFIX:
+        pa = import_pyarrow()
+        return pa.ipc.open_file(pa.memory_map(str(file_path))).schema.names
+    if suffix in OPENPYXL_SUFFIXES:
+        workbook, worksheet = open_worksheet(file_path, sheet)
+        try:
+            return header_names(next(worksheet.iter_rows(max_row=1, values_only=True), ()))
+        finally:
+            workbook.close()
+    return pd.read_excel(file_path, sheet_name=sheet or 0, nrows=0).columns.tolist()
+
+
+def open_worksheet(file_path: pathlib.Path, sheet: str) -> tuple:
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    return workbook, workbook[sheet] if sheet else workbook.worksheets[0]
+
+
+def iter_chunks(file_path: pathlib.Path, sheet: str, usecols: list, chunk_rows: int, add_on_cols: dict,
+                text_cols: list = None, float_cols: list = None, cache: bool = False):
+    """
+    Reads the input file in chunks of rows, only parsing the given columns, so that requests can be planned and sent
+    before the whole file is read. CSV files are parsed by PyArrow with several threads if it is installed, xlsx
+    workbooks are read row by row and their sheet can be cached as Parquet next to them.
+    param file_path: The path of the input CSV, Excel, Parquet or Feather file.
+    param sheet: The sheet of an Excel file, the first sheet if it is empty.
+    param usecols: The columns to read, every other column is skipped.
+    param chunk_rows: The number of rows of a chunk, 0 reads the whole file as one chunk.
+    param add_on_cols: Columns added to every chunk with a constant value, e.g. the internal country code column.
+    param text_cols: Columns parsed from CSV as text, like pandas does for non numeric columns, e.g. IDs and dates.
+    param float_cols: Columns parsed from CSV as floats, e.g. the coordinates.
+    param cache: Reads an xlsx sheet from its Parquet conversion if it is still up to date, or writes it.
+    :return: A generator of Pandas dataframes.
+    """
+    suffix: str = file_path.suffix.lower()
+    if suffix == CSV_SUFFIX:
+        pa = optional_pyarrow()
+        if pa is None:
+            chunks = iter_pandas_csv_chunks(file_path, usecols, chunk_rows)
+        else:
+            chunks = iter_arrow_csv_chunks(pa, file_path, usecols, chunk_rows, text_cols or [], float_cols or [])
+    elif suffix == PARQUET_SUFFIX:
+        pa = import_pyarrow()
+        chunks = iter_arrow_chunks(pa, pa.parquet.ParquetFile(file_path).iter_batches(
+            batch_size=chunk_rows or 65536, columns=usecols), chunk_rows)
+    elif suffix == FEATHER_SUFFIX:
+        pa = import_pyarrow()
+        table = pa.ipc.open_file(pa.memory_map(str(file_path))).read_all()
+        chunks = iter_arrow_chunks(pa, (table.select(usecols) if usecols else table).to_batches(), chunk_rows)
+    elif suffix in OPENPYXL_SUFFIXES:
+        chunks = iter_cached_excel_chunks(file_path, sheet, usecols, chunk_rows) if cache and usecols else \
+            iter_excel_chunks(file_path, sheet, usecols, chunk_rows)
+    else:
+        data: pd.DataFrame = pd.read_excel(file_path, sheet_name=sheet or 0, usecols=usecols)
+        chunks = [data] if chunk_rows <= 0 else \
+            (data.iloc[start:start + chunk_rows] for start in range(0, len(data), chunk_rows))
+
+    for chunk in chunks:
+        chunk = chunk.reset_index(drop=True)
+        for counter, (col_name, value) in enumerate(add_on_cols.items()):
+            chunk.insert(counter, col_name, value)
+        yield chunk
+
+
+def iter_pandas_csv_chunks(file_path: pathlib.Path, usecols: list, chunk_rows: int):
+    if chunk_rows <= 0:
+        return [pd.read_csv(file_path, usecols=usecols)]
+    return pd.read_csv(file_path, usecols=usecols, chunksize=chunk_rows)
+
+
+def iter_arrow_csv_chunks(pa, file_path: pathlib.Path, usecols: list, chunk_rows: int, text_cols: list,
+                          float_cols: list):
+    """
+    Parses a CSV file with PyArrow. The text and float columns get fixed types, so that a value of a later block can
+    not contradict the type inferred from the first block, and text columns of numbers become numeric like in pandas.
+    """
+    import pyarrow.csv
+
+    column_types: dict = {col: pa.string() for col in text_cols}
+    column_types.update({col: pa.float64() for col in float_cols})
+    convert_options = pyarrow.csv.ConvertOptions(include_columns=usecols, column_types=column_types,
+                                                 strings_can_be_null=True)
+    read_options = pyarrow.csv.ReadOptions(use_threads=True)
+    if chunk_rows <= 0:
+        batches = pyarrow.csv.read_csv(file_path, read_options=read_options,
+                                       convert_options=convert_options).to_batches()
+    else:
+        batches = pyarrow.csv.open_csv(file_path, read_options=read_options, convert_options=convert_options)
+
+    for chunk in iter_arrow_chunks(pa, batches, chunk_rows):
+        for col in text_cols:
+            if col in chunk.columns:
+                try:
+                    chunk[col] = pd.to_numeric(chunk[col])
+                except (ValueError, TypeError):
+                    pass
+        yield chunk
+
+
+def iter_arrow_chunks(pa, batches, chunk_rows: int):
+    """
+    Regroups Arrow record batches into dataframes of chunk_rows rows.
+    param pa: The pyarrow module.
+    param batches: An iterable of record batches.
+    param chunk_rows: The number of rows of a chunk, 0 for one chunk of every row.
+    :return: A generator of Pandas dataframes.
+    """
+    pending: list = []
+    pending_rows: int = 0
+    for batch in batches:
+        while batch.num_rows > 0:
+            take: int = batch.num_rows if chunk_rows <= 0 else min(chunk_rows - pending_rows, batch.num_rows)
+            pending.append(batch.slice(0, take))
+            pending_rows += take
+            batch = batch.slice(take)
+            if pending_rows == chunk_rows:
+                yield pa.Table.from_batches(pending).to_pandas()
+                pending = []
+                pending_rows = 0
+    if pending_rows > 0:
+        yield pa.Table.from_batches(pending).to_pandas()
+
+
+def iter_excel_chunks(file_path: pathlib.Path, sheet: str, usecols: list, chunk_rows: int):
+    """
+    Reads an xlsx sheet row by row with openpyxl in read-only mode, which does not load the whole workbook.
+    param file_path: The path of the workbook.
+    param sheet: The sheet, the first sheet if it is empty.
+    param usecols: The columns to read, every column if None.
+    param chunk_rows: The number of rows of a chunk, 0 reads the whole sheet as one chunk.
+    :return: A generator of Pandas dataframes.
+    """
+    workbook, worksheet = open_worksheet(file_path, sheet)
+    try:
+        rows = worksheet.iter_rows(values_only=True)
+        names: list = header_names(next(rows, ()))
+        columns: list = usecols if usecols is not None else names
+        positions: list = [names.index(col) for col in columns]
+
+        chunk: list = []
+        for row in rows:
+            values: tuple = tuple(row[position] if position < len(row) else None for position in positions)
+            # like pandas.read_excel, empty rows are skipped
+            if all(value is None for value in values):
+                continue
+            chunk.append(values)
+            if len(chunk) == chunk_rows:
+                yield pd.DataFrame(chunk, columns=columns)
+                chunk = []
+        if len(chunk) > 0 or chunk_rows <= 0:
+            yield pd.DataFrame(chunk, columns=columns)
+    finally:
+        workbook.close()
+
+
+def excel_cache_path(file_path: pathlib.Path, sheet: str) -> pathlib.Path:
+    return file_path.with_name(f'{file_path.name}.{sheet or "first_sheet"}.parquet')
+
+
+def read_excel_cache(pa, cache_path: pathlib.Path, file_path: pathlib.Path, sheet: str, usecols: list):
+    """
+    Checks the Parquet conversion of an Excel sheet against the workbook, the workbook is only hashed when its size
+    matches but its modification time does not, e.g. after it was copied.
+    :return: A ParquetFile, or None if there is no conversion or it is out of date.
+    """
+    if not cache_path.exists():
+        return None
+    parquet_file = pa.parquet.ParquetFile(cache_path)
+    metadata: dict = parquet_file.schema_arrow.metadata or {}
+    stat = os.stat(file_path)
+    if metadata.get(CACHE_SHEET_NAME, b'').decode('utf-8') != (sheet or '') or \
+            metadata.get(CACHE_SOURCE_SIZE) != str(stat.st_size).encode('utf-8') or \
+            not set(usecols).issubset(json.loads(metadata.get(CACHE_COLUMNS, b'[]'))):
+        return None
+    if metadata.get(CACHE_SOURCE_MTIME) != str(stat.st_mtime_ns).encode('utf-8') and \
+            metadata.get(CACHE_SOURCE_SHA256, b'').decode('utf-8') != hash_file(file_path):
+        return None
+    return parquet_file
+
+
+def iter_cached_excel_chunks(file_path: pathlib.Path, sheet: str, usecols: list, chunk_rows: int):
+    """
+    Reads an xlsx sheet from its Parquet conversion next to the workbook if it is up to date, otherwise reads the
+    workbook and writes the conversion while the chunks are used, under a temporary name until the last chunk.
+    """
+    pa = optional_pyarrow()
+    if pa is None:
+        print('The Excel input cache needs pyarrow, install it with pip install meteobe[arrow]')
+        yield from iter_excel_chunks(file_path, sheet, usecols, chunk_rows)
+        return
+
+    cache_path: pathlib.Path = excel_cache_path(file_path, sheet)
+    parquet_file = read_excel_cache(pa, cache_path, file_path, sheet, usecols)
+    if parquet_file is not None:
+        print(f'Loading sheet {sheet} from its Parquet conversion {cache_path}')
+        yield from iter_arrow_chunks(pa, parquet_file.iter_batches(batch_size=chunk_rows or 65536, columns=usecols),
+                                     chunk_rows)
+        return
+
+    stat = os.stat(file_path)
+    metadata: dict = {CACHE_SOURCE_SIZE: str(stat.st_size), CACHE_SOURCE_MTIME: str(stat.st_mtime_ns),
+                      CACHE_SOURCE_SHA256: hash_file(file_path), CACHE_SHEET_NAME: sheet or '',
+                      CACHE_COLUMNS: json.dumps(usecols)}
+    temporary_path: str = f'{cache_path}.tmp'
+    # None until the first chunk is written, False once caching failed
+    writer = None
+    try:
+        for chunk in iter_excel_chunks(file_path, sheet, usecols, chunk_rows):
+            if writer is False:
+                yield chunk
+                continue
+            try:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    table = table.replace_schema_metadata({**(table.schema.metadata or {}), **metadata})
+                    writer = pa.parquet.ParquetWriter(temporary_path, table.schema)
+                writer.write_table(table.cast(writer.schema))
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, OSError) as error:
+                # e.g. a column of numbers and text, the sheet is read from the workbook again next time
+                print(f'Could not cache sheet {sheet} of {file_path} as Parquet: {error}')
+                discard_excel_cache(writer, temporary_path)
+                writer = False
+            yield chunk
+
+        if writer:
+            writer.close()
+            os.replace(temporary_path, cache_path)
+            writer = None
+            print(f'Cached sheet {sheet} of {file_path} as {cache_path}')
+    finally:
+        # the chunks were not all read, e.g. the run failed, so the conversion is incomplete
+        if writer:
+            discard_excel_cache(writer, temporary_path)
+
+
+def discard_excel_cache(writer, temporary_path: str):
+    """
+    Closes and removes the conversion of an Excel sheet that could not be completed, so a truncated conversion is
+    never read instead of the workbook.
+    param writer: The ParquetWriter of the conversion, None if it was not created.
+    param temporary_path: The temporary path of the conversion.
+    :return: None
+    """
+    try:
+        if writer is not None:
+            writer.close()
+    except OSError as error:
+        print(f'Could not close {temporary_path}: {error}')
+    try:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+    except OSError as error:
+        # the conversion is only ever read under its final name, so a leftover temporary file is harmless
+        print(f'Could not remove {temporary_path}: {error}')
@@ -0,0 +1,140 @@
+"""Module to reshape decoded Meteoblue results into a long layout of one row per date and variable"""
+__package__ = 'meteobe'
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from .code_registry import CodeRegistry
+from .result_sink import ARROW_FORMAT, CSV_ENCODING, CSV_FORMAT, OUTPUT_FORMATS, PARQUET_FORMAT, import_pyarrow
+
+WIDE_LAYOUT = 'wide'
+LONG_LAYOUT = 'long'
+OUTPUT_LAYOUTS = [WIDE_LAYOUT, LONG_LAYOUT]
+
+VARIABLE_ID = 'variable_id'
+VALUE = 'value'
+
+# Columns of the schema side-table describing the variable ids
+SCHEMA_COLUMNS = [VARIABLE_ID, 'column', 'layout', 'code', 'variable', 'level', 'aggregation', 'start_depth',
+                  'end_depth', 'unit', 'default_unit']
+CATEGORICAL_SCHEMA_COLUMNS = ['layout', 'variable', 'level', 'aggregation', 'unit', 'default_unit']
+
+
+class LongLayout:
+    """
+    Reshapes the result of a record from one column per variable into (id, date, variable_id, value) rows with NumPy,
+    without building a dataframe to melt. Missing values are left out, so sparse variables take no space, and the
+    rows keep their columns when a sub-query changes.
+    """
+
+    def __init__(self, code_registry: CodeRegistry, key_columns: list, dropped_columns: list,
+                 dates_col: str = None) -> None:
+        """
+        Instance of a LongLayout.
+        param code_registry: The CodeRegistry naming the variable columns, used for their schema ids.
+        param key_columns: The columns repeated on every row of a record, e.g. the ID column.
+        param dropped_columns: The columns left out of the long layout, e.g. the latitude and longitude.
+        param dates_col: The dates column, repeated for every variable, None for results without dates.
+        """
+        self.code_registry = code_registry
+        self.key_columns = key_columns
+        self.dropped_columns = dropped_columns
+        self.dates_col = dates_col
+        # the schema id of every variable column reshaped so far, in the order they were first seen
+        self.variable_ids: dict = {}
+        # the descriptions of the variables in the side-table of a previous run, by column name
+        self.loaded_descriptions: dict = {}
+
+    def variable_id(self, column_name: str) -> int:
+        variable_id = self.variable_ids.get(column_name)
+        if variable_id is None:
+            variable_id = self.code_registry.schema_id(column_name)
+            self.variable_ids[column_name] = variable_id
+        return variable_id
+
+    def to_long(self, response_dict: dict) -> dict:
+        """
+        Reshapes the result of a record, one variable after the other.
+        param response_dict: A dictionary of column names and scalar or list-like values of the same length.
+        :return: A dictionary of the key columns, the dates, the variable ids and the values.
+        """
+        skipped_columns: list = self.key_columns + self.dropped_columns + [self.dates_col]
+        value_columns: list = [column for column in response_dict if column not in skipped_columns]
+        value_arrays: list = [np.asarray(response_dict[column], dtype=np.float64).ravel() for column in value_columns]
+
+        variable_ids: np.ndarray = np.repeat(np.array([self.variable_id(column) for column in value_columns],
+                                                      dtype=np.int32), [len(value) for value in value_arrays])
+        values: np.ndarray = np.concatenate(value_arrays) if len(value_arrays) > 0 else np.empty(0)
+        present: np.ndarray = ~np.isnan(values)
+
+        long_dict: dict = {column: response_dict[column] for column in self.key_columns if column in response_dict}
+        if self.dates_col in response_dict:
+            long_dict[self.dates_col] = np.tile(np.asarray(response_dict[self.dates_col]), len(value_columns))[present]
+        long_dict[VARIABLE_ID] = variable_ids[present]
+        long_dict[VALUE] = values[present]
+        return long_dict
+
+    def load_schema(self, file_path: str, output_format: str = CSV_FORMAT):
+        """
+        Loads the side-table written by a previous run, which describes the variables whose values are resumed from a
+        checkpoint journal rather than decoded again.
+        param file_path: The path of the schema side-table without its extension.
+        param output_format: The output format of the run, the side-table of another format is loaded if the previous
+        run wrote another format.
+        :return: None
+        """
+        for schema_format in [output_format] + [other for other in OUTPUT_FORMATS if other != output_format]:
+            schema_file: str = f'{file_path}.{schema_format}'
+            if not os.path.exists(schema_file):
+                continue
+            if schema_format == PARQUET_FORMAT:
+                schema: pd.DataFrame = import_pyarrow().parquet.read_table(schema_file).to_pandas()
+            elif schema_format == ARROW_FORMAT:
+                schema = import_pyarrow().ipc.open_file(schema_file).read_pandas()
+            else:
+                schema = pd.read_csv(schema_file, encoding=CSV_ENCODING, keep_default_na=False)
+            for description in schema.to_dict('records'):
+                self.loaded_descriptions[description['column']] = description
+            return
+
+    def write_schema(self, file_path: str, output_format: str = CSV_FORMAT) -> str:
+        """
+        Writes the schema side-table in the output format, where the categorical columns are dictionary encoded in
+        Parquet and Arrow.
+        param file_path: The path of the schema side-table without its extension.
+        param output_format: One of OUTPUT_FORMATS.
+        :return: The path of the side-table.
+        """
+        schema_file: str = f'{file_path}.{output_format}'
+        schema: pd.DataFrame = self.schema_frame()
+        if output_format in [PARQUET_FORMAT, ARROW_FORMAT]:
+            pa = import_pyarrow()
+            table = pa.Table.from_pandas(schema, preserve_index=False)
+            if output_format == PARQUET_FORMAT:
+                pa.parquet.write_table(table, schema_file)
+            else:
+                with pa.ipc.new_file(schema_file, table.schema) as writer:
+                    writer.write_table(table)
+        else:
+            schema.to_csv(schema_file, index=False, encoding=CSV_ENCODING)
+        return schema_file
+
+    def schema_frame(self) -> pd.DataFrame:
+        """
+        Builds the schema side-table of the variables reshaped so far from the codes JSON file.
+        :return: A Pandas dataframe with one row per variable id, the descriptive columns are categorical.
+        """
+        descriptions: list = []
+        for column_name in self.variable_ids:
+            description: dict = self.code_registry.describe_column(column_name)
+            description[VARIABLE_ID] = description.pop('schema_id')
+            if 'code' not in description and column_name in self.loaded_descriptions:
+                description = self.loaded_descriptions[column_name]
+            descriptions.append(description)
+
+        schema: pd.DataFrame = pd.DataFrame(descriptions, columns=SCHEMA_COLUMNS)
+        for column in CATEGORICAL_SCHEMA_COLUMNS:
+            schema[column] = schema[column].astype('category')
+        return schema
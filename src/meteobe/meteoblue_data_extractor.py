@@ -1,4 +1,6 @@
 """Module to retrieve Meteoblue weather and soil data by using recommended best datasets"""
+import argparse
+import asyncio
 import pathlib
 import sys
 import pandas as pd
@@ -6,15 +8,34 @@ import json
 import time
 import os
 import warnings
-from datetime import timedelta, datetime
+from datetime import date, datetime
+
+import numpy as np
 
-import meteoblue_dataset_sdk
 from meteoblue_dataset_sdk.protobuf.dataset_pb2 import DatasetApiProtobuf
 
 __package__ = 'meteobe'
 import configurator
 from . import constants
+from . import input_loader
+from . import code_registry
+from . import query_compiler
+from . import request_planner
+from . import response_decoder
+from .checkpoint_journal import CheckpointJournal
+from .client_pool import DEFAULT_POOL_SIZE, MeteoBlueClientPool
 from .configurator import ConfigUtil
+from .input_loader import DEFAULT_INPUT_CHUNK_ROWS
+from .long_layout import LONG_LAYOUT, OUTPUT_LAYOUTS, WIDE_LAYOUT, LongLayout
+from .rate_limiter import DEFAULT_BURST, DEFAULT_INITIAL_CONCURRENCY, DEFAULT_LATENCY_SPIKE_FACTOR, \
+    DEFAULT_MIN_CONCURRENCY, DEFAULT_REQUESTS_PER_SECOND, AdaptiveRateLimiter, AimdConcurrencyController, TokenBucket
+from .response_cache import ResponseCache
+from .retry_policy import DEFAULT_BASE_DELAY_SECONDS, DEFAULT_MAX_ATTEMPTS, DEFAULT_MAX_DELAY_SECONDS, \
+    DEFAULT_REQUEST_DEADLINE_SECONDS, RetryPolicy
+from .result_sink import COUNTRY_CODE_PARTITION, CSV_FORMAT, DEFAULT_FLUSH_ROWS, DEFAULT_FLUSH_SECONDS, \
+    DEFAULT_PARQUET_COMPRESSION, OUTPUT_FORMATS, PARQUET_FORMAT, PARTITIONS, YEAR_PARTITION, ParquetOptions, \
+    ResultSink, open_result_sink
+from .tile_cache import TileCache, missing_range
 
 # data domains
 DOMAIN_NEMSGLOBAL = 'NEMSGLOBAL'
@@ -72,6 +93,19 @@ START_DEPTH_0 = 0
 END_DEPTH_30 = 30
 END_DEPTH_60 = 60
 
+# Execution modes
+EXECUTION_MODE_SYNC = 'sync'
+EXECUTION_MODE_ASYNC = 'async'
+DEFAULT_MAX_CONCURRENT_REQUESTS = 8
+DEFAULT_MAX_POINTS_PER_REQUEST = 50
+DEFAULT_COORDINATE_PRECISION = 4
+DEFAULT_CACHE_MAX_SIZE_MB = 2048
+CACHE_FILENAME = 'meteoblue_response_cache.sqlite'
+TILE_CACHE_FILENAME = 'meteoblue_tile_cache.sqlite'
+
+# Soil data does not change over time, every soil request is sent for this single day
+SOIL_REQUEST_DATE = '2020-01-01'
+
 # Time resolution
 TIME_RESOLUTION_DAILY = 'daily'
 TIME_RESOLUTION_HOURLY = 'hourly'
@@ -100,38 +134,47 @@ LEVEL = 'level'
 
 # Crop column names and shared with Weather data
 DATES = 'Dates'
+DATES_FORMAT = '%Y-%m-%d %H:%M:%S'
 
 # Temp columns
 START_DATE_COLUMN = 'Start_Date'
 END_DATE_COLUMN = 'End_Date'
+FAILED_DOMAIN_COLUMN = 'Failed_Domain'
+FAILURE_REASON_COLUMN = 'Failure_Reason'
 
 
 class MeteoBlueConnector:
     """Connecting to Meteoblue via REST API and retrieve data by user input parameters"""
 
     def __init__(self, key: str, id_col: str, lat_col: str, lon_col: str,
-                 country_code_col: str, codes_filename: str) -> None:
-        """Instance of a MeteoBlueConnector with user API key"""
+                 country_code_col: str, codes_filename: str, response_cache: ResponseCache = None,
+                 pool_size: int = DEFAULT_POOL_SIZE, retry_policy: RetryPolicy = None,
+                 rate_limiter: AdaptiveRateLimiter = None) -> None:
+        """
+        Instance of a MeteoBlueConnector with user API key, responses are cached if a response cache is given and
+        all requests share a pool of at most pool_size keep-alive connections. Failed requests are retried according
+        to the retry policy and every attempt waits for the rate limiter, both with their defaults if not given.
+        """
         self.key = key
         self.id_col = id_col
         self.lat_col = lat_col
         self.lon_col = lon_col
         self.country_code_col = country_code_col
-
-        with open(codes_filename) as file:
-            self.codes_lst = json.load(file)
-            print(
-                f'\nLoaded {len(self.codes_lst)} default unit, code and variable from Meteoblue JSON API '
-                f'\n{self.codes_lst}')
+        self.response_cache = response_cache
+        self.pool_size = pool_size
+        self.client_pool = None
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.rate_limiter = rate_limiter if rate_limiter is not None else AdaptiveRateLimiter()
+        self.query_templates: dict = {}
+
+        self.code_registry: code_registry.CodeRegistry = code_registry.load_code_registry(codes_filename)
+        self.codes_lst = self.code_registry.codes_lst
+        print(
+            f'\nLoaded {len(self.codes_lst)} default unit, code and variable from Meteoblue JSON API '
+            f'\n{self.codes_lst}')
 
     def lookup_variable_by_code(self, code: int) -> str:
-        variable: str = ''
-        for d in self.codes_lst:
-            if d['code'] == code:
-                variable = d['variable']
-            else:
-                continue
-        return variable
+        return self.code_registry.lookup_variable(code)
 
     @staticmethod
     def validate_col_names(col_names: list, data: pd.DataFrame):
@@ -153,7 +196,23 @@ class MeteoBlueConnector:
 
     @staticmethod
     def convert_timeinterval_to_list(start: int, end: int, stride: int) -> list:
-        return [datetime.fromtimestamp(n).strftime("%Y-%m-%d %H:%M:%S") for n in range(start, end, stride)]
+        return [datetime.fromtimestamp(n).strftime(DATES_FORMAT) for n in range(start, end, stride)]
+
+    @staticmethod
+    def resolve_best_domains(country_code: str, precipitation_domains: dict, temperature_domains: dict,
+                             wind_domains: dict) -> tuple:
+        """
+        Resolves the recommended best datasets for a country, falling back to the default datasets.
+        param country_code: ISO country code.
+        param precipitation_domains: The best precipitation dataset for a specific country.
+        param temperature_domains: The best temperature dataset for a specific country.
+        param wind_domains: The best wind dataset for a specific country
+        :return: A (precipitation, temperature, wind) domain tuple.
+        """
+        domain_precipitation = precipitation_domains.get(country_code, precipitation_domains.get(DEFAULT.upper()))
+        domain_temp = temperature_domains.get(country_code, temperature_domains.get(DEFAULT.upper()))
+        domain_wind = wind_domains.get(country_code, wind_domains.get(DEFAULT.upper()))
+        return domain_precipitation, domain_temp, domain_wind
 
     @staticmethod
     def build_weather_data_query_best_dataset(country_code: str, precipitation_domains: dict, temperature_domains: dict,
@@ -166,9 +225,8 @@ class MeteoBlueConnector:
         param wind_domains: The best wind dataset for a specific country
         :return: A weather JSON query.
         """
-        domain_precipitation = precipitation_domains.get(country_code, precipitation_domains.get(DEFAULT.upper()))
-        domain_temp = temperature_domains.get(country_code, temperature_domains.get(DEFAULT.upper()))
-        domain_wind = wind_domains.get(country_code, wind_domains.get(DEFAULT.upper()))
+        domain_precipitation, domain_temp, domain_wind = MeteoBlueConnector.resolve_best_domains(
+            country_code, precipitation_domains, temperature_domains, wind_domains)
         print(
             f'country <{country_code}> use precipitation domain <{domain_precipitation}>, temperature domain '
             f'<domain_temp>, wind <{domain_wind}>')
@@ -248,6 +306,31 @@ class MeteoBlueConnector:
 
         return weather_query
 
+    def weather_query_template(self, country_code: str, precipitation_domains: dict, temperature_domains: dict,
+                               wind_domains: dict, merge_queries: bool = True) -> query_compiler.QueryTemplate:
+        """
+        Gets the compiled weather query template of a country, built once per (precipitation, temperature, wind)
+        domain triple and shared by every country resolving to the same best domains.
+        param country_code: ISO country code.
+        param precipitation_domains: The best precipitation dataset for a specific country.
+        param temperature_domains: The best temperature dataset for a specific country.
+        param wind_domains: The best wind dataset for a specific country
+        param merge_queries: Merges the sub-queries of the same domain, see query_compiler.compile_queries.
+        :return: A query_compiler.QueryTemplate.
+        """
+        domains: tuple = self.resolve_best_domains(country_code, precipitation_domains, temperature_domains,
+                                                   wind_domains)
+        template: query_compiler.QueryTemplate = self.query_templates.get(domains + (merge_queries,))
+        if template is None:
+            template = self.query_template(self.build_weather_data_query_best_dataset(
+                country_code, precipitation_domains, temperature_domains, wind_domains), merge_queries)
+            self.query_templates[domains + (merge_queries,)] = template
+        return template
+
+    def query_template(self, queries: list, merge_queries: bool = True) -> query_compiler.QueryTemplate:
+        return query_compiler.QueryTemplate(query_compiler.compile_queries(queries, merge_queries),
+                                            self.build_json_payload)
+
     @staticmethod
     def build_soil_query(start_depth: int, end_depth: int) -> dict:
         """
@@ -337,13 +420,16 @@ class MeteoBlueConnector:
     def build_json_payload(lat, lon, start_date, end_date, queries):
         """
         Builds Meteoblue REST JSON payload by using the queries built from query building function.
-        param lat: The latitude of required weather data.
-        param lon: The longitude of required weather data.
+        param lat: The latitude of required weather data, or a list of latitudes for a MultiPoint request.
+        param lon: The longitude of required weather data, or a list of longitudes for a MultiPoint request.
         param start_date: The start date of interested data range.
         param end_date: The end date of interested data range.
         param queries: The query that contains interested weather/soil attributes.
         :return: Fully constructed JSON request ready to submit to Meteoblue REST API.
         """
+        lats: list = lat if isinstance(lat, list) else [lat]
+        lons: list = lon if isinstance(lon, list) else [lon]
+
         params = {
             "units": {
                 "temperature": "CELSIUS",
@@ -355,12 +441,12 @@ class MeteoBlueConnector:
                 "type": "MultiPoint",
                 "coordinates": [
                     [
-                        lon, lat,
-                    ]
+                        each_lon, each_lat,
+                    ] for each_lat, each_lon in zip(lats, lons)
                 ],
                 "locationNames": [
                     ""
-                ],
+                ] * len(lats),
                 "mode": "preferLandWithMatchingElevation"
             },
             "format": "json",
@@ -373,166 +459,906 @@ class MeteoBlueConnector:
 
         return params
 
-    def get_meteoblue_data(self, lat, lon, start_date, end_date, queries):
+    @staticmethod
+    def hash_request(lat, lon, start_date, end_date, queries) -> str:
         """
-        Sends Request to Meteoblue REST API.
+        Hashes the Meteoblue REST JSON payload of a request, e.g. to recognise requests completed by a previous run.
         param lat: The latitude of required weather data.
         param lon: The longitude of required weather data.
         param start_date: The start date of interested data range.
         param end_date: The end date of interested data range.
+        param queries: The query that contains interested weather/soil attributes.
+        :return: The hex digest of the canonical payload.
+        """
+        payload: dict = MeteoBlueConnector.build_json_payload(lat, lon, start_date, end_date, queries)
+        return ResponseCache.hash_payload(payload)
+
+    @staticmethod
+    def print_request(lat, lon, start_date, end_date):
+        if isinstance(lat, list):
+            print(f'Getting data for <{len(lat)}> geo locations for date range from <{start_date}> to <{end_date}>')
+        else:
+            print(
+                f'Getting data for geo location at latitude <{lat}> and longitude <{lon}> for date range from '
+                f'<{start_date}> to <{end_date}>')
+
+    def locate(self, data: pd.DataFrame, domains_per_row: list, grid_resolutions: dict, precision: int) -> list:
+        """
+        Gets the coordinates requested for each row, rounded or snapped to a representative location of their grid
+        cells if grid resolutions are given.
+        param data: The time data.
+        param domains_per_row: The domains of the queries of each row.
+        param grid_resolutions: The grid resolution in degrees of each upper case domain name, empty to only round.
+        param precision: The number of decimals the coordinates are rounded to.
+        :return: A (lat, lon) tuple for each row.
+        """
+        lats: list = data[self.lat_col].tolist()
+        lons: list = data[self.lon_col].tolist()
+        if len(grid_resolutions) > 0:
+            return request_planner.snap_to_grid_cells(lats, lons, domains_per_row, grid_resolutions, precision)
+        return [request_planner.round_coordinates(lat, lon, precision) for lat, lon in zip(lats, lons)]
+
+    def locate_domains(self, data: pd.DataFrame, domains_per_row: list, grid_resolutions: dict,
+                       precision: int) -> list:
+        """
+        Gets the coordinates requested for each domain of each row when its queries are requested on their own,
+        snapped to a representative location of the grid cell of each domain.
+        param data: The time data.
+        param domains_per_row: The domains of the queries of each row.
+        param grid_resolutions: The grid resolution in degrees of each upper case domain name.
+        param precision: The number of decimals the coordinates are rounded to.
+        :return: A dictionary of the (lat, lon) tuple of each domain, for each row.
+        """
+        return request_planner.snap_to_domain_grid_cells(data[self.lat_col].tolist(), data[self.lon_col].tolist(),
+                                                         domains_per_row, grid_resolutions, precision)
+
+    @staticmethod
+    def describe_request(lat, lon) -> str:
+        if isinstance(lat, list):
+            return f'<{len(lat)}> geo locations'
+        return f'geo location at latitude <{lat}> and longitude <{lon}>'
+
+    def get_client_pool(self) -> MeteoBlueClientPool:
+        if self.client_pool is None:
+            self.client_pool = MeteoBlueClientPool(self.key, self.pool_size)
+        return self.client_pool
+
+    def close(self):
+        """
+        Closes the connections to Meteoblue and prints how often they were reused.
+        :return: None
+        """
+        if self.client_pool is not None:
+            self.client_pool.close()
+            self.client_pool = None
+
+    def load_cached_response(self, payload: dict) -> tuple:
+        """
+        Looks up a payload in the response cache.
+        param payload: The payload built by build_json_payload.
+        :return: A (cache key, DatasetApiProtobuf object) tuple, the object is None if the payload is not cached.
+        """
+        if self.response_cache is None:
+            return None, None
+
+        cache_key: str = self.response_cache.hash_payload(payload)
+        data = self.response_cache.get(cache_key)
+        if data is None:
+            return cache_key, None
+
+        result = DatasetApiProtobuf()
+        result.ParseFromString(data)
+        return cache_key, result
+
+    def cache_response(self, cache_key: str, payload: dict, result: DatasetApiProtobuf):
+        if self.response_cache is not None and result is not None:
+            self.response_cache.set(cache_key, result.SerializeToString(), self.response_cache.ttl_for_payload(payload))
+
+    def get_meteoblue_data(self, lat, lon, start_date, end_date, queries):
+        """
+        Sends Request to Meteoblue REST API, unless the response is in the response cache. The request is sent on the
+        event loop of the client pool, the response cache is looked up and updated on the calling thread.
+        param lat: The latitude of required weather data, or a list of latitudes for a MultiPoint request.
+        param lon: The longitude of required weather data, or a list of longitudes for a MultiPoint request.
+        param start_date: The start date of interested data range.
+        param end_date: The end date of interested data range.
         param queries:
         :return: The response from Meteoblue.
         """
-        print(
-            f'Getting data for geo location at latitude <{lat}> and longitude <{lon}> for date range from '
-            f'<{start_date}> to <{end_date}>')
+        payload: dict = self.build_json_payload(lat, lon, start_date, end_date, queries)
+        cache_key, cached_result = self.load_cached_response(payload)
+        if cached_result is not None:
+            return cached_result
 
-        try:
-            client = meteoblue_dataset_sdk.Client(apikey=self.key)
-            result = client.query_sync(self.build_json_payload(lat, lon, start_date, end_date, queries))
+        result = self.get_client_pool().run(self.send_meteoblue_request(
+            lat, lon, start_date, end_date, payload, cache_key or ResponseCache.hash_payload(payload)))
+        self.cache_response(cache_key, payload, result)
+        return result
 
-            return result
+    async def send_meteoblue_request(self, lat, lon, start_date, end_date, payload: dict, request_hash: str):
+        """
+        Sends a payload to Meteoblue REST API on the event loop of the client pool, retrying it according to the retry
+        policy and waiting for the rate limiter before each attempt. The response cache is not used here because its
+        SQLite connection belongs to the thread that opened it, not to the event loop thread.
+        param lat: The latitude of required weather data, or a list of latitudes for a MultiPoint request.
+        param lon: The longitude of required weather data, or a list of longitudes for a MultiPoint request.
+        param start_date: The start date of interested data range.
+        param end_date: The end date of interested data range.
+        param payload: The payload built by build_json_payload.
+        param request_hash: The hash of the payload, under which a failure is recorded by the retry policy.
+        :return: The response from Meteoblue, or None if the request failed.
+        """
+        async def send_request():
+            self.print_request(lat, lon, start_date, end_date)
+            return await self.get_client_pool().query(payload)
 
-        except ConnectionError as ce:
-            print(f'Got connection error with exception {ce}')
-            time.sleep(10)
-        except Exception as exception:
-            print(
-                f'No coordinates was found for geo location at latitude <{lat}> and longitude <{lon}>, '
-                f'exception is {exception}')
+        async def send_once():
+            # the rate limiter slot is only held while the request is in flight, not while backing off before a retry
+            return await self.rate_limiter.run(send_request)
+
+        return await self.retry_policy.run(send_once, request_hash, self.describe_request(lat, lon))
+
+    def get_meteoblue_data_concurrently(self, requests: list) -> list:
+        """
+        Sends Requests to Meteoblue REST API concurrently, as many at the same time as the rate limiter allows. The
+        response cache is looked up before and updated after the requests are sent, on the calling thread.
+        param requests: A list of (lat, lon, start_date, end_date, queries) tuples.
+        :return: The responses from Meteoblue in the same order as the requests.
+        """
+        payloads: list = [self.build_json_payload(*request) for request in requests]
+        cached: list = [self.load_cached_response(payload) for payload in payloads]
+        missing: list = [index for index, (cache_key, cached_result) in enumerate(cached) if cached_result is None]
+
+        async def gather_responses() -> list:
+            return await asyncio.gather(*[
+                self.send_meteoblue_request(*requests[index][:4], payloads[index],
+                                            cached[index][0] or ResponseCache.hash_payload(payloads[index]))
+                for index in missing])
+
+        responses: list = [cached_result for cache_key, cached_result in cached]
+        for index, result in zip(missing, self.get_client_pool().run(gather_responses()) if missing else []):
+            self.cache_response(cached[index][0], payloads[index], result)
+            responses[index] = result
+        return responses
+
+    def get_meteoblue_data_in_bulk(self, requests: list, execution_mode: str) -> list:
+        """
+        Sends Requests to Meteoblue REST API one by one or concurrently depending on the execution mode.
+        param requests: A list of (lat, lon, start_date, end_date, queries) tuples.
+        param execution_mode: Either sync or async.
+        :return: The responses from Meteoblue in the same order as the requests.
+        """
+        if execution_mode == EXECUTION_MODE_ASYNC:
+            return self.get_meteoblue_data_concurrently(requests)
+
+        return [self.get_meteoblue_data(*request) for request in requests]
 
-    def convert_weather_json_to_dict(self, result: DatasetApiProtobuf, id_col: str, id_value: str) -> dict:
+    def get_meteoblue_data_by_plan(self, plan: list, row_count: int, execution_mode: str,
+                                   failure_reasons: list = None) -> list:
+        """
+        Sends the planned MultiPoint requests and splits the decoded responses back to the rows they were planned for,
+        the result of a location is fanned out to every row planned for it. A request of several locations that
+        Meteoblue rejected because of some of its locations is split in halves and sent again until the locations it
+        fails for are requested on their own, any other failure fails every location of the request at once.
+        param plan: A list of request_planner.PlannedRequest.
+        param row_count: The number of rows in the time data.
+        param execution_mode: Either sync or async.
+        param failure_reasons: A list of row_count elements receiving the reason of each failed row, if given.
+        :return: The response_decoder.LocationResult for each row, None for the rows that failed.
+        """
+        row_responses: list = [None] * row_count
+        while len(plan) > 0:
+            requests: list = [planned_request.as_request() for planned_request in plan]
+            responses: list = self.get_meteoblue_data_in_bulk(requests, execution_mode)
+            split_plan: list = []
+            for planned_request, request, response in zip(plan, requests, responses):
+                location_count: int = planned_request.location_count
+                if response is None and location_count > 1 and \
+                        self.retry_policy.rejected_locations(self.hash_request(*request)):
+                    split_plan.extend(planned_request.split())
+                    continue
+
+                reason: str = ''
+                try:
+                    location_responses: list = response_decoder.decode_locations(response, location_count)
+                    if response is None:
+                        reason = self.retry_policy.failure_reason(self.hash_request(*request)) or 'no response'
+                    elif location_responses[0] is None:
+                        reason = 'the response does not have one result per location'
+                except Exception as exception:
+                    print(f'Failed to decode the response for <{location_count}> geo locations with error: '
+                          f'<{exception}>')
+                    location_responses = [None] * location_count
+                    reason = f'decoding failed: {exception}'
+
+                for rows, location_response in zip(planned_request.location_rows, location_responses):
+                    for row_index in rows:
+                        row_responses[row_index] = location_response
+                        if failure_reasons is not None and location_response is None:
+                            failure_reasons[row_index] = reason
+
+            if len(split_plan) > 0:
+                print(f'<{len(split_plan) // 2}> requests were rejected because of their locations, which are '
+                      f'requested again in <{len(split_plan)}> smaller requests')
+            plan = split_plan
+
+        return row_responses
+
+    def get_meteoblue_data_by_query(self, locations: list, start_dates: list, end_dates: list, queries_per_row: list,
+                                    payload_hashes: list, row_indices: list, max_points: int,
+                                    execution_mode: str, query_hashes_per_row: list = None,
+                                    domain_locations: list = None) -> list:
+        """
+        Requests every query of a row on its own, so that each domain is sent, cached and retried independently of
+        the other domains of the row and a query shared by rows with different best domains is only requested once.
+        The queries of all rows sharing the same dates and query are packed into MultiPoint requests.
+        A row keeps the blocks of its successful queries, its failed queries are listed in its failed_queries.
+        param locations: The (lat, lon) tuple of each row.
+        param start_dates: The start date of each row.
+        param end_dates: The end date of each row.
+        param queries_per_row: The queries of each row.
+        param payload_hashes: The hash of the canonical payload of each row, rows with the same hash share a result.
+        param row_indices: The rows to fetch data for.
+        param max_points: The maximum number of locations in one request.
+        param execution_mode: Either sync or async.
+        param query_hashes_per_row: The hash of each query of each row, hashed here if not given.
+        param domain_locations: The (lat, lon) tuple of each domain of each row, snapped to the grid cell of the
+        domain, the location of the row is used for every query if not given.
+        :return: The response_decoder.LocationResult for each row, listing the queries that failed in failed_queries.
         """
-        Converts weather data REST response DatasetApiProtobuf object to dictionary.
+        if query_hashes_per_row is None:
+            query_hashes_per_row = [[ResponseCache.hash_payload(query) for query in queries]
+                                    for queries in queries_per_row]
+
+        # fetch units are (location, dates, query)
+        units: list = []
+        unit_indices: dict = {}
+        payload_units: dict = {}
+        for row_index in row_indices:
+            if payload_hashes[row_index] in payload_units:
+                continue
+
+            row_units: list = []
+            for query, query_hash in zip(queries_per_row[row_index], query_hashes_per_row[row_index]):
+                lat, lon = locations[row_index] if domain_locations is None else \
+                    domain_locations[row_index].get(query.get('domain'), locations[row_index])
+                key = (lat, lon, start_dates[row_index], end_dates[row_index], query_hash)
+                if key not in unit_indices:
+                    unit_indices[key] = len(units)
+                    units.append((lat, lon, start_dates[row_index], end_dates[row_index], query, query_hash))
+                row_units.append(unit_indices[key])
+            payload_units[payload_hashes[row_index]] = row_units
+
+        print(f'<{len(payload_units)}> distinct payloads are split into <{len(units)}> single query units')
+        plan: list = request_planner.plan_multipoint_requests([unit[0] for unit in units], [unit[1] for unit in units],
+                                                              [unit[2] for unit in units], [unit[3] for unit in units],
+                                                              [[unit[4]] for unit in units],
+                                                              [unit[5] for unit in units], max_points)
+        unit_failure_reasons: list = [''] * len(units)
+        unit_responses: list = self.get_meteoblue_data_by_plan(plan, len(units), execution_mode, unit_failure_reasons)
+
+        # the blocks of the successful queries are kept even if other queries of the row failed
+        payload_responses: dict = {}
+        for payload_hash, row_units in payload_units.items():
+            blocks: list = []
+            failed_queries: list = []
+            for unit_index in row_units:
+                response = unit_responses[unit_index]
+                if response is None:
+                    query: dict = units[unit_index][4]
+                    failed_queries.append(response_decoder.FailedQuery(query.get('domain'), units[unit_index][5],
+                                                                       unit_failure_reasons[unit_index]))
+                else:
+                    blocks.append(response.blocks[0].location_block(response.location))
+            payload_responses[payload_hash] = response_decoder.LocationResult(blocks, 0, failed_queries)
+
+        row_responses: list = [None] * len(locations)
+        for row_index in row_indices:
+            row_responses[row_index] = payload_responses.get(payload_hashes[row_index])
+        return row_responses
+
+    def get_meteoblue_data_by_tiles(self, tile_cache: TileCache, locations: list, start_dates: list, end_dates: list,
+                                    queries_per_row: list, payload_hashes: list, row_indices: list, max_points: int,
+                                    execution_mode: str, split_queries: bool = False,
+                                    query_hashes_per_row: list = None, domain_locations: list = None) -> list:
+        """
+        Fetches only the days that are not in the tile cache yet and stitches the cached and fresh day tiles of every
+        row into one time series per query. The missing days of a row and query are fetched as one date range, and
+        the ranges of all rows sharing the same dates and queries are packed into MultiPoint requests. Rows without
+        dates are not looked up and get no result.
+        param tile_cache: The tile cache.
+        param locations: The (lat, lon) tuple of each row.
+        param start_dates: The start date of each row.
+        param end_dates: The end date of each row.
+        param queries_per_row: The queries of each row.
+        param payload_hashes: The hash of the canonical payload of each row, rows with the same hash share a result.
+        param row_indices: The rows to fetch data for.
+        param max_points: The maximum number of locations in one request.
+        param execution_mode: Either sync or async.
+        param split_queries: Requests every query on its own instead of the queries missing the same days together.
+        param query_hashes_per_row: The hash of each query of each row, hashed here if not given.
+        param domain_locations: The (lat, lon) tuple of each domain of each row, snapped to the grid cell of the
+        domain, only given when split_queries is True. The location of the row is used for every query if not given.
+        :return: The response_decoder.LocationResult for each row, listing the queries that failed in failed_queries.
+        """
+        if query_hashes_per_row is None:
+            query_hashes_per_row = [[tile_cache.hash_query(query) for query in queries] for queries in queries_per_row]
+
+        def query_location(row_index: int, query: dict) -> tuple:
+            if domain_locations is None:
+                return locations[row_index]
+            return domain_locations[row_index].get(query.get('domain'), locations[row_index])
+
+        # fetch units are (location, missing date range, queries missing that range)
+        units: list = []
+        unit_indices: dict = {}
+        payload_rows: dict = {}
+        for row_index in row_indices:
+            if payload_hashes[row_index] in payload_rows or pd.isna(start_dates[row_index]) or \
+                    pd.isna(end_dates[row_index]):
+                continue
+            payload_rows[payload_hashes[row_index]] = row_index
+
+            first_day: int = start_dates[row_index].toordinal()
+            last_day: int = end_dates[row_index].toordinal()
+            range_queries: dict = {}
+            for query, query_hash in zip(queries_per_row[row_index], query_hashes_per_row[row_index]):
+                lat, lon = query_location(row_index, query)
+                cached_days: set = tile_cache.cached_days(tile_cache.location_key(lat, lon), query_hash, first_day,
+                                                          last_day)
+                day_range = missing_range(first_day, last_day, cached_days)
+                if day_range is not None:
+                    range_key: tuple = day_range + (lat, lon) + ((query_hash,) if split_queries else ())
+                    range_queries.setdefault(range_key, []).append((query_hash, query))
+
+            for range_key, hashed_queries in range_queries.items():
+                first_missing, last_missing, lat, lon = range_key[:4]
+                key = (tile_cache.location_key(lat, lon), first_missing, last_missing,
+                       tuple([h for h, q in hashed_queries]))
+                if key not in unit_indices:
+                    unit_indices[key] = len(units)
+                    units.append((lat, lon, first_missing, last_missing, hashed_queries))
+
+        print(f'<{len(payload_rows)}> distinct payloads need <{len(units)}> date ranges that are not in the tile cache')
+        plan: list = request_planner.plan_multipoint_requests(
+            [unit[0] for unit in units], [unit[1] for unit in units],
+            [date.fromordinal(unit[2]) for unit in units], [date.fromordinal(unit[3]) for unit in units],
+            [[query for query_hash, query in unit[4]] for unit in units],
+            [tuple([query_hash for query_hash, query in unit[4]]) for unit in units], max_points)
+        unit_failure_reasons: list = [''] * len(units)
+        unit_responses: list = self.get_meteoblue_data_by_plan(plan, len(units), execution_mode, unit_failure_reasons)
+
+        # blocks whose time steps do not split into days are used as they are
+        untiled_blocks: dict = {}
+        query_failure_reasons: dict = {}
+        for (lat, lon, first_missing, last_missing, hashed_queries), unit_response, reason in \
+                zip(units, unit_responses, unit_failure_reasons):
+            location_key: str = tile_cache.location_key(lat, lon)
+            if unit_response is None:
+                for query_hash, query in hashed_queries:
+                    query_failure_reasons[(location_key, query_hash)] = reason
+                continue
+            for (query_hash, query), block in zip(hashed_queries, unit_response.blocks):
+                if not tile_cache.store_block(location_key, query_hash, block, unit_response.location,
+                                              first_missing, last_missing):
+                    untiled_blocks[(location_key, query_hash, first_missing, last_missing)] = \
+                        block.location_block(unit_response.location)
+
+        payload_responses: dict = {}
+        for payload_hash, row_index in payload_rows.items():
+            first_day: int = start_dates[row_index].toordinal()
+            last_day: int = end_dates[row_index].toordinal()
+            blocks: list = []
+            failed_queries: list = []
+            for query, query_hash in zip(queries_per_row[row_index], query_hashes_per_row[row_index]):
+                location_key: str = tile_cache.location_key(*query_location(row_index, query))
+                block = untiled_blocks.get((location_key, query_hash, first_day, last_day))
+                if block is None:
+                    block = tile_cache.load_block(location_key, query_hash, first_day, last_day)
+                if block is None:
+                    reason: str = query_failure_reasons.get((location_key, query_hash)) or 'missing day tiles'
+                    failed_queries.append(response_decoder.FailedQuery(query.get('domain'), query_hash, reason))
+                else:
+                    blocks.append(block)
+            payload_responses[payload_hash] = response_decoder.LocationResult(blocks, 0, failed_queries)
+
+        row_responses: list = [None] * len(locations)
+        for row_index in row_indices:
+            row_responses[row_index] = payload_responses.get(payload_hashes[row_index])
+        return row_responses
 
-        param result: MeteoBlue response in DatasetApiProtobuf object.
+    def convert_weather_json_to_dict(self, result, id_col: str, id_value: str) -> dict:
+        """
+        Converts weather data REST response to dictionary, the values of each code are views on the NumPy block of
+        their geometry.
+
+        param result: MeteoBlue response in DatasetApiProtobuf object, or one location of a decoded response.
         param id_col: Any unique ID from the field file
         param id_value: The value of the unique ID
         :return: A dictionary with required key value pair.
         """
+        location_result: response_decoder.LocationResult = response_decoder.as_location_result(result)
+        location: int = location_result.location
         responses = {id_col: id_value}
 
         # geometry
-        for i in range(len(result.geometries)):
-            geometry = result.geometries[i]
-
-            responses[self.lat_col] = geometry.lats[0]
-            responses[self.lon_col] = geometry.lons[0]
+        for block in location_result.blocks:
+            responses[self.lat_col] = block.lats[location]
+            responses[self.lon_col] = block.lons[location]
 
             # dates
-            responses[DATES] = self.convert_timeinterval_to_list(geometry.timeIntervals[0].start,
-                                                                 geometry.timeIntervals[0].end,
-                                                                 geometry.timeIntervals[0].stride)
+            responses[DATES] = response_decoder.build_time_axis(block.start, block.end, block.stride)
 
             # codes
-            codes = geometry.codes
-            for j in range(len(codes)):
-                code: int = codes[j].code
-                var: str = self.lookup_variable_by_code(code)
-                agg: str = codes[j].aggregation
-                unit: str = codes[j].unit
-                responses[var.replace(' ', '_') + '_(' + ''.join([agg[0].upper(), agg[1:]]) + ')_(' + unit + ')'] = \
-                    codes[j].timeIntervals[0].data
+            values = block.location_values(location)
+            for j, code_info in enumerate(block.codes):
+                responses[self.code_registry.weather_column_name(code_info)] = values[:, j]
 
         return responses
 
-    def convert_soil_json_to_dict(self, result: DatasetApiProtobuf, id_col: str, id_value: str) -> dict:
+    def convert_soil_json_to_dict(self, result, id_col: str, id_value: str) -> dict:
         """
-        Converts soil data REST response DatasetApiProtobuf object to a dictionary.
-        param result: MeteoBlue response in DatasetApiProtobuf object.
+        Converts soil data REST response to a dictionary, the values of each code are views on the NumPy block of
+        their geometry.
+        param result: MeteoBlue response in DatasetApiProtobuf object, or one location of a decoded response.
         param id_col: Any unique ID from the field file
         param id_value: The value of the unique ID
         :return: A dictionary converted from response
         """
+        location_result: response_decoder.LocationResult = response_decoder.as_location_result(result)
+        location: int = location_result.location
 
         responses = {id_col: id_value}
-        for i in range(len(result.geometries)):
+        for block in location_result.blocks:
             # geometry
-            geometry = result.geometries[i]
-            responses[self.lat_col] = geometry.lats[0]
-            responses[self.lon_col] = geometry.lons[0]
+            responses[self.lat_col] = block.lats[location]
+            responses[self.lon_col] = block.lons[location]
 
             # codes
-            codes = geometry.codes
-            for j in range(len(codes)):
-                column_name: str
-                code: int = codes[j].code
-                var: str = self.lookup_variable_by_code(code)
-                unit: str = codes[j].unit
-
-                if codes[j].level == LVL_AGGREGATE:
-                    start_depth: int = codes[j].startDepth
-                    end_depth: int = codes[j].endDepth
-                    column_name = var.replace(' ', '_') + '_(' + str(start_depth) + '-' + str(
-                        end_depth) + ')_(' + unit + ')'
-                else:
-                    column_name = var.replace(' ', '_') + '_(' + codes[j].level + ')_(' + unit + ')'
-
-                responses[column_name] = codes[j].timeIntervals[0].data
+            values = block.location_values(location)
+            for j, code_info in enumerate(block.codes):
+                responses[self.code_registry.soil_column_name(code_info)] = values[:, j]
 
         return responses
 
     @staticmethod
     def load_data(input_file_dir: str, source_data_filename: str, sheet: str, add_on_cols: dict) -> pd.DataFrame:
         # Loads data into a dataframe, the crop type can be corn, grape etc.
-        file_name_path = pathlib.Path(__file__).resolve().parent.parent.joinpath(input_file_dir).joinpath(source_data_filename)
+        file_name_path = input_loader.input_file_path(input_file_dir, source_data_filename)
         print(f'Loading data from file: {file_name_path}... ')
+        return next(input_loader.iter_chunks(file_name_path, sheet, None, 0, add_on_cols))
 
-        if pathlib.Path(file_name_path).suffix == '.csv':
-            data = pd.read_csv(file_name_path)
-        else:
-            data = pd.read_excel(file_name_path, sheet_name=sheet)
-
-        counter = 0
-        for t in (add_on_cols.items()):
-            data.insert(counter, t[0], t[1])
-            counter += 1
-
-        return data
-
-    def time_data(self, df: pd, interested_dates_cols: list, start_date_offset, end_date_offset) -> pd:
+    def time_data(self, df: pd, interested_dates_cols: list, start_date_offset, end_date_offset,
+                  show_info: bool = True) -> pd:
         """
         Forming time data dataframe subset.
         param df: The dataframe of the input CSV file with geolocation information
         param interested_dates_cols: The date columns provided by the user.
         param start_date_offset: The start date offset provided by the user.
         param end_date_offset: The end date offset provided by the user.
+        param show_info: Prints the summary of the dataframe, e.g. only for the first chunk of a streamed file.
         :return: A Pandas dataframe.
         """
 
         joined_on_cols: list = [self.id_col, self.lat_col, self.lon_col, self.country_code_col]
-        start_end_cols: list = [START_DATE_COLUMN, END_DATE_COLUMN]
 
         # Converts the date columns to datetime for calculation
         self.convert_to_datetime(df, interested_dates_cols)
 
-        # Calculates offset dates from the dates_of_interest columns, and add them back to the dataframe
+        # Calculates offset dates from the dates_of_interest columns for all rows at once
         # This date will be used to extract the Meteoblue data.
-        df[START_DATE_COLUMN] = df.apply(
-            lambda x: min(x[interested_dates_cols]) + timedelta(days=start_date_offset), axis=1)
-        df[END_DATE_COLUMN] = df.apply(
-            lambda x: max(x[interested_dates_cols]) + timedelta(days=end_date_offset), axis=1)
+        start_dates, end_dates = request_planner.plan_time_windows(
+            df[interested_dates_cols].to_numpy(dtype='datetime64[ns]'), start_date_offset, end_date_offset)
 
-        df[START_DATE_COLUMN] = pd.to_datetime(df[START_DATE_COLUMN]).dt.date
-        df[END_DATE_COLUMN] = pd.to_datetime(df[END_DATE_COLUMN]).dt.date
+        df_with_time = df[joined_on_cols].copy()
+        df_with_time[START_DATE_COLUMN] = start_dates.astype(object)
+        df_with_time[END_DATE_COLUMN] = end_dates.astype(object)
+        df_with_time.drop_duplicates(inplace=True, ignore_index=True)
 
-        # Removes 'Unnamed' columns from the dataframe
-        df.drop(df.columns[df.columns.str.contains('Unnamed')], axis=1, inplace=True)
+        if show_info:
+            pd.set_option('display.max_rows', 100)
+            pd.set_option('display.max_columns', None)
+            df_with_time.info()
 
-        pd.set_option('display.max_rows', 100)
-        pd.set_option('display.max_columns', None)
+        return df_with_time
 
-        df.info()
 
-        df_with_time = df[joined_on_cols + start_end_cols]
-        df_with_time.drop_duplicates(inplace=True, ignore_index=True)
-        df_with_time.info()
+class RecordWriter:
+    """
+    Writes the results of the records of one kind of data, weather or soil, to its result sink and checkpoint journal,
+    and collects the failed records of every chunk for its failed file.
+    """
 
-        return df_with_time
+    def __init__(self, sink: ResultSink, journal: CheckpointJournal, layout: LongLayout = None,
+                 country_code_col: str = None) -> None:
+        """
+        Instance of a RecordWriter.
+        param sink: The result sink of the output file.
+        param journal: The checkpoint journal of the completed records.
+        param layout: The LongLayout the results are converted to, None to write them in the wide layout.
+        param country_code_col: The country code column added to the results, None unless the output is partitioned
+        by it.
+        """
+        self.sink = sink
+        self.journal = journal
+        self.layout = layout
+        self.country_code_col = country_code_col
+        self.failed_dfs: list = []
+        self.failed_record_count = 0
+        self.failure_count = 0
+
+    def write(self, record_id, record_hash: str, response_dict: dict, country_code: str = None,
+              journal: bool = True, failed_query_hashes: list = None):
+        """
+        Writes the result of a record to the result sink and journals it as completed.
+        param record_id: The ID of the record.
+        param record_hash: The hash of the request of the record.
+        param response_dict: The decoded result of the record.
+        param country_code: The country code of the record, only written if the output is partitioned by it.
+        param journal: False for a result that was read from the journal and is not journaled again.
+        param failed_query_hashes: The hashes of the queries of the record that failed, fetched again on resume.
+        :return: None
+        """
+        output_dict: dict = response_dict if self.country_code_col is None else \
+            {**response_dict, self.country_code_col: country_code}
+        self.sink.add(output_dict if self.layout is None else self.layout.to_long(output_dict))
+        if journal:
+            self.journal.record(record_id, record_hash, response_dict, failed_query_hashes)
 
+    def add_failures(self, time_df: pd.DataFrame, failed_rows: list, failures: list = None):
+        """
+        Collects the failures of a chunk.
+        param time_df: The records of the chunk.
+        param failed_rows: The positions of the records of the chunk without any result.
+        param failures: The failed (position, domain, reason) units of the chunk, written to the failed file with their
+        domain and reason, or None to write the failed records as they are.
+        :return: None
+        """
+        if failures is None:
+            self.failed_dfs.append(time_df.iloc[list(failed_rows)])
+            self.failure_count += len(failed_rows)
+        else:
+            self.failed_dfs.append(time_df.iloc[[row for row, domain, reason in failures]].assign(
+                **{FAILED_DOMAIN_COLUMN: [domain for row, domain, reason in failures],
+                   FAILURE_REASON_COLUMN: [reason for row, domain, reason in failures]}))
+            self.failure_count += len(failures)
+        self.failed_record_count += len(failed_rows)
 
-def extract():
+    def failed_df(self) -> pd.DataFrame:
+        """
+        Gets the failures collected over all chunks.
+        :return: A Pandas dataframe of the failed records.
+        """
+        if len(self.failed_dfs) == 0:
+            return pd.DataFrame()
+        return pd.concat(self.failed_dfs, ignore_index=True)
 
+    def close(self) -> int:
+        """
+        Closes the journal and the result sink.
+        :return: The number of rows written.
+        """
+        self.journal.close()
+        return self.sink.close()
+
+
+class ChunkExtractor:
+    """
+    Requests, decodes and writes the weather and soil data of the input records one chunk at a time, keeping what the
+    chunks of a run share: the query templates, the records already requested and the writers.
+    """
+
+    def __init__(self, mb: MeteoBlueConnector, weather_writer: RecordWriter, soil_writer: RecordWriter,
+                 soil_template: query_compiler.QueryTemplate, weather_template: query_compiler.QueryTemplate = None,
+                 best_domains: tuple = None, split_queries: bool = False, execution_mode: str = EXECUTION_MODE_SYNC,
+                 max_points: int = DEFAULT_MAX_POINTS_PER_REQUEST,
+                 coordinate_precision: int = DEFAULT_COORDINATE_PRECISION, grid_resolutions: dict = None,
+                 tile_cache: TileCache = None, weather_column_order: code_registry.ColumnOrder = None) -> None:
+        """
+        Instance of a ChunkExtractor.
+        param mb: The MeteoBlueConnector sending the requests.
+        param weather_writer: The RecordWriter of the weather data.
+        param soil_writer: The RecordWriter of the soil data.
+        param soil_template: The query template of the soil data.
+        param weather_template: The query template of the weather data of every record, e.g. loaded from
+        weather_request.json, or None to use the template of the best domains of the country of each record.
+        param best_domains: The (precipitation, temperature, wind) best domains of the countries.
+        param split_queries: Requests, caches and retries the weather query of every domain on its own.
+        param execution_mode: EXECUTION_MODE_SYNC or EXECUTION_MODE_ASYNC.
+        param max_points: The maximum number of locations packed into one MultiPoint request.
+        param coordinate_precision: The number of decimals coordinates are rounded to.
+        param grid_resolutions: The grid resolution of the domains locations are snapped to, empty to round them.
+        param tile_cache: The TileCache of the weather data, None to request every day.
+        param weather_column_order: The ColumnOrder of the wide weather output, the queries of every new template are
+        added to it.
+        """
+        self.mb = mb
+        self.weather_writer = weather_writer
+        self.soil_writer = soil_writer
+        self.soil_template = soil_template
+        self.weather_template = weather_template
+        self.best_domains: tuple = best_domains
+        self.split_queries = split_queries
+        self.execution_mode = execution_mode
+        self.max_points = max_points
+        self.coordinate_precision = coordinate_precision
+        self.grid_resolutions: dict = grid_resolutions if grid_resolutions is not None else {}
+        self.tile_cache = tile_cache
+        self.weather_column_order = weather_column_order
+
+        self.described_templates: set = set()
+        # A record whose payload was already requested for its ID, e.g. in an earlier chunk, is neither requested nor
+        # written again, as the whole file is deduplicated at once
+        self.seen_weather_records: set = set()
+        self.seen_soil_records: set = set()
+
+    def valid_locations(self, time_df: pd.DataFrame) -> list:
+        """
+        Tells which records can be requested, a single invalid location would make Meteoblue reject the whole
+        MultiPoint request it is packed into.
+        param time_df: The records of a chunk.
+        :return: A list of booleans, one per record.
+        """
+        return [request_planner.valid_coordinates(lat, lon) for lat, lon in
+                zip(time_df[self.mb.lat_col].tolist(), time_df[self.mb.lon_col].tolist())]
+
+    def weather_templates(self, time_df: pd.DataFrame) -> list:
+        """
+        Gets the weather query template of every record and describes the templates that are new to the run.
+        Sub-queries of the same domain are merged and duplicate codes removed once per template, the template of a
+        country is shared by every country resolving to the same best domains. Queries requested on their own are not
+        merged, so that each of them is shared by every country requesting it.
+        param time_df: The records of a chunk.
+        :return: A list of query_compiler.QueryTemplate, one per record.
+        """
+        weather_templates: list = []
+        for country_code in time_df[self.mb.country_code_col]:
+            weather_template = self.weather_template
+            if weather_template is None:
+                weather_template = self.mb.weather_query_template(country_code, *self.best_domains,
+                                                                  not self.split_queries)
+            weather_templates.append(weather_template)
+        for weather_template in dict.fromkeys(weather_templates):
+            if weather_template not in self.described_templates:
+                print(f'Weather {weather_template.compiled.describe()}')
+                self.described_templates.add(weather_template)
+                if self.weather_column_order is not None:
+                    self.weather_column_order.add_queries(weather_template.queries)
+        return weather_templates
+
+    def process_weather_chunk(self, time_df: pd.DataFrame):
+        """
+        Requests the weather data of the records of a chunk that are not completed yet, and writes the results and
+        failures of every record of the chunk that was not written by an earlier chunk.
+        A record keeps the columns of the domains that succeeded, one failed (record, domain) unit is reported per
+        domain that did not, and a record that could not be requested or extracted at all is reported once without a
+        domain.
+        param time_df: The records of the chunk with their start and end dates, see MeteoBlueConnector.time_data.
+        :return: None
+        """
+        mb: MeteoBlueConnector = self.mb
+        journal: CheckpointJournal = self.weather_writer.journal
+        # The fetch stages iterate plain columns rather than indexing the dataframe one value at a time
+        record_ids: list = time_df[mb.id_col].tolist()
+        country_codes: list = time_df[mb.country_code_col].tolist()
+        start_dates: list = time_df[START_DATE_COLUMN].tolist()
+        end_dates: list = time_df[END_DATE_COLUMN].tolist()
+        weather_templates: list = self.weather_templates(time_df)
+
+        # Coordinates are rounded, or snapped to their grid cells, so that records at the same location share one
+        # canonical payload and are requested once
+        weather_locations: list = mb.locate(time_df, [weather_template.domains for weather_template in
+                                                      weather_templates], self.grid_resolutions,
+                                            self.coordinate_precision)
+        weather_hashes: list = [weather_template.hash_request(*weather_location, start_date, end_date)
+                                for weather_template, weather_location, start_date, end_date in
+                                zip(weather_templates, weather_locations, start_dates, end_dates)]
+        # Queries requested on their own are snapped to the grid cells of their own domain, so that a coarse domain
+        # is requested once per coarse cell
+        weather_domain_locations = None
+        if self.split_queries and len(self.grid_resolutions) > 0:
+            weather_domain_locations = mb.locate_domains(time_df, [weather_template.domains for weather_template in
+                                                                   weather_templates], self.grid_resolutions,
+                                                         self.coordinate_precision)
+        # Records that can not be requested are reported as failed instead, a record without any date of interest has
+        # no time window
+        weather_failure_reasons: list = [
+            'invalid coordinates' if not valid_location else
+            'missing dates' if pd.isna(start_date) or pd.isna(end_date) else ''
+            for valid_location, start_date, end_date in zip(self.valid_locations(time_df), start_dates, end_dates)]
+        # Records journaled with failed queries only fetch these queries again
+        weather_fetch_queries: list = []
+        weather_fetch_query_hashes: list = []
+        weather_fetch_hashes: list = []
+        weather_fetch_keys: list = []
+        pending_weather_rows: list = []
+        repeated_weather_rows: set = set()
+        for weather_counter in range(len(time_df)):
+            weather_template: query_compiler.QueryTemplate = weather_templates[weather_counter]
+            fetch_queries: list = weather_template.queries
+            fetch_query_hashes: list = weather_template.query_hashes
+            fetch_hash: str = weather_hashes[weather_counter]
+            fetch_key = weather_template
+            weather_id = record_ids[weather_counter]
+            weather_record: tuple = (weather_id, weather_hashes[weather_counter])
+            if weather_record in self.seen_weather_records:
+                repeated_weather_rows.add(weather_counter)
+            elif not journal.is_completed(weather_id, weather_hashes[weather_counter]):
+                pending_weather_rows.append(weather_counter)
+            else:
+                failed_query_hashes: list = journal.get_failed_queries(weather_id, weather_hashes[weather_counter])
+                if len(failed_query_hashes) > 0:
+                    fetch_queries = [query for query, query_hash in zip(weather_template.queries,
+                                                                        weather_template.query_hashes)
+                                     if query_hash in failed_query_hashes]
+                    fetch_query_hashes = [query_hash for query_hash in weather_template.query_hashes
+                                          if query_hash in failed_query_hashes]
+                    fetch_hash = mb.hash_request(*weather_locations[weather_counter], start_dates[weather_counter],
+                                                 end_dates[weather_counter], fetch_queries)
+                    fetch_key = (weather_template, tuple(fetch_query_hashes))
+                    pending_weather_rows.append(weather_counter)
+            self.seen_weather_records.add(weather_record)
+            weather_fetch_queries.append(fetch_queries)
+            weather_fetch_query_hashes.append(fetch_query_hashes)
+            weather_fetch_hashes.append(fetch_hash)
+            weather_fetch_keys.append(fetch_key)
+        requested_weather_rows: list = [weather_counter for weather_counter in pending_weather_rows
+                                        if not weather_failure_reasons[weather_counter]]
+
+        if self.tile_cache is not None:
+            weather_responses: list = mb.get_meteoblue_data_by_tiles(self.tile_cache, weather_locations, start_dates,
+                                                                     end_dates, weather_fetch_queries,
+                                                                     weather_fetch_hashes, requested_weather_rows,
+                                                                     self.max_points, self.execution_mode,
+                                                                     self.split_queries, weather_fetch_query_hashes,
+                                                                     weather_domain_locations)
+        elif self.split_queries:
+            weather_responses: list = mb.get_meteoblue_data_by_query(weather_locations, start_dates, end_dates,
+                                                                     weather_fetch_queries, weather_fetch_hashes,
+                                                                     requested_weather_rows, self.max_points,
+                                                                     self.execution_mode, weather_fetch_query_hashes,
+                                                                     weather_domain_locations)
+        else:
+            weather_plan: list = request_planner.plan_multipoint_requests([lat for lat, lon in weather_locations],
+                                                                          [lon for lat, lon in weather_locations],
+                                                                          start_dates, end_dates,
+                                                                          weather_fetch_queries, weather_fetch_keys,
+                                                                          self.max_points, requested_weather_rows,
+                                                                          weather_fetch_hashes)
+            weather_responses: list = mb.get_meteoblue_data_by_plan(weather_plan, len(time_df), self.execution_mode,
+                                                                    weather_failure_reasons)
+
+        weather_failures: list = []
+        failed_weather_rows: list = []
+        pending_weather_row_set: set = set(pending_weather_rows)
+        requested_weather_row_set: set = set(requested_weather_rows)
+        for weather_counter, weather_response in enumerate(weather_responses):
+            # the decoded blocks of a record are released once it has been added
+            weather_responses[weather_counter] = None
+            if weather_counter in repeated_weather_rows:
+                continue
+            weather_id = record_ids[weather_counter]
+            fetch_queries: list = weather_fetch_queries[weather_counter]
+            fetch_query_hashes: list = weather_fetch_query_hashes[weather_counter]
+            failed_queries: list = []
+            record_failure_reason: str = ''
+            try:
+                response_dict = journal.get(weather_id, weather_hashes[weather_counter])
+                is_journaled = response_dict is not None
+                if is_journaled:
+                    response_dict[DATES] = np.array(response_dict[DATES], dtype='datetime64[s]')
+                is_updated = weather_counter in pending_weather_row_set
+                if is_updated:
+                    if weather_counter not in requested_weather_row_set:
+                        record_failure_reason = weather_failure_reasons[weather_counter]
+                        weather_response = response_decoder.LocationResult([], 0, [])
+                    elif weather_response is None:
+                        weather_response = response_decoder.LocationResult(
+                            [], 0, [response_decoder.FailedQuery(query.get('domain'), query_hash,
+                                                                 weather_failure_reasons[weather_counter] or
+                                                                 'no response')
+                                    for query, query_hash in zip(fetch_queries, fetch_query_hashes)])
+                    failed_queries = weather_response.failed_queries
+                    if len(weather_response.blocks) == 0:
+                        is_updated = False
+                    elif is_journaled:
+                        fetched_dict: dict = mb.convert_weather_json_to_dict(weather_response, mb.id_col, weather_id)
+                        response_dict.update({column: values for column, values in fetched_dict.items()
+                                              if column != DATES})
+                    else:
+                        response_dict = mb.convert_weather_json_to_dict(weather_response, mb.id_col, weather_id)
+
+                if response_dict is None:
+                    failed_weather_rows.append(weather_counter)
+                else:
+                    self.weather_writer.write(weather_id, weather_hashes[weather_counter], response_dict,
+                                              country_codes[weather_counter], is_updated,
+                                              [failed_query.query_hash for failed_query in failed_queries])
+            except Exception as exe:
+                print(f"Failed to extract weather data for latitude <{time_df[mb.lat_col].iat[weather_counter]}> "
+                      f"and longitude <{time_df[mb.lon_col].iat[weather_counter]}> with error: <{exe}>")
+                failed_weather_rows.append(weather_counter)
+                failed_queries = []
+                record_failure_reason = f'extraction failed: {exe}'
+
+            if record_failure_reason:
+                weather_failures.append((weather_counter, '', record_failure_reason))
+            for domain, reason in response_decoder.failed_domains(failed_queries):
+                weather_failures.append((weather_counter, domain, reason))
+
+        self.weather_writer.add_failures(time_df, failed_weather_rows, weather_failures)
+        print(f'<{len(failed_weather_rows)}> out of <{len(time_df)}> records failed to extract weather data from '
+              f'Meteoblue, <{len(weather_failures)}> (record, domain) units failed')
+
+    def process_soil_chunk(self, time_df: pd.DataFrame):
+        """
+        Requests the soil data of the records of a chunk that are not completed yet, once per location regardless of
+        the dates, and writes the results and failures of every record of the chunk that was not written by an earlier
+        chunk.
+        param time_df: The records of the chunk.
+        :return: None
+        """
+        mb: MeteoBlueConnector = self.mb
+        journal: CheckpointJournal = self.soil_writer.journal
+        record_ids: list = time_df[mb.id_col].tolist()
+        country_codes: list = time_df[mb.country_code_col].tolist()
+        valid_locations: list = self.valid_locations(time_df)
+
+        failed_soil_rows: list = []
+        soil_locations: list = mb.locate(time_df, [self.soil_template.domains] * len(time_df), self.grid_resolutions,
+                                         self.coordinate_precision)
+        soil_hashes: list = [self.soil_template.hash_request(*soil_location, SOIL_REQUEST_DATE, SOIL_REQUEST_DATE)
+                             for soil_location in soil_locations]
+        repeated_soil_rows: set = set()
+        for soil_counter in range(len(time_df)):
+            soil_record: tuple = (record_ids[soil_counter], soil_hashes[soil_counter])
+            if soil_record in self.seen_soil_records:
+                repeated_soil_rows.add(soil_counter)
+            self.seen_soil_records.add(soil_record)
+        # Records with invalid coordinates are reported as failed without being requested
+        pending_soil_rows: list = [soil_counter for soil_counter in range(len(time_df))
+                                   if soil_counter not in repeated_soil_rows and valid_locations[soil_counter] and
+                                   not journal.is_completed(record_ids[soil_counter], soil_hashes[soil_counter])]
+
+        soil_plan: list = request_planner.plan_soil_requests([lat for lat, lon in soil_locations],
+                                                             [lon for lat, lon in soil_locations],
+                                                             SOIL_REQUEST_DATE, SOIL_REQUEST_DATE,
+                                                             self.soil_template.queries, self.max_points,
+                                                             self.coordinate_precision, pending_soil_rows)
+        soil_responses: list = mb.get_meteoblue_data_by_plan(soil_plan, len(time_df), self.execution_mode)
+        for soil_counter, soil_response in enumerate(soil_responses):
+            soil_responses[soil_counter] = None
+            if soil_counter in repeated_soil_rows:
+                continue
+            if not valid_locations[soil_counter]:
+                print(f"Skipped soil data for invalid latitude <{time_df[mb.lat_col].iat[soil_counter]}> "
+                      f"and longitude <{time_df[mb.lon_col].iat[soil_counter]}>")
+                failed_soil_rows.append(soil_counter)
+                continue
+            try:
+                response_dict = journal.get(record_ids[soil_counter], soil_hashes[soil_counter])
+                is_journaled = response_dict is not None
+                if not is_journaled:
+                    response_dict = mb.convert_soil_json_to_dict(soil_response, mb.id_col, record_ids[soil_counter])
+                self.soil_writer.write(record_ids[soil_counter], soil_hashes[soil_counter], response_dict,
+                                       country_codes[soil_counter], not is_journaled)
+            except Exception as exe:
+                print(f"Failed to extract soil data for latitude <{time_df[mb.lat_col].iat[soil_counter]}> "
+                      f"and longitude <{time_df[mb.lon_col].iat[soil_counter]}> with error: <{exe}>")
+                failed_soil_rows.append(soil_counter)
+
+        self.soil_writer.add_failures(time_df, failed_soil_rows)
+        print(f'<{len(failed_soil_rows)}> out of <{len(time_df)}> records failed to extract soil data from Meteoblue')
+
+
+def extract(resume: bool = False):
+    """
+    Extracts weather and soil data from Meteoblue for the input file configured in the ini file.
+    param resume: Skips the records completed by the previous run, as recorded in its checkpoint journals.
+    :return: None
+    """
+
+    started_at: float = time.monotonic()
     config: ConfigUtil = ConfigUtil(constants.INI_FILE)
     print(f'========== Loading property data from ini file {constants.INI_FILE} ==========')
 
@@ -555,6 +1381,20 @@ def extract():
     source_filename = config.get_property(constants.FILE_PATHS_SECTION, constants.SOURCE_DATA_FILENAME)
     sheet_name = config.get_property(constants.FILE_PATHS_SECTION, constants.SHEET_NAME)
 
+    # Loads the output format, results are appended to the output files in batches while they arrive
+    output_format = config.get_property(constants.FILE_PATHS_SECTION, constants.OUTPUT_FORMAT, CSV_FORMAT)
+    if output_format not in OUTPUT_FORMATS:
+        print(f'output_format should be one of {OUTPUT_FORMATS}, use {CSV_FORMAT} now instead of {output_format}')
+        output_format = CSV_FORMAT
+    # Results are written with one column per variable (wide) or one row per date and variable (long)
+    output_layout = config.get_property(constants.FILE_PATHS_SECTION, constants.OUTPUT_LAYOUT, WIDE_LAYOUT)
+    if output_layout not in OUTPUT_LAYOUTS:
+        print(f'output_layout should be one of {OUTPUT_LAYOUTS}, use {WIDE_LAYOUT} now instead of {output_layout}')
+        output_layout = WIDE_LAYOUT
+    flush_rows = int(config.get_property(constants.FILE_PATHS_SECTION, constants.FLUSH_ROWS, str(DEFAULT_FLUSH_ROWS)))
+    flush_seconds = float(config.get_property(constants.FILE_PATHS_SECTION, constants.FLUSH_SECONDS,
+                                              str(DEFAULT_FLUSH_SECONDS)))
+
     # Creating output file paths
     data_file_name = os.path.splitext(source_filename)[0]
     data_file_name_path = pathlib.Path(__file__).resolve().parent.parent.joinpath(output_dir).joinpath(data_file_name)
@@ -573,6 +1413,22 @@ def extract():
     lon_column = config.get_property(constants.METEOBLUE_SECTION, constants.LONGITUDE_COL)
     country_code_column = config.get_property(constants.METEOBLUE_SECTION, constants.COUNTRY_CODE_COL)
 
+    # Loads the encoding of Parquet output, which can be partitioned by country code and year
+    partition_by: list = [partition.strip() for partition in
+                          config.get_property(constants.FILE_PATHS_SECTION, constants.PARTITION_BY, '').split(',')
+                          if partition.strip() != '']
+    for partition in [partition for partition in partition_by if partition not in PARTITIONS]:
+        print(f'partition_by should only contain {PARTITIONS}, ignore {partition} now')
+        partition_by.remove(partition)
+    if len(partition_by) > 0 and output_format != PARQUET_FORMAT:
+        print(f'partition_by is only used by {PARQUET_FORMAT} output, ignore it now for {output_format} output')
+        partition_by = []
+    parquet_options: ParquetOptions = ParquetOptions(
+        config.get_property(constants.FILE_PATHS_SECTION, constants.PARQUET_COMPRESSION, DEFAULT_PARQUET_COMPRESSION),
+        config.get_property(constants.FILE_PATHS_SECTION, constants.PARQUET_FLOAT32, 'y') == 'y',
+        [lat_column, lon_column], DATES,
+        [country_code_column if partition == COUNTRY_CODE_PARTITION else YEAR_PARTITION for partition in partition_by])
+
     # Check if start_date_offset > 0 set to = 0, if end_date_offset < 0 set to 0,
     # any dates in between start and end dates are already covered!
     if s_date_offset > 0:
@@ -582,6 +1438,85 @@ def extract():
         print(f'end_date_offset should be set to more than 0, use 0 now instead of {e_date_offset}')
         e_date_offset = 0
 
+    # Loading execution mode, requests are sent one by one (sync) or concurrently (async)
+    execution_mode = config.get_property(constants.METEOBLUE_SECTION, constants.EXECUTION_MODE, EXECUTION_MODE_SYNC)
+    max_concurrency = int(config.get_property(constants.METEOBLUE_SECTION, constants.MAX_CONCURRENT_REQUESTS,
+                                              str(DEFAULT_MAX_CONCURRENT_REQUESTS)))
+    if execution_mode not in [EXECUTION_MODE_SYNC, EXECUTION_MODE_ASYNC]:
+        print(f'execution_mode should be either {EXECUTION_MODE_SYNC} or {EXECUTION_MODE_ASYNC}, '
+              f'use {EXECUTION_MODE_SYNC} now instead of {execution_mode}')
+        execution_mode = EXECUTION_MODE_SYNC
+    if max_concurrency < 1:
+        print(f'max_concurrent_requests should be at least 1, use 1 now instead of {max_concurrency}')
+        max_concurrency = 1
+
+    # Loading the maximum number of locations packed into one MultiPoint request
+    max_points = int(config.get_property(constants.METEOBLUE_SECTION, constants.MAX_POINTS_PER_REQUEST,
+                                         str(DEFAULT_MAX_POINTS_PER_REQUEST)))
+    if max_points < 1:
+        print(f'max_points_per_request should be at least 1, use 1 now instead of {max_points}')
+        max_points = 1
+
+    # Loading the maximum number of keep-alive connections shared by all requests
+    pool_size = int(config.get_property(constants.METEOBLUE_SECTION, constants.CONNECTION_POOL_SIZE,
+                                        str(DEFAULT_POOL_SIZE)))
+
+    # Loading whether the weather queries of a record are requested, cached and retried per domain
+    split_queries = config.get_property(constants.METEOBLUE_SECTION, constants.SPLIT_QUERIES_BY_DOMAIN, 'n') == 'y'
+
+    # Loading the number of decimals coordinates are rounded to before locations are compared
+    coordinate_precision = int(config.get_property(constants.METEOBLUE_SECTION, constants.COORDINATE_PRECISION,
+                                                   str(DEFAULT_COORDINATE_PRECISION)))
+
+    # Loading response cache settings, cached responses are reused until their domain's time to live expires
+    response_cache = None
+    if config.get_property(constants.RESPONSE_CACHE_SECTION, constants.CACHE_ENABLED, 'n') == 'y':
+        cache_file = config.get_property(constants.RESPONSE_CACHE_SECTION, constants.CACHE_FILE, '')
+        if not cache_file:
+            cache_file = str(data_file_name_path.parent.joinpath(CACHE_FILENAME))
+        cache_max_size_mb = float(config.get_property(constants.RESPONSE_CACHE_SECTION, constants.CACHE_MAX_SIZE_MB,
+                                                      str(DEFAULT_CACHE_MAX_SIZE_MB)))
+        cache_ttl_days: dict = config.get_section_properties(constants.CACHE_TTL_DAYS)
+        response_cache = ResponseCache(cache_file, int(cache_max_size_mb * 1024 * 1024), cache_ttl_days)
+
+    # Loading tile cache settings, weather data is kept per location, query and day so that only the missing days
+    # are fetched
+    tile_cache = None
+    if config.get_property(constants.TILE_CACHE_SECTION, constants.CACHE_ENABLED, 'n') == 'y':
+        tile_cache_file = config.get_property(constants.TILE_CACHE_SECTION, constants.CACHE_FILE, '')
+        if not tile_cache_file:
+            tile_cache_file = str(data_file_name_path.parent.joinpath(TILE_CACHE_FILENAME))
+        tile_cache = TileCache(tile_cache_file, config.get_section_properties(constants.CACHE_TTL_DAYS))
+
+    # Loading the retry policy, throttled, timed out and server errors are retried with exponential backoff
+    retry_policy: RetryPolicy = RetryPolicy(
+        int(config.get_property(constants.RETRY_SECTION, constants.RETRY_MAX_ATTEMPTS, str(DEFAULT_MAX_ATTEMPTS))),
+        float(config.get_property(constants.RETRY_SECTION, constants.RETRY_BASE_DELAY_SECONDS,
+                                  str(DEFAULT_BASE_DELAY_SECONDS))),
+        float(config.get_property(constants.RETRY_SECTION, constants.RETRY_MAX_DELAY_SECONDS,
+                                  str(DEFAULT_MAX_DELAY_SECONDS))),
+        float(config.get_property(constants.RETRY_SECTION, constants.REQUEST_DEADLINE_SECONDS,
+                                  str(DEFAULT_REQUEST_DEADLINE_SECONDS))))
+
+    # Loading the rate limiter, requests are paced by a token bucket and their concurrency is lowered on throttling,
+    # server errors and latency spikes and raised again while Meteoblue is healthy
+    adaptive_concurrency = config.get_property(constants.RATE_LIMIT_SECTION, constants.ADAPTIVE_CONCURRENCY, 'y') == 'y'
+    initial_concurrency = int(config.get_property(constants.RATE_LIMIT_SECTION, constants.INITIAL_CONCURRENT_REQUESTS,
+                                                  str(DEFAULT_INITIAL_CONCURRENCY)))
+    min_concurrency = int(config.get_property(constants.RATE_LIMIT_SECTION, constants.MIN_CONCURRENT_REQUESTS,
+                                              str(DEFAULT_MIN_CONCURRENCY)))
+    latency_spike_factor = float(config.get_property(constants.RATE_LIMIT_SECTION, constants.LATENCY_SPIKE_FACTOR,
+                                                      str(DEFAULT_LATENCY_SPIKE_FACTOR)))
+    requests_per_second = float(config.get_property(constants.RATE_LIMIT_SECTION, constants.REQUESTS_PER_SECOND,
+                                                    str(DEFAULT_REQUESTS_PER_SECOND)))
+    burst = int(config.get_property(constants.RATE_LIMIT_SECTION, constants.BURST, str(DEFAULT_BURST)))
+    if execution_mode == EXECUTION_MODE_SYNC:
+        max_concurrency = initial_concurrency = min_concurrency = 1
+    rate_limiter: AdaptiveRateLimiter = AdaptiveRateLimiter(
+        TokenBucket(requests_per_second, burst),
+        AimdConcurrencyController(initial_concurrency, min_concurrency, max_concurrency, latency_spike_factor,
+                                  adaptive_concurrency))
+
     # Loading user selected date columns
     user_interested_date_cols: list = config.get_property(constants.METEOBLUE_SECTION,
                                                           constants.USER_INTERESTED_DATE_COLS).split(',')
@@ -591,92 +1526,159 @@ def extract():
     temperature_dom: dict = config.get_all_keys_properties(constants.BEST_TEMPERATURE_DOMAINS)
     wind_dom: dict = config.get_all_keys_properties(constants.BEST_WIND_DOMAINS)
 
+    # Loading the native grid resolution of the domains, locations in the same grid cells are requested once
+    grid_snapping = config.get_property(constants.METEOBLUE_SECTION, constants.GRID_SNAPPING, 'n') == 'y'
+    grid_resolutions: dict = {}
+    if grid_snapping:
+        grid_resolutions = {domain.upper(): float(resolution) for domain, resolution in
+                            config.get_section_properties(constants.DOMAIN_GRID_RESOLUTIONS).items()}
+
     internal_cols: dict = {}
     if not bool(country_code_column and country_code_column.strip()):
         print('No country_code column is specified')
         country_code_column = 'country_code'  # internal value, doesn't matter what it is
         internal_cols[country_code_column] = 'BR'  # TODO this can not be hardcoded
 
+    # Loading the number of input rows read at once, the requests of a chunk are sent before the next one is read
+    input_chunk_rows = int(config.get_property(constants.FILE_PATHS_SECTION, constants.INPUT_CHUNK_ROWS,
+                                               str(DEFAULT_INPUT_CHUNK_ROWS)))
+    # Loading whether an xlsx sheet is converted to Parquet next to the workbook, which is read instead next time
+    input_cache = config.get_property(constants.FILE_PATHS_SECTION, constants.INPUT_CACHE, 'y') == 'y'
+    required_cols: list = list(dict.fromkeys([id_column, lat_column, lon_column, country_code_column]
+                                             + user_interested_date_cols))
+
     print(f'\n=========== Validating column headers ==========')
-    data_df = MeteoBlueConnector.load_data(input_dir, source_filename, sheet_name, internal_cols)
-    MeteoBlueConnector.validate_col_names([id_column, lat_column, lon_column, country_code_column]
-                                          + user_interested_date_cols, data_df)
+    input_file: pathlib.Path = input_loader.input_file_path(input_dir, source_filename)
+    if input_chunk_rows > 0:
+        print(f'Streaming data from file: {input_file} in chunks of <{input_chunk_rows}> rows... ')
+    else:
+        print(f'Loading data from file: {input_file}... ')
+    MeteoBlueConnector.validate_col_names(required_cols, pd.DataFrame(
+        columns=list(internal_cols) + input_loader.read_column_names(input_file, sheet_name)))
+    # Only the columns needed to request Meteoblue are parsed, the IDs and dates as text like pandas does
+    data_chunks = input_loader.iter_chunks(input_file, sheet_name,
+                                           [col for col in required_cols if col not in internal_cols],
+                                           input_chunk_rows, internal_cols,
+                                           text_cols=[id_column, country_code_column] + user_interested_date_cols,
+                                           float_cols=[lat_column, lon_column], cache=input_cache)
 
     print(f'\n=========== Loading {source_filename} {sheet_name} into dataframe ==========')
     mb: MeteoBlueConnector = MeteoBlueConnector(api_key, id_column, lat_column, lon_column,
-                                                country_code_column, codes_file)
-    time_df: pd.DataFrame = mb.time_data(data_df, user_interested_date_cols, s_date_offset, e_date_offset)
-
-    # Getting weather data from Meteoblue
-    print(f'\n=========== Getting Weather Data from Meteoblue ==========')
-    weather_df: pd.DataFrame = pd.DataFrame()
-    failed_weather_df: pd.DataFrame = time_df.copy()
+                                                country_code_column, codes_file, response_cache, pool_size,
+                                                retry_policy, rate_limiter)
+    # The results get the country code of their record when the output is partitioned by it
+    partition_by_country: bool = country_code_column in parquet_options.partition_cols
+    # In the long layout the variables are described by a schema side-table instead of the column names
+    key_columns: list = [id_column, country_code_column] if partition_by_country else [id_column]
+    weather_layout: LongLayout = LongLayout(mb.code_registry, key_columns, [lat_column, lon_column], DATES) \
+        if output_layout == LONG_LAYOUT else None
+    soil_layout: LongLayout = LongLayout(mb.code_registry, key_columns, [lat_column, lon_column]) \
+        if output_layout == LONG_LAYOUT else None
+    if resume and output_layout == LONG_LAYOUT:
+        weather_layout.load_schema(str(data_file_name_path) + '_weather_data_only_best_domains_schema', output_format)
+        soil_layout.load_schema(str(data_file_name_path) + '_soil_data_only_schema', output_format)
+
+    # Rows of IDs with several records may be duplicated across records and are deduplicated when written, the IDs
+    # are added chunk by chunk, including the IDs of earlier chunks that come up again
+    shared_ids: set = set()
+    seen_ids: set = set()
+    # The wide columns are written in the order of the codes of the query templates, whichever record arrives first
+    weather_column_order = None if output_layout == LONG_LAYOUT else code_registry.ColumnOrder(
+        mb.code_registry, code_registry.WEATHER_LAYOUT, [id_column, lat_column, lon_column, DATES])
+    soil_column_order = None if output_layout == LONG_LAYOUT else code_registry.ColumnOrder(
+        mb.code_registry, code_registry.SOIL_LAYOUT, [id_column, lat_column, lon_column])
+    weather_sink: ResultSink = open_result_sink(output_format,
+                                                str(data_file_name_path) + '_weather_data_only_best_domains',
+                                                flush_rows, flush_seconds, shared_ids, id_column, DATES_FORMAT,
+                                                parquet_options, weather_column_order)
+    soil_sink: ResultSink = open_result_sink(output_format, str(data_file_name_path) + '_soil_data_only', flush_rows,
+                                             flush_seconds, shared_ids, id_column, parquet_options=parquet_options,
+                                             column_order=soil_column_order)
 
     load_w_file = input("Load weather json from weather_request.json file? type y/n: ")
-    weather_queries = None
+    loaded_weather_template = None
     if load_w_file == 'y':
-        weather_queries = MeteoBlueConnector.load_json_from_file(weather_request_file)
-    for weather_counter in range(len(time_df)):
-        if load_w_file == 'n':
-            weather_queries = mb.build_weather_data_query_best_dataset(time_df[mb.country_code_col][weather_counter],
-                                                                       precipitation_dom,
-                                                                       temperature_dom, wind_dom)
-
-        weather_response = mb.get_meteoblue_data(time_df[mb.lat_col][weather_counter],
-                                                 time_df[mb.lon_col][weather_counter],
-                                                 time_df[START_DATE_COLUMN][weather_counter],
-                                                 time_df[END_DATE_COLUMN][weather_counter],
-                                                 weather_queries)
-        try:
-            response_dict = mb.convert_weather_json_to_dict(weather_response, id_column,
-                                                            time_df[mb.id_col][weather_counter])
-            each_field_df = pd.DataFrame(response_dict)
-            weather_df = weather_df.append(each_field_df, ignore_index=True)
-            failed_weather_df.drop([weather_counter], axis=0, inplace=True)
-        except Exception as exe:
-            print(f"Failed to extract weather data for latitude <{time_df[mb.lat_col][weather_counter]}> "
-                  f"and longitude <{time_df[mb.lon_col][weather_counter]}> with error: <{exe}>")
-
-    print(f'<{len(failed_weather_df)}> out of <{len(time_df)}> records failed to extract weather data from Meteoblue')
-    weather_df.info()
-
-    # Getting Soil data from Meteoblue
-    print(f'\n=========== Getting Soil Data from Meteoblue ==========')
-    soil_df: pd.DataFrame = pd.DataFrame()
-    failed_soil_df: pd.DataFrame = time_df.copy()
+        loaded_weather_template = mb.query_template(MeteoBlueConnector.load_json_from_file(weather_request_file),
+                                                    not split_queries)
 
     load_s_file = input("Load soil json from soil_request.json file? type y/n: ")
     if load_s_file == 'y':
-        soil_queries = MeteoBlueConnector.load_json_from_file(soil_request_file)
+        soil_template = mb.query_template(MeteoBlueConnector.load_json_from_file(soil_request_file))
     else:
-        soil_queries = [mb.build_soil_query(START_DEPTH_0, END_DEPTH_30),
-                        mb.build_soil_query(START_DEPTH_0, END_DEPTH_60)]
-
-    for soil_counter in range(len(time_df)):
-        soil_response = mb.get_meteoblue_data(time_df[mb.lat_col][soil_counter],
-                                              time_df[mb.lon_col][soil_counter],
-                                              time_df[START_DATE_COLUMN][soil_counter],
-                                              time_df[END_DATE_COLUMN][soil_counter],
-                                              soil_queries)
-        try:
-            response_dict = mb.convert_soil_json_to_dict(soil_response, id_column, time_df[mb.id_col][soil_counter])
-            each_field_df = pd.DataFrame(response_dict)
-            soil_df = soil_df.append(each_field_df, ignore_index=True)
-            failed_soil_df.drop([soil_counter], axis=0, inplace=True)
-        except Exception as exe:
-            print(f"Failed to extract soil data for latitude <{time_df[mb.lat_col][soil_counter]}> "
-                  f"and longitude <{time_df[mb.lon_col][soil_counter]}> with error: <{exe}>")
-
-    print(f'<{len(failed_soil_df)}> out of <{len(time_df)}> records failed to extract soil data from Meteoblue')
-    soil_df.info()
+        soil_template = mb.query_template([mb.build_soil_query(START_DEPTH_0, END_DEPTH_30),
+                                           mb.build_soil_query(START_DEPTH_0, END_DEPTH_60)])
+    print(f'Soil {soil_template.compiled.describe()}')
+    if soil_column_order is not None:
+        soil_column_order.add_queries(soil_template.queries)
+
+    # Skips the records completed by the previous run
+    weather_journal: CheckpointJournal = CheckpointJournal(str(data_file_name_path) + '_weather_checkpoint.jsonl',
+                                                           resume)
+    soil_journal: CheckpointJournal = CheckpointJournal(str(data_file_name_path) + '_soil_checkpoint.jsonl', resume)
+
+    # Weather and soil records are written, journaled and reported as failed the same way
+    output_country_code_col: str = country_code_column if partition_by_country else None
+    weather_writer: RecordWriter = RecordWriter(weather_sink, weather_journal, weather_layout, output_country_code_col)
+    soil_writer: RecordWriter = RecordWriter(soil_sink, soil_journal, soil_layout, output_country_code_col)
+    chunk_extractor: ChunkExtractor = ChunkExtractor(mb, weather_writer, soil_writer, soil_template,
+                                                     loaded_weather_template,
+                                                     (precipitation_dom, temperature_dom, wind_dom), split_queries,
+                                                     execution_mode, max_points, coordinate_precision,
+                                                     grid_resolutions, tile_cache, weather_column_order)
+
+    record_count: int = 0
+    for chunk_counter, data_df in enumerate(data_chunks):
+        time_df: pd.DataFrame = mb.time_data(data_df, user_interested_date_cols, s_date_offset, e_date_offset,
+                                             chunk_counter == 0)
+        del data_df
+        if input_chunk_rows > 0:
+            print(f'\n=========== Requesting chunk <{chunk_counter}> of <{len(time_df)}> records ==========')
+        record_count += len(time_df)
+        chunk_ids: pd.Series = time_df[mb.id_col]
+        shared_ids.update(chunk_ids[chunk_ids.duplicated(keep=False) | chunk_ids.isin(seen_ids)])
+        seen_ids.update(chunk_ids)
+
+        # Getting weather data from Meteoblue
+        print(f'\n=========== Getting Weather Data from Meteoblue ==========')
+        chunk_extractor.process_weather_chunk(time_df)
+
+        # Getting Soil data from Meteoblue
+        print(f'\n=========== Getting Soil Data from Meteoblue ==========')
+        chunk_extractor.process_soil_chunk(time_df)
+
+    weather_row_count: int = weather_writer.close()
+    failed_weather_df: pd.DataFrame = weather_writer.failed_df()
+    soil_row_count: int = soil_writer.close()
+    failed_soil_df: pd.DataFrame = soil_writer.failed_df()
+    if input_chunk_rows > 0:
+        print(f'\n<{weather_writer.failed_record_count}> out of <{record_count}> records failed to extract weather '
+              f'data from Meteoblue, <{weather_writer.failure_count}> (record, domain) units failed')
+        print(f'<{soil_writer.failed_record_count}> out of <{record_count}> records failed to extract soil data from '
+              f'Meteoblue')
+    print(f'<{weather_row_count}> rows of <{len(weather_sink.columns)}> weather columns are written in '
+          f'<{weather_sink.batch_count}> batches')
+    print(f'<{soil_row_count}> rows of <{len(soil_sink.columns)}> soil columns are written in '
+          f'<{soil_sink.batch_count}> batches')
+
+    mb.close()
+    if response_cache is not None:
+        response_cache.close()
+    if tile_cache is not None:
+        tile_cache.close()
+    retry_policy.print_summary()
+    if retry_policy.first_request_at is not None:
+        print(f'The first request was sent <{retry_policy.first_request_at - started_at:.1f}> seconds after the start')
+    rate_limiter.print_metrics()
 
     print(f'\n\n========== Writing Weather Data to {output_dir}{os.path.sep} ==========')
-    if len(weather_df) == 0:
+    if weather_row_count == 0:
         print('No weather data was retrieved from Meteoblue, please check connections or API key')
     else:
-        weather_df.drop_duplicates().to_csv(str(data_file_name_path) + '_weather_data_only_best_domains.csv', index=False,
-                                            header=weather_df.columns, encoding='UTF-8-sig')
-        print(f"Finished writing {str(data_file_name_path) + '_weather_data_only_best_domains.csv'}")
+        print(f"Finished writing {weather_sink.file_path}")
+        if weather_layout is not None:
+            schema_file: str = weather_layout.write_schema(
+                str(data_file_name_path) + '_weather_data_only_best_domains_schema', output_format)
+            print(f"Finished writing {schema_file}")
 
     if len(failed_weather_df) > 0:
         failed_weather_df.drop_duplicates().to_csv(str(data_file_name_path) + '_weather_data_only_best_domains_failed.csv',
@@ -684,18 +1686,28 @@ def extract():
         print(f"Finished writing {str(data_file_name_path) + '_weather_data_only_best_domains_failed.csv'} file")
 
     print(f'\n========== Writing Soil Data to {output_dir}{os.path.sep} ==========')
-    if len(soil_df) == 0:
+    if soil_row_count == 0:
         print('No soil data was retrieved from Meteoblue, please check connections or API key')
     else:
-        soil_df.drop_duplicates().to_csv(str(data_file_name_path) + '_soil_data_only.csv', index=False,
-                                         header=soil_df.columns, encoding='UTF-8-sig')
-        print(f"Finished writing {str(data_file_name_path) + '_soil_data_only.csv'}")
+        print(f"Finished writing {soil_sink.file_path}")
+        if soil_layout is not None:
+            schema_file = soil_layout.write_schema(str(data_file_name_path) + '_soil_data_only_schema',
+                                                   output_format)
+            print(f"Finished writing {schema_file}")
 
     if len(failed_soil_df) > 0:
-        failed_weather_df.drop_duplicates().to_csv(str(data_file_name_path) + '_soil_data_only_failed.csv',
-                                                   index=False, header=failed_soil_df.columns, encoding='UTF-8-sig')
+        failed_soil_df.drop_duplicates().to_csv(str(data_file_name_path) + '_soil_data_only_failed.csv',
+                                                index=False, header=failed_soil_df.columns, encoding='UTF-8-sig')
         print(f"Finished writing {str(data_file_name_path) + '_soil_data_only_failed.csv'} file")
 
+    if len(retry_policy.records) > 0:
+        pd.DataFrame(retry_policy.records_as_dicts()).to_csv(str(data_file_name_path) + '_request_log.csv',
+                                                             index=False, encoding='UTF-8-sig')
+        print(f"Finished writing {str(data_file_name_path) + '_request_log.csv'} file")
+
 
 if __name__ == "__main__":
-    extract()
+    parser = argparse.ArgumentParser(description='Extracts weather and soil data from Meteoblue')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip the records completed by the previous run and only fetch what is missing')
+    extract(parser.parse_args().resume)
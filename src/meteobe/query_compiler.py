@@ -0,0 +1,155 @@
+"""Module to merge Meteoblue sub-queries of the same domain and remove duplicate codes before they are requested"""
+__package__ = 'meteobe'
+
+import hashlib
+import json
+import re
+
+CODES = 'codes'
+DOMAIN = 'domain'
+
+# Placeholders of the values inserted into the pre-serialised payload of a query template
+LAT_MARKER = '@lat@'
+LON_MARKER = '@lon@'
+START_DATE_MARKER = '@start_date@'
+END_DATE_MARKER = '@end_date@'
+
+
+def merge_key(query: dict) -> str:
+    """
+    Gets the key of the settings two sub-queries must share to be merged, i.e. everything but their codes, e.g. the
+    domain, timeResolution, gapFillDomain and transformations. Domains are compared regardless of case because the
+    best domains are read from the ini file, whose keys are lower case.
+    param query: A sub-query.
+    :return: A canonical JSON string.
+    """
+    settings: dict = {key: value for key, value in query.items() if key != CODES}
+    if isinstance(settings.get(DOMAIN), str):
+        settings[DOMAIN] = settings[DOMAIN].upper()
+    return json.dumps(settings, sort_keys=True)
+
+
+def code_key(code: dict) -> str:
+    return json.dumps(code, sort_keys=True)
+
+
+def canonical_json(value) -> str:
+    """Serialises a payload independently of key order and formatting, as hashed by ResponseCache.hash_payload"""
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), default=str)
+
+
+def hash_canonical_json(canonical: str) -> str:
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class CompiledQueries:
+    """Merged and deduplicated sub-queries and the sub-queries each of them was compiled from"""
+
+    def __init__(self, queries: list, source_indices: list, removed_codes: int, dropped_indices: list = None) -> None:
+        """
+        Instance of CompiledQueries.
+        param queries: The compiled sub-queries.
+        param source_indices: The indices of the original sub-queries merged into each compiled sub-query.
+        param removed_codes: The number of duplicate codes removed.
+        param dropped_indices: The indices of the original sub-queries left without any code, which are not requested.
+        """
+        self.queries = queries
+        self.source_indices = source_indices
+        self.removed_codes = removed_codes
+        self.dropped_indices = dropped_indices or []
+
+    @property
+    def source_query_count(self) -> int:
+        return sum([len(indices) for indices in self.source_indices]) + len(self.dropped_indices)
+
+    def describe(self) -> str:
+        return (f'<{self.source_query_count}> sub-queries are compiled into <{len(self.queries)}> queries and '
+                f'<{self.removed_codes}> duplicate codes are removed')
+
+
+def compile_queries(queries: list, merge: bool = True) -> CompiledQueries:
+    """
+    Merges consecutive sub-queries sharing the same domain, time resolution and transformations into one sub-query
+    and removes the codes already requested with the same level, aggregation and depths. Only consecutive sub-queries
+    are merged so that the codes keep their order and the decoded columns keep their names and order, a duplicate
+    code would only have overwritten the column of its first occurrence.
+    param queries: The sub-queries of a request, e.g. loaded from weather_request.json or soil_request.json.
+    param merge: Merges the sub-queries, otherwise every sub-query is kept as its own query and only the codes already
+    requested by a previous sub-query of the same settings are removed. Queries requested on their own are kept apart
+    so that the same sub-query, e.g. the NEMSGLOBAL base query, has the same hash whatever the other domains are.
+    Sub-queries left without any code are dropped.
+    :return: CompiledQueries.
+    """
+    compiled: list = []
+    source_indices: list = []
+    seen_codes: dict = {}
+    removed_codes: int = 0
+    last_key = None
+
+    for index, query in enumerate(queries):
+        key: str = merge_key(query)
+        if key != last_key or not merge:
+            compiled.append({name: value for name, value in query.items() if name != CODES})
+            compiled[-1][CODES] = []
+            source_indices.append([])
+            if key != last_key and merge:
+                seen_codes[key] = set()
+            last_key = key
+        source_indices[-1].append(index)
+
+        codes_seen: set = seen_codes.setdefault(key, set())
+        for code in query.get(CODES, []):
+            if code_key(code) in codes_seen:
+                removed_codes += 1
+                continue
+            codes_seen.add(code_key(code))
+            compiled[-1][CODES].append(code)
+
+    # a query whose codes were all requested by previous ones would be sent, cached and reported as failed for nothing
+    kept: list = [index for index, query in enumerate(compiled) if len(query[CODES]) > 0]
+    dropped_indices: list = [source_index for index, indices in enumerate(source_indices) if index not in kept
+                             for source_index in indices]
+    return CompiledQueries([compiled[index] for index in kept], [source_indices[index] for index in kept],
+                           removed_codes, dropped_indices)
+
+
+class QueryTemplate:
+    """
+    Compiled sub-queries shared by every row using them, with the canonical payload pre-serialised into fragments so
+    that hashing the request of a row only inserts its coordinates and dates. The fragments are only used to hash the
+    rows, the payloads sent to Meteoblue are built by build_payload once per MultiPoint request, which packs the
+    locations of several rows, and refer to the compiled sub-queries of the template rather than copies of them.
+    """
+
+    def __init__(self, compiled: CompiledQueries, build_payload) -> None:
+        """
+        Instance of a QueryTemplate.
+        param compiled: The compiled sub-queries.
+        param build_payload: The function building the payload of a request, MeteoBlueConnector.build_json_payload.
+        """
+        self.compiled = compiled
+        self.queries: list = compiled.queries
+        self.domains: list = [query.get(DOMAIN) for query in self.queries]
+        self.query_hashes: list = [hash_canonical_json(canonical_json(query)) for query in self.queries]
+
+        canonical: str = canonical_json(build_payload(LAT_MARKER, LON_MARKER, START_DATE_MARKER, END_DATE_MARKER,
+                                                      self.queries))
+        # the markers are kept in the fragments, at odd indices
+        self.fragments: list = re.split('(' + '|'.join([re.escape(json.dumps(LAT_MARKER)),
+                                                        re.escape(json.dumps(LON_MARKER)),
+                                                        re.escape(START_DATE_MARKER),
+                                                        re.escape(END_DATE_MARKER)]) + ')', canonical)
+
+    def hash_request(self, lat, lon, start_date, end_date) -> str:
+        """
+        Hashes the payload of a single location request, same as hashing the payload built with build_payload.
+        param lat: The latitude of the location.
+        param lon: The longitude of the location.
+        param start_date: The start date of interested data range.
+        param end_date: The end date of interested data range.
+        :return: The hex digest of the canonical payload.
+        """
+        values: dict = {json.dumps(LAT_MARKER): json.dumps(lat, default=str),
+                        json.dumps(LON_MARKER): json.dumps(lon, default=str),
+                        START_DATE_MARKER: f'{start_date}', END_DATE_MARKER: f'{end_date}'}
+        return hash_canonical_json(''.join([values.get(fragment, fragment) for fragment in self.fragments]))
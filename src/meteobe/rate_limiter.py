@@ -0,0 +1,206 @@
+"""Module to pace the requests sent to Meteoblue and tune their concurrency from the responses of the server"""
+__package__ = 'meteobe'
+
+import asyncio
+import time
+
+from .retry_policy import SERVER_ERROR, THROTTLED, classify_error
+
+DEFAULT_REQUESTS_PER_SECOND = 10.0
+DEFAULT_BURST = 10
+DEFAULT_MIN_CONCURRENCY = 1
+DEFAULT_INITIAL_CONCURRENCY = 4
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_LATENCY_SPIKE_FACTOR = 3.0
+
+# Multiplicative decrease of the concurrency limit on throttling, server errors and latency spikes
+DECREASE_FACTOR = 0.5
+# Weight of the latest latency in the moving average latency
+LATENCY_SMOOTHING = 0.2
+# Number of successful requests needed before latency spikes are detected
+LATENCY_WARMUP_REQUESTS = 5
+
+
+class TokenBucket:
+    """Token bucket allowing bursts of up to capacity requests and rate requests per second on average"""
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        """
+        Instance of a TokenBucket, starting full.
+        param rate: The number of tokens added per second, 0 for no rate limit.
+        param capacity: The maximum number of tokens.
+        """
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+
+    def refill(self):
+        now: float = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        """
+        Takes one token, waiting until one has been added if the bucket is empty.
+        :return: None
+        """
+        if self.rate <= 0:
+            return
+        self.refill()
+        while self.tokens < 1:
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+            self.refill()
+        self.tokens -= 1
+
+
+class AimdConcurrencyController:
+    """
+    Concurrency limit raised additively by about one per round trip while Meteoblue is healthy and cut
+    multiplicatively on throttling, server errors and latency spikes
+    """
+
+    def __init__(self, initial_limit: int = DEFAULT_INITIAL_CONCURRENCY, min_limit: int = DEFAULT_MIN_CONCURRENCY,
+                 max_limit: int = DEFAULT_MAX_CONCURRENCY, latency_spike_factor: float = DEFAULT_LATENCY_SPIKE_FACTOR,
+                 adaptive: bool = True) -> None:
+        """
+        Instance of an AimdConcurrencyController.
+        param initial_limit: The concurrency limit of the first requests.
+        param min_limit: The lowest concurrency limit.
+        param max_limit: The highest concurrency limit.
+        param latency_spike_factor: A response slower than this factor times the moving average latency is a spike.
+        param adaptive: Keeps the concurrency limit at max_limit if False.
+        """
+        self.min_limit = max(min_limit, 1)
+        self.max_limit = max(max_limit, self.min_limit)
+        self.adaptive = adaptive
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit) if adaptive else self.max_limit)
+        self.latency_spike_factor = latency_spike_factor
+
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.average_latency = None
+        self.successes = 0
+        self.last_decrease_at = 0.0
+        self.increases = 0
+        self.decreases = 0
+        self.throttled = 0
+        self.server_errors = 0
+        self.latency_spikes = 0
+
+        # created on first use so that it belongs to the event loop of the requests
+        self.condition = None
+
+    async def acquire(self):
+        """
+        Waits until the number of requests in flight is below the concurrency limit and counts one more.
+        :return: None
+        """
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    async def release(self, latency: float, error_class: str = None):
+        """
+        Counts one request less in flight and adjusts the concurrency limit to its outcome.
+        param latency: The seconds the request took.
+        param error_class: The retry_policy error class of the request, None if it succeeded.
+        :return: None
+        """
+        async with self.condition:
+            self.in_flight -= 1
+            if error_class == THROTTLED:
+                self.throttled += 1
+                self.decrease(error_class)
+            elif error_class == SERVER_ERROR:
+                self.server_errors += 1
+                self.decrease(error_class)
+            elif error_class is None:
+                self.on_success(latency)
+            self.condition.notify_all()
+
+    def on_success(self, latency: float):
+        self.successes += 1
+        if self.average_latency is not None and self.successes > LATENCY_WARMUP_REQUESTS \
+                and latency > self.latency_spike_factor * self.average_latency:
+            self.latency_spikes += 1
+            self.decrease('latency spike')
+        elif self.adaptive and self.limit < self.max_limit:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.increases += 1
+
+        if self.average_latency is None:
+            self.average_latency = latency
+        else:
+            self.average_latency += LATENCY_SMOOTHING * (latency - self.average_latency)
+
+    def decrease(self, reason: str):
+        """
+        Cuts the concurrency limit, at most once per average round trip so that requests failing together only
+        count once.
+        param reason: The reason of the decrease for the logs.
+        :return: None
+        """
+        now: float = time.monotonic()
+        if not self.adaptive or now - self.last_decrease_at < (self.average_latency or 0):
+            return
+        self.last_decrease_at = now
+        limit: float = max(self.min_limit, self.limit * DECREASE_FACTOR)
+        if int(limit) < int(self.limit):
+            print(f'Lowering the concurrency limit from <{int(self.limit)}> to <{int(limit)}> after {reason}')
+        self.limit = limit
+        self.decreases += 1
+
+
+class AdaptiveRateLimiter:
+    """Token bucket and AIMD concurrency controller every request to Meteoblue goes through"""
+
+    def __init__(self, token_bucket: TokenBucket = None, controller: AimdConcurrencyController = None) -> None:
+        self.token_bucket = token_bucket if token_bucket is not None else TokenBucket(DEFAULT_REQUESTS_PER_SECOND,
+                                                                                      DEFAULT_BURST)
+        self.controller = controller if controller is not None else AimdConcurrencyController()
+
+    async def run(self, send_request):
+        """
+        Sends a request once there is a free slot under the concurrency limit and a token in the bucket, and feeds its
+        latency and outcome back to the concurrency controller.
+        param send_request: A coroutine function sending the request.
+        :return: The result of the request, errors are raised again after they have been counted.
+        """
+        await self.controller.acquire()
+        error_class = None
+        started_at: float = time.monotonic()
+        try:
+            await self.token_bucket.acquire()
+            started_at = time.monotonic()
+            return await send_request()
+        except BaseException as exception:
+            error_class = classify_error(exception)
+            raise
+        finally:
+            await self.controller.release(time.monotonic() - started_at, error_class)
+
+    def metrics(self) -> dict:
+        """
+        Gets the current limits and the counters of the rate limiter.
+        :return: A dictionary of metric names and values.
+        """
+        controller: AimdConcurrencyController = self.controller
+        return {
+            'concurrency_limit': int(controller.limit),
+            'in_flight': controller.in_flight,
+            'max_in_flight': controller.max_in_flight,
+            'requests_per_second': self.token_bucket.rate,
+            'average_latency_seconds': round(controller.average_latency or 0, 3),
+            'limit_increases': controller.increases,
+            'limit_decreases': controller.decreases,
+            'throttled': controller.throttled,
+            'server_errors': controller.server_errors,
+            'latency_spikes': controller.latency_spikes
+        }
+
+    def print_metrics(self):
+        print('Rate limiter ' + ', '.join([f'{name} <{value}>' for name, value in self.metrics().items()]))
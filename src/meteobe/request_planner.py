@@ -0,0 +1,275 @@
+"""Module to plan Meteoblue requests before they are sent, e.g. packing rows into MultiPoint requests"""
+__package__ = 'meteobe'
+
+import math
+
+import numpy as np
+
+
+class PlannedRequest:
+    """One Meteoblue request covering one or more rows of the time data"""
+
+    def __init__(self, start_date, end_date, queries) -> None:
+        """Instance of a PlannedRequest sharing dates and queries for all its locations"""
+        self.start_date = start_date
+        self.end_date = end_date
+        self.queries = queries
+        self.location_rows: list = []
+        self.lats: list = []
+        self.lons: list = []
+
+    @property
+    def location_count(self) -> int:
+        return len(self.location_rows)
+
+    def add_location(self, rows: list, lat, lon):
+        """
+        Adds a location to the request.
+        param rows: The rows of the time data the result of this location is fanned out to.
+        param lat: The latitude of the location.
+        param lon: The longitude of the location.
+        :return: None
+        """
+        self.location_rows.append(rows)
+        self.lats.append(lat)
+        self.lons.append(lon)
+
+    def as_request(self) -> tuple:
+        """
+        Gets the request in the form accepted by MeteoBlueConnector.get_meteoblue_data.
+        :return: A (lats, lons, start_date, end_date, queries) tuple.
+        """
+        return self.lats, self.lons, self.start_date, self.end_date, self.queries
+
+    def split(self) -> list:
+        """
+        Splits the request into two requests of half of its locations each, e.g. to find the location Meteoblue
+        rejects the request for.
+        :return: A list of two PlannedRequest sharing the dates and queries of this request.
+        """
+        half: int = (self.location_count + 1) // 2
+        parts: list = []
+        for first, last in [(0, half), (half, self.location_count)]:
+            part: PlannedRequest = PlannedRequest(self.start_date, self.end_date, self.queries)
+            for rows, lat, lon in zip(self.location_rows[first:last], self.lats[first:last], self.lons[first:last]):
+                part.add_location(rows, lat, lon)
+            parts.append(part)
+        return parts
+
+
+def plan_multipoint_requests(lats: list, lons: list, start_dates: list, end_dates: list, queries_per_row: list,
+                             group_keys: list, max_points: int, row_indices: list = None,
+                             payload_hashes: list = None) -> list:
+    """
+    Groups rows sharing the same start/end dates and the same group key into MultiPoint requests, rows with the same
+    payload hash are requested once as one location and its result is fanned out to all of them. Rows with invalid
+    coordinates are not planned, see valid_coordinates.
+    param lats: The latitude of each row.
+    param lons: The longitude of each row.
+    param start_dates: The start date of each row.
+    param end_dates: The end date of each row.
+    param queries_per_row: The queries of each row, rows with the same group key must have the same queries.
+    param group_keys: The key of the queries of each row, e.g. the resolved best domains.
+    param max_points: The maximum number of locations in one request.
+    param row_indices: The rows to plan requests for, all rows if None.
+    param payload_hashes: The hash of the canonical single location payload of each row, no rows are merged if None.
+    :return: A list of PlannedRequest in the order of the first row they cover.
+    """
+    if row_indices is None:
+        row_indices = range(len(lats))
+
+    open_requests: dict = {}
+    planned_locations: dict = {}
+    plan: list = []
+
+    for row_index in row_indices:
+        if not valid_coordinates(lats[row_index], lons[row_index]):
+            continue
+        if payload_hashes is not None:
+            planned_location = planned_locations.get(payload_hashes[row_index])
+            if planned_location is not None:
+                planned_location.append(row_index)
+                continue
+
+        key = (start_dates[row_index], end_dates[row_index], group_keys[row_index])
+        planned_request: PlannedRequest = open_requests.get(key)
+        if planned_request is None or planned_request.location_count >= max_points:
+            planned_request = PlannedRequest(start_dates[row_index], end_dates[row_index], queries_per_row[row_index])
+            open_requests[key] = planned_request
+            plan.append(planned_request)
+
+        rows: list = [row_index]
+        planned_request.add_location(rows, lats[row_index], lons[row_index])
+        if payload_hashes is not None:
+            planned_locations[payload_hashes[row_index]] = rows
+
+    location_count: int = sum([planned_request.location_count for planned_request in plan])
+    print(f'<{len(row_indices)}> records are deduplicated to <{location_count}> distinct payloads '
+          f'(dedup ratio <{dedup_ratio(len(row_indices), location_count):.2f}>) packed into <{len(plan)}> requests '
+          f'of at most <{max_points}> locations')
+    return plan
+
+
+def plan_time_windows(dates: np.ndarray, start_date_offset: int, end_date_offset: int) -> tuple:
+    """
+    Computes the date range of every row at once, from the earliest date of interest shifted by the start offset to
+    the latest date of interest shifted by the end offset. Missing dates are ignored.
+    param dates: A (rows, date columns) datetime64 array of the dates of interest.
+    param start_date_offset: The number of days added to the earliest date, usually negative.
+    param end_date_offset: The number of days added to the latest date.
+    :return: A (start dates, end dates) tuple of datetime64[D] arrays, NaT for the rows without any date, which can
+    not be requested.
+    """
+    start_dates: np.ndarray = np.fmin.reduce(dates, axis=1) + np.timedelta64(start_date_offset, 'D')
+    end_dates: np.ndarray = np.fmax.reduce(dates, axis=1) + np.timedelta64(end_date_offset, 'D')
+    return start_dates.astype('datetime64[D]'), end_dates.astype('datetime64[D]')
+
+
+def dedup_ratio(record_count: int, distinct_count: int) -> float:
+    """
+    Gets the number of records per distinct request payload.
+    param record_count: The number of records.
+    param distinct_count: The number of distinct payloads requested for them.
+    :return: The ratio, 1 if every record needs its own payload.
+    """
+    return record_count / distinct_count if distinct_count > 0 else 1.0
+
+
+def valid_coordinates(lat, lon) -> bool:
+    """
+    Checks that a location can be sent to Meteoblue, one invalid location makes Meteoblue reject the whole request.
+    param lat: The latitude of the location.
+    param lon: The longitude of the location.
+    :return: True if both coordinates are finite numbers within the range of latitudes and longitudes.
+    """
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        return False
+    return math.isfinite(lat) and math.isfinite(lon) and -90 <= lat <= 90 and -180 <= lon <= 180
+
+
+def round_coordinates(lat, lon, precision: int) -> tuple:
+    return round(float(lat), precision), round(float(lon), precision)
+
+
+def grid_cell_key(lat, lon, domains: list, grid_resolutions: dict, precision: int) -> tuple:
+    """
+    Gets the native grid cell of a location in each domain of its queries, locations with the same key get the same
+    data from Meteoblue.
+    param lat: The latitude of the location.
+    param lon: The longitude of the location.
+    param domains: The domain of each query.
+    param grid_resolutions: The grid resolution in degrees of each upper case domain name.
+    param precision: The number of decimals the coordinates of domains without a grid resolution are rounded to.
+    :return: A tuple of (domain, latitude cell, longitude cell) tuples, one per distinct domain.
+    """
+    cells: list = []
+    for domain in sorted(set(domains)):
+        resolution = grid_resolutions.get(domain.upper())
+        if resolution:
+            cells.append((domain, math.floor(round(float(lat) / resolution, 9)),
+                          math.floor(round(float(lon) / resolution, 9))))
+        else:
+            cells.append((domain,) + round_coordinates(lat, lon, precision))
+    return tuple(cells)
+
+
+def snap_to_grid_cells(lats: list, lons: list, domains_per_row: list, grid_resolutions: dict,
+                       precision: int) -> list:
+    """
+    Snaps every location to a representative location of its grid cells, the first location of the input that falls
+    into the same cell of every domain, so that plots a few metres apart are requested once.
+    param lats: The latitude of each row.
+    param lons: The longitude of each row.
+    param domains_per_row: The domains of the queries of each row.
+    param grid_resolutions: The grid resolution in degrees of each upper case domain name.
+    param precision: The number of decimals the coordinates are rounded to.
+    :return: The rounded (lat, lon) of the representative location of each row.
+    """
+    representatives: dict = {}
+    locations: list = []
+    for lat, lon, domains in zip(lats, lons, domains_per_row):
+        if not valid_coordinates(lat, lon):
+            # has no grid cell, the location is not requested
+            locations.append(round_coordinates(lat, lon, precision))
+            continue
+        key: tuple = grid_cell_key(lat, lon, domains, grid_resolutions, precision)
+        location = representatives.get(key)
+        if location is None:
+            location = round_coordinates(lat, lon, precision)
+            representatives[key] = location
+        locations.append(location)
+
+    print(f'<{len(lats)}> locations are snapped to <{len(representatives)}> grid cells')
+    return locations
+
+
+def snap_to_domain_grid_cells(lats: list, lons: list, domains_per_row: list, grid_resolutions: dict,
+                              precision: int) -> list:
+    """
+    Snaps every location to a representative location of its grid cell in each domain on its own, the first location
+    of the input that falls into the same cell of that domain, so that the query of a coarse domain is requested once
+    per coarse cell even when a finer domain of the same row tells the locations apart.
+    param lats: The latitude of each row.
+    param lons: The longitude of each row.
+    param domains_per_row: The domains of the queries of each row.
+    param grid_resolutions: The grid resolution in degrees of each upper case domain name.
+    param precision: The number of decimals the coordinates are rounded to.
+    :return: A dictionary of the rounded (lat, lon) of the representative location of each domain, for each row.
+    """
+    representatives: dict = {}
+    locations: list = []
+    for lat, lon, domains in zip(lats, lons, domains_per_row):
+        domain_locations: dict = {}
+        if not valid_coordinates(lat, lon):
+            # has no grid cell, the location is not requested
+            locations.append({domain: round_coordinates(lat, lon, precision) for domain in domains})
+            continue
+        for domain in domains:
+            key: tuple = grid_cell_key(lat, lon, [domain], grid_resolutions, precision)
+            location = representatives.get(key)
+            if location is None:
+                location = round_coordinates(lat, lon, precision)
+                representatives[key] = location
+            domain_locations[domain] = location
+        locations.append(domain_locations)
+
+    print(f'<{len(lats)}> locations are snapped to <{len(representatives)}> grid cells of their domains')
+    return locations
+
+
+def plan_soil_requests(lats: list, lons: list, start_date, end_date, soil_queries, max_points: int, precision: int,
+                       row_indices: list = None) -> list:
+    """
+    Plans one soil data request location per distinct rounded coordinate, regardless of the dates of the rows
+    because soil data does not change over time. Rows with invalid coordinates are not planned, see valid_coordinates.
+    param lats: The latitude of each row.
+    param lons: The longitude of each row.
+    param start_date: The start date sent for every location.
+    param end_date: The end date sent for every location.
+    param soil_queries: The soil queries of every row.
+    param max_points: The maximum number of locations in one request.
+    param precision: The number of decimals the coordinates are rounded to before they are compared.
+    param row_indices: The rows to plan requests for, all rows if None.
+    :return: A list of PlannedRequest, the result of each location is fanned out to all its rows.
+    """
+    if row_indices is None:
+        row_indices = range(len(lats))
+
+    location_rows: dict = {}
+    for row_index in row_indices:
+        if not valid_coordinates(lats[row_index], lons[row_index]):
+            continue
+        location_rows.setdefault(round_coordinates(lats[row_index], lons[row_index], precision), []).append(row_index)
+
+    plan: list = []
+    for (lat, lon), rows in location_rows.items():
+        if len(plan) == 0 or plan[-1].location_count >= max_points:
+            plan.append(PlannedRequest(start_date, end_date, soil_queries))
+        plan[-1].add_location(rows, lat, lon)
+
+    print(f'<{len(row_indices)}> records are deduplicated to <{len(location_rows)}> soil locations '
+          f'(dedup ratio <{dedup_ratio(len(row_indices), len(location_rows)):.2f}>) packed into <{len(plan)}> requests '
+          f'of at most <{max_points}> locations')
+    return plan
@@ -0,0 +1,119 @@
+"""Module to keep raw Meteoblue responses on disk so that re-runs skip the network for requests already answered"""
+__package__ = 'meteobe'
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+SECONDS_PER_DAY = 86400
+DEFAULT_TTL_KEY = 'DEFAULT'
+
+
+class ResponseCache:
+    """SQLite store of raw protobuf responses keyed by a canonical hash of the request payload"""
+
+    def __init__(self, cache_file: str, max_size_bytes: int, ttl_days: dict) -> None:
+        """
+        Instance of a ResponseCache.
+        param cache_file: The SQLite file storing the responses, created if it does not exist.
+        param max_size_bytes: The least recently used responses are evicted above this size.
+        param ttl_days: Number of days a response stays valid per domain, DEFAULT is used for other domains.
+        """
+        self.cache_file = cache_file
+        self.max_size_bytes = max_size_bytes
+        self.ttl_seconds: dict = {domain.upper(): float(days) * SECONDS_PER_DAY for domain, days in ttl_days.items()}
+        self.hits = 0
+        self.misses = 0
+
+        cache_dir = os.path.dirname(cache_file)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        self.connection = sqlite3.connect(cache_file, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, data BLOB NOT NULL, '
+                                'size INTEGER NOT NULL, expires_at REAL NOT NULL, last_access REAL NOT NULL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)')
+        self.connection.execute('DELETE FROM responses WHERE expires_at < ?', (time.time(),))
+        self.size_bytes: int = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        print(f'Loaded response cache <{cache_file}> with <{self.size_bytes}> bytes')
+
+    @staticmethod
+    def hash_payload(payload: dict) -> str:
+        """
+        Hashes a Meteoblue REST JSON payload independently of key order and formatting.
+        param payload: The payload built by MeteoBlueConnector.build_json_payload.
+        :return: The hex digest of the canonical payload.
+        """
+        canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def ttl_for_payload(self, payload: dict) -> float:
+        """
+        Gets the time to live of a response, which is the shortest time to live of all queried domains.
+        param payload: The payload built by MeteoBlueConnector.build_json_payload.
+        :return: The time to live in seconds.
+        """
+        default_ttl = self.ttl_seconds.get(DEFAULT_TTL_KEY, 0)
+        ttls: list = [self.ttl_seconds.get(str(query.get('domain')).upper(), default_ttl)
+                      for query in payload.get('queries', [])]
+        return min(ttls) if ttls else default_ttl
+
+    def get(self, key: str):
+        """
+        Gets the raw response stored for a key.
+        param key: The payload hash.
+        :return: The raw protobuf bytes, or None if not cached or expired.
+        """
+        now = time.time()
+        row = self.connection.execute('SELECT data, expires_at FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] < now:
+            self.misses += 1
+            return None
+
+        self.connection.execute('UPDATE responses SET last_access = ? WHERE key = ?', (now, key))
+        self.hits += 1
+        return row[0]
+
+    def set(self, key: str, data: bytes, ttl: float):
+        """
+        Stores a raw response, evicting the least recently used responses if the cache grows too large.
+        param key: The payload hash.
+        param data: The raw protobuf bytes.
+        param ttl: Number of seconds the response stays valid.
+        :return: None
+        """
+        if ttl <= 0:
+            return
+
+        now = time.time()
+        previous = self.connection.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+        self.connection.execute('INSERT OR REPLACE INTO responses (key, data, size, expires_at, last_access) '
+                                'VALUES (?, ?, ?, ?, ?)', (key, sqlite3.Binary(data), len(data), now + ttl, now))
+        self.size_bytes += len(data) - (previous[0] if previous else 0)
+
+        if self.size_bytes > self.max_size_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used responses until the cache fits in its maximum size.
+        :return: None
+        """
+        excess = self.size_bytes - self.max_size_bytes
+        evicted_keys: list = []
+        for key, size in self.connection.execute('SELECT key, size FROM responses ORDER BY last_access').fetchall():
+            if excess <= 0:
+                break
+            evicted_keys.append((key,))
+            excess -= size
+            self.size_bytes -= size
+
+        self.connection.executemany('DELETE FROM responses WHERE key = ?', evicted_keys)
+        print(f'Evicted <{len(evicted_keys)}> responses from the response cache')
+
+    def close(self):
+        print(f'Response cache had <{self.hits}> hits and <{self.misses}> misses')
+        self.connection.close()
@@ -0,0 +1,204 @@
+"""Module to decode Meteoblue DatasetApiProtobuf responses into NumPy blocks"""
+__package__ = 'meteobe'
+
+import functools
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import numpy as np
+from meteoblue_dataset_sdk.protobuf.dataset_pb2 import DatasetApiProtobuf
+
+# Spacing of the samples used to detect a daylight saving time change within a time interval
+UTC_OFFSET_SAMPLE_SECONDS = 7 * 86400
+
+CodeInfo = namedtuple('CodeInfo', ['code', 'level', 'aggregation', 'unit', 'start_depth', 'end_depth'])
+FailedQuery = namedtuple('FailedQuery', ['domain', 'query_hash', 'reason'])
+
+
+
+def failed_domains(failed_queries: list) -> list:
+    """
+    Gets the failed domains of a record, with the reason of the first of its queries that failed for each of them.
+    Domains are compared regardless of case because the best domains are read from the ini file, whose keys are lower
+    case, so a domain is reported once whether its sub-queries were merged or requested on their own.
+    param failed_queries: The FailedQuery list of a record.
+    :return: A list of (domain, reason) tuples, with the domain in upper case.
+    """
+    reasons: dict = {}
+    for failed_query in failed_queries:
+        domain: str = failed_query.domain.upper() if isinstance(failed_query.domain, str) else ''
+        reasons.setdefault(domain, failed_query.reason)
+    return list(reasons.items())
+
+class GeometryBlock:
+    """The values of one geometry of a response, stored as one (locations, time steps, codes) array"""
+
+    def __init__(self, geometry, dtype) -> None:
+        """
+        Instance of a GeometryBlock, copying the repeated data fields of the geometry once into a contiguous array.
+        param geometry: One geometry of a DatasetApiProtobuf object.
+        param dtype: The NumPy dtype of the values, e.g. np.float32 or np.float64.
+        """
+        self.domain: str = geometry.domain
+        self.lats: list = list(geometry.lats)
+        self.lons: list = list(geometry.lons)
+
+        self.start = self.end = self.stride = None
+        if len(geometry.timeIntervals) > 0:
+            self.start = geometry.timeIntervals[0].start
+            self.end = geometry.timeIntervals[0].end
+            self.stride = geometry.timeIntervals[0].stride
+
+        self.codes: list = [CodeInfo(code.code, code.level, code.aggregation, code.unit, code.startDepth,
+                                     code.endDepth) for code in geometry.codes]
+
+        location_count: int = max(len(self.lats), 1)
+        value_count: int = len(geometry.codes[0].timeIntervals[0].data) if len(geometry.codes) > 0 else 0
+        step_count: int = value_count // location_count
+        self.values: np.ndarray = np.empty((location_count, step_count, len(self.codes)), dtype=dtype)
+
+        for j, code in enumerate(geometry.codes):
+            data = code.timeIntervals[0].data
+            if len(data) != location_count * step_count:
+                raise ValueError(f'Code <{code.code}> of domain <{self.domain}> has <{len(data)}> values instead '
+                                 f'of <{location_count * step_count}>')
+            # data of all locations is concatenated, one time series after another
+            self.values[:, :, j] = np.fromiter(data, dtype=dtype, count=len(data)).reshape(location_count,
+                                                                                         step_count)
+
+    @classmethod
+    def from_values(cls, domain: str, lats: list, lons: list, start: int, end: int, stride: int, codes: list,
+                    values: np.ndarray):
+        """
+        Builds a GeometryBlock from values that were already decoded, e.g. stitched together from cached tiles.
+        param domain: The domain of the geometry.
+        param lats: The latitude of each location.
+        param lons: The longitude of each location.
+        param start: The first timestamp of the time interval.
+        param end: The end of the time interval (exclusive).
+        param stride: The seconds between two timestamps.
+        param codes: A list of CodeInfo, one per code.
+        param values: A (locations, time steps, codes) array.
+        :return: A GeometryBlock.
+        """
+        block = cls.__new__(cls)
+        block.domain = domain
+        block.lats = lats
+        block.lons = lons
+        block.start = start
+        block.end = end
+        block.stride = stride
+        block.codes = codes
+        block.values = values
+        return block
+
+    @property
+    def location_count(self) -> int:
+        return self.values.shape[0]
+
+    def location_block(self, location: int):
+        """
+        Gets a single location GeometryBlock sharing the values of one location of this block.
+        param location: The index of the location in the request.
+        :return: A GeometryBlock.
+        """
+        return GeometryBlock.from_values(self.domain, [self.lats[location]], [self.lons[location]], self.start,
+                                         self.end, self.stride, self.codes, self.values[location:location + 1])
+
+    def location_values(self, location: int) -> np.ndarray:
+        """
+        Gets the (time steps, codes) block of one location without copying.
+        param location: The index of the location in the request.
+        :return: A 2-D NumPy array view.
+        """
+        return self.values[location]
+
+
+class LocationResult:
+    """
+    The decoded geometry blocks of a response together with the index of one of its locations, and the queries that
+    failed if the blocks were assembled from several requests
+    """
+
+    def __init__(self, blocks: list, location: int, failed_queries: list = None) -> None:
+        self.blocks = blocks
+        self.location = location
+        self.failed_queries: list = failed_queries if failed_queries is not None else []
+
+
+def decode_blocks(result: DatasetApiProtobuf, dtype=np.float64) -> list:
+    """
+    Decodes every geometry of a response into a GeometryBlock.
+    param result: MeteoBlue response in DatasetApiProtobuf object.
+    param dtype: The NumPy dtype of the values.
+    :return: A list of GeometryBlock in the order of the queries.
+    """
+    return [GeometryBlock(geometry, dtype) for geometry in result.geometries]
+
+
+def decode_locations(result: DatasetApiProtobuf, location_count: int, dtype=np.float64) -> list:
+    """
+    Decodes a (MultiPoint) response and splits it into one LocationResult per requested location.
+    param result: MeteoBlue response in DatasetApiProtobuf object, None if the request failed.
+    param location_count: The number of locations in the request.
+    param dtype: The NumPy dtype of the values.
+    :return: A list of LocationResult in the order of the requested locations, None for each if it can not be split.
+    """
+    if result is None:
+        return [None] * location_count
+
+    blocks: list = decode_blocks(result, dtype)
+    for block in blocks:
+        if block.location_count != location_count:
+            print(f'Got <{block.location_count}> locations from domain <{block.domain}> instead of '
+                  f'<{location_count}>, the response can not be split')
+            return [None] * location_count
+
+    return [LocationResult(blocks, location) for location in range(location_count)]
+
+
+def as_location_result(result, dtype=np.float64) -> LocationResult:
+    """
+    Gets the decoded single location of a response, decoding it first if it is a DatasetApiProtobuf object.
+    param result: A LocationResult, or a single location response in DatasetApiProtobuf object.
+    param dtype: The NumPy dtype of the values.
+    :return: A LocationResult.
+    """
+    if isinstance(result, LocationResult):
+        return result
+    return LocationResult(decode_blocks(result, dtype), 0)
+
+
+def local_utc_offset(timestamp: int) -> int:
+    """
+    Gets the offset of the local time zone to UTC at a point in time.
+    param timestamp: Seconds since the epoch.
+    :return: The offset in seconds.
+    """
+    utc_datetime = datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)
+    return int((datetime.fromtimestamp(timestamp) - utc_datetime).total_seconds())
+
+
+@functools.lru_cache(maxsize=1024)
+def build_time_axis(start: int, end: int, stride: int) -> np.ndarray:
+    """
+    Builds the local date times of a time interval as datetime64, cached because most locations share an interval.
+    param start: The first timestamp of the interval in seconds since the epoch.
+    param end: The end of the interval (exclusive) in seconds since the epoch.
+    param stride: The seconds between two timestamps.
+    :return: A read-only datetime64[s] NumPy array shared by every caller of the same interval.
+    """
+    timestamps: np.ndarray = np.arange(start, end, stride, dtype=np.int64)
+    if len(timestamps) == 0:
+        return np.empty(0, dtype='datetime64[s]')
+
+    samples: list = list(range(start, int(timestamps[-1]), UTC_OFFSET_SAMPLE_SECONDS)) + [int(timestamps[-1])]
+    offsets: set = {local_utc_offset(sample) for sample in samples}
+    if len(offsets) == 1:
+        time_axis = (timestamps + offsets.pop()).astype('datetime64[s]')
+    else:
+        # the interval crosses a daylight saving time change, so every timestamp gets its own offset
+        time_axis = np.array([datetime.fromtimestamp(n) for n in timestamps.tolist()], dtype='datetime64[s]')
+
+    time_axis.setflags(write=False)
+    return time_axis
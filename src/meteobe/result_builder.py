@@ -0,0 +1,105 @@
+"""Module to accumulate decoded Meteoblue results column by column before building one dataframe"""
+__package__ = 'meteobe'
+
+import numpy as np
+import pandas as pd
+
+
+def to_column_chunk(value, row_count: int) -> np.ndarray:
+    """
+    Converts a decoded value into a column chunk of row_count rows, a scalar value is repeated for every row.
+    param value: A scalar or a list-like value of row_count elements.
+    param row_count: The number of rows of the location.
+    :return: A NumPy array, numeric values keep a numeric dtype and any other values are stored as objects.
+    """
+    if is_list_like(value):
+        chunk = np.asarray(value)
+    else:
+        chunk = np.full(row_count, value)
+
+    if chunk.dtype.kind not in 'biufcmM':
+        chunk = chunk.astype(object)
+    return chunk
+
+
+def is_list_like(value) -> bool:
+    return hasattr(value, '__len__') and not isinstance(value, (str, bytes))
+
+
+def missing_chunk(dtype: np.dtype, row_count: int) -> np.ndarray:
+    """
+    Builds the column chunk of the rows of a column that is missing from their locations, filled with the missing
+    value of the column's dtype so that padding a column does not change its dtype.
+    param dtype: The dtype of the chunks of the column.
+    param row_count: The number of missing rows.
+    :return: NaT for datetime and timedelta columns, NaN of the same precision for float columns, NaN floats for
+    integer and boolean columns, like pandas does, and NaN objects for any other column.
+    """
+    if dtype.kind in 'mM':
+        return np.full(row_count, 'NaT', dtype=dtype)
+    if dtype.kind in 'fc':
+        return np.full(row_count, np.nan, dtype=dtype)
+    if dtype.kind in 'biu':
+        return np.full(row_count, np.nan)
+    return np.full(row_count, np.nan, dtype=object)
+
+
+class ResultBuilder:
+    """Columnar buffers of decoded results, replaces appending one dataframe per location to the accumulated one"""
+
+    def __init__(self) -> None:
+        """Instance of an empty ResultBuilder"""
+        self.chunks: dict = {}
+        self.row_count = 0
+
+    def add(self, response_dict: dict):
+        """
+        Adds the decoded result of one location, columns missing from either side are filled with the missing value of
+        their dtype, see missing_chunk. The missing rows are only counted here, because the dtype of a column may not
+        be known yet when its first rows are missing.
+        param response_dict: A dictionary of column names and scalar or list-like values of the same length.
+        :return: None
+        """
+        lengths: set = {len(value) for value in response_dict.values() if is_list_like(value)}
+        if len(lengths) > 1:
+            raise ValueError(f'All arrays must be of the same length, got lengths {sorted(lengths)}')
+        row_count: int = lengths.pop() if lengths else 1
+
+        # the chunks are converted before any buffer is touched so that a failed location leaves no partial rows
+        new_chunks: dict = {column: to_column_chunk(value, row_count) for column, value in response_dict.items()}
+
+        for column, chunks in self.chunks.items():
+            if column not in new_chunks:
+                chunks.append(row_count)
+        for column, chunk in new_chunks.items():
+            if column not in self.chunks:
+                self.chunks[column] = [self.row_count] if self.row_count > 0 else []
+            self.chunks[column].append(chunk)
+
+        self.row_count += row_count
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        Materialises the buffers into one dataframe, the columns are in the order they were first added.
+        :return: A Pandas dataframe.
+        """
+        columns: dict = {column: self.concatenate(chunks) for column, chunks in self.chunks.items()}
+        return pd.DataFrame(columns)
+
+    @staticmethod
+    def concatenate(chunks: list) -> np.ndarray:
+        """
+        Concatenates the chunks of a column.
+        param chunks: The column chunks, and the number of missing rows wherever the column was missing.
+        :return: A NumPy array.
+        """
+        arrays: list = [chunk for chunk in chunks if isinstance(chunk, np.ndarray)]
+        if len(arrays) == 0:
+            return np.empty(0)
+        try:
+            dtype: np.dtype = np.result_type(*{array.dtype for array in arrays})
+        except TypeError:
+            # e.g. dates and numbers, which are concatenated as objects
+            dtype = np.dtype(object)
+        return np.concatenate([chunk if isinstance(chunk, np.ndarray) else missing_chunk(dtype, chunk)
+                               for chunk in chunks])
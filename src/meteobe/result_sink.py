@@ -0,0 +1,454 @@
+"""Module to stream decoded Meteoblue results to the output files while they arrive instead of at the end of a run"""
+__package__ = 'meteobe'
+
+import abc
+import csv
+import os
+import shutil
+import time
+from urllib.parse import quote
+
+import pandas as pd
+
+from .result_builder import ResultBuilder
+
+CSV_FORMAT = 'csv'
+PARQUET_FORMAT = 'parquet'
+ARROW_FORMAT = 'arrow'
+OUTPUT_FORMATS = [CSV_FORMAT, PARQUET_FORMAT, ARROW_FORMAT]
+
+DEFAULT_FLUSH_ROWS = 100000
+DEFAULT_FLUSH_SECONDS = 60.0
+
+CSV_ENCODING = 'UTF-8-sig'
+
+DEFAULT_PARQUET_COMPRESSION = 'zstd'
+# Partitions of the Parquet output, the year is taken from the dates of the rows
+COUNTRY_CODE_PARTITION = 'country_code'
+YEAR_PARTITION = 'year'
+PARTITIONS = [COUNTRY_CODE_PARTITION, YEAR_PARTITION]
+# Directory name of the rows without a partition value, as used by Hive and Spark
+HIVE_DEFAULT_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+
+def import_pyarrow():
+    """
+    Imports PyArrow, which is only needed for the Parquet and Arrow output formats.
+    :return: The pyarrow module.
+    """
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as error:
+        raise ImportError(f'The Parquet and Arrow output formats need pyarrow, install it with '
+                          f'pip install meteobe[arrow]: {error}')
+    return pyarrow
+
+
+class ParquetOptions:
+    """Encoding and layout of the Parquet output"""
+
+    def __init__(self, compression: str = DEFAULT_PARQUET_COMPRESSION, float32: bool = True,
+                 float64_columns: list = None, dates_col: str = None, partition_cols: list = None) -> None:
+        """
+        Instance of ParquetOptions.
+        param compression: The compression codec of the column chunks, e.g. zstd, snappy or none.
+        param float32: Writes the float measurements as float32, which halves their size.
+        param float64_columns: The float columns kept as float64, e.g. the latitude and longitude.
+        param dates_col: The dates column, written as timestamps and used for the year partition.
+        param partition_cols: The columns the output is partitioned by into key=value directories, YEAR_PARTITION is
+        taken from the dates.
+        """
+        self.compression = compression
+        self.float32 = float32
+        self.float64_columns: list = float64_columns or []
+        self.dates_col = dates_col
+        self.partition_cols: list = partition_cols or []
+
+
+class ResultSink(abc.ABC):
+    """
+    Appends the decoded results to an output file in batches of at most flush_rows rows, or whatever arrived within
+    flush_seconds, so that only one batch is held in memory. The file is written under a temporary name and renamed
+    when it is finished, so readers never see a half written file.
+    """
+
+    extension = ''
+
+    def __init__(self, file_path: str, flush_rows: int = DEFAULT_FLUSH_ROWS,
+                 flush_seconds: float = DEFAULT_FLUSH_SECONDS, shared_ids: set = None, id_col: str = None,
+                 column_order=None) -> None:
+        """
+        Instance of a ResultSink.
+        param file_path: The path of the output file without its extension.
+        param flush_rows: The number of buffered rows written as one batch.
+        param flush_seconds: The maximum number of seconds rows stay buffered.
+        param shared_ids: The IDs of several records, duplicate rows of these IDs are only written once.
+        param id_col: The ID column, needed to find the rows of the shared IDs.
+        param column_order: A code_registry.ColumnOrder giving the order of the columns, they are written in the order
+        they arrive if it is None.
+        """
+        self.file_path = file_path + self.extension
+        self.flush_rows = max(flush_rows, 1)
+        self.flush_seconds = flush_seconds
+        # the set is shared with the caller, which adds the IDs of every chunk of records it reads
+        self.shared_ids: set = shared_ids if shared_ids is not None else set()
+        self.id_col = id_col
+        self.column_order = column_order
+
+        self.builder: ResultBuilder = ResultBuilder()
+        self.flushed_at = time.monotonic()
+        self.columns: list = []
+        # a new part file is started when a batch brings new columns, the parts are merged when the sink is closed
+        self.part_files: list = []
+        self.written_hashes: set = set()
+        self.row_count = 0
+        self.batch_count = 0
+
+    def add(self, response_dict: dict):
+        """
+        Buffers the decoded result of one record and writes the buffer if it is full or old enough.
+        param response_dict: A dictionary of column names and scalar or list-like values of the same length.
+        :return: None
+        """
+        self.builder.add(response_dict)
+        if self.builder.row_count >= self.flush_rows or time.monotonic() - self.flushed_at >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered rows as one batch.
+        :return: None
+        """
+        self.flushed_at = time.monotonic()
+        if self.builder.row_count == 0:
+            return
+        batch: pd.DataFrame = self.drop_written_rows(self.builder.to_dataframe())
+        self.builder = ResultBuilder()
+        if len(batch) == 0:
+            return
+
+        new_columns: list = [column for column in batch.columns if column not in self.columns]
+        if len(self.part_files) == 0 or len(new_columns) > 0:
+            self.close_part()
+            self.columns = self.columns + new_columns
+            if self.column_order is not None:
+                self.columns = sorted(self.columns, key=self.column_order.rank)
+            self.open_part(self.next_part_file())
+        self.write_batch(batch.reindex(columns=self.columns))
+        self.row_count += len(batch)
+        self.batch_count += 1
+
+    def next_part_file(self) -> str:
+        self.part_files.append(f'{self.file_path}.part{len(self.part_files)}')
+        return self.part_files[-1]
+
+    def drop_written_rows(self, batch: pd.DataFrame) -> pd.DataFrame:
+        """
+        Drops duplicate rows, rows of IDs with a single record can only be duplicated within their record.
+        param batch: The rows of a batch.
+        :return: The rows that were not written yet.
+        """
+        batch = batch.drop_duplicates(ignore_index=True)
+        if len(self.shared_ids) == 0 or self.id_col not in batch.columns:
+            return batch
+
+        shared_rows = batch[self.id_col].isin(self.shared_ids)
+        if not shared_rows.any():
+            return batch
+        row_hashes = pd.util.hash_pandas_object(batch[shared_rows], index=False)
+        written = row_hashes.isin(self.written_hashes)
+        self.written_hashes.update(row_hashes[~written].tolist())
+        return batch.drop(index=row_hashes.index[written.to_numpy()]).reset_index(drop=True)
+
+    def close(self) -> int:
+        """
+        Writes the remaining rows, merges the part files and renames the result to the output file.
+        :return: The number of rows written, no output file is written if it is 0.
+        """
+        self.flush()
+        self.close_part()
+        if len(self.part_files) == 0:
+            return 0
+
+        if len(self.part_files) == 1:
+            os.replace(self.part_files[0], self.file_path)
+        else:
+            merged_file: str = f'{self.file_path}.merged'
+            self.merge_parts(merged_file)
+            os.replace(merged_file, self.file_path)
+            for part_file in self.part_files:
+                os.remove(part_file)
+        return self.row_count
+
+    @abc.abstractmethod
+    def open_part(self, part_file: str):
+        """Starts a part file with the current columns"""
+
+    @abc.abstractmethod
+    def write_batch(self, batch: pd.DataFrame):
+        """Appends a batch with the current columns to the open part file"""
+
+    @abc.abstractmethod
+    def close_part(self):
+        """Closes the open part file, if any"""
+
+    @abc.abstractmethod
+    def merge_parts(self, merged_file: str):
+        """Merges the part files into one file with the columns of every part"""
+
+
+class CsvResultSink(ResultSink):
+    """CSV output with a single header row, the same as writing the whole dataframe with to_csv"""
+
+    extension = '.csv'
+
+    def __init__(self, file_path: str, flush_rows: int = DEFAULT_FLUSH_ROWS,
+                 flush_seconds: float = DEFAULT_FLUSH_SECONDS, shared_ids: set = None, id_col: str = None,
+                 date_format: str = None, column_order=None) -> None:
+        super().__init__(file_path, flush_rows, flush_seconds, shared_ids, id_col, column_order)
+        self.date_format = date_format
+        self.file = None
+
+    def open_part(self, part_file: str):
+        self.file = open(part_file, 'w', encoding=CSV_ENCODING, newline='')
+        csv.writer(self.file, lineterminator=os.linesep).writerow(self.columns)
+
+    def write_batch(self, batch: pd.DataFrame):
+        batch.to_csv(self.file, index=False, header=False, date_format=self.date_format)
+        self.file.flush()
+
+    def close_part(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def merge_parts(self, merged_file: str):
+        # the values are copied as text so that they are written exactly as they were
+        with open(merged_file, 'w', encoding=CSV_ENCODING, newline='') as merged:
+            writer = csv.writer(merged, lineterminator=os.linesep)
+            writer.writerow(self.columns)
+            for part_file in self.part_files:
+                with open(part_file, encoding=CSV_ENCODING, newline='') as part:
+                    reader = csv.reader(part)
+                    part_columns: list = next(reader)
+                    positions: dict = {column: position for position, column in enumerate(part_columns)}
+                    for row in reader:
+                        writer.writerow([row[positions[column]] if column in positions else ''
+                                         for column in self.columns])
+
+
+class ArrowResultSink(ResultSink):
+    """Arrow IPC file output, one record batch per flushed batch"""
+
+    extension = '.arrow'
+
+    def __init__(self, file_path: str, flush_rows: int = DEFAULT_FLUSH_ROWS,
+                 flush_seconds: float = DEFAULT_FLUSH_SECONDS, shared_ids: set = None, id_col: str = None,
+                 column_order=None) -> None:
+        super().__init__(file_path, flush_rows, flush_seconds, shared_ids, id_col, column_order)
+        self.pa = import_pyarrow()
+        self.part_file = None
+        self.writer = None
+        self.schemas: list = []
+
+    def open_part(self, part_file: str):
+        # the writer is created by the first batch, whose types make the schema of the part
+        self.part_file = part_file
+
+    def new_writer(self, part_file: str, schema):
+        return self.pa.ipc.new_file(part_file, schema)
+
+    def to_table(self, batch: pd.DataFrame):
+        return self.pa.Table.from_pandas(batch, preserve_index=False)
+
+    def write_batch(self, batch: pd.DataFrame):
+        table = self.to_table(batch)
+        if self.writer is not None and not table.schema.equals(self.schemas[-1]):
+            try:
+                table = table.cast(self.schemas[-1])
+            except (self.pa.ArrowInvalid, self.pa.ArrowTypeError, self.pa.ArrowNotImplementedError):
+                # e.g. a column that only had missing values so far, the batch starts a part with its own types
+                self.close_part()
+                self.open_part(self.next_part_file())
+
+        if self.writer is None:
+            self.schemas.append(table.schema)
+            self.writer = self.new_writer(self.part_file, table.schema)
+        self.writer.write_table(table)
+
+    def close_part(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def read_part_batches(self, part_file: str):
+        reader = self.pa.ipc.open_file(part_file)
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+
+    def merge_parts(self, merged_file: str):
+        schema = self.pa.unify_schemas(self.schemas, promote_options='permissive')
+        schema = self.pa.schema([schema.field(column) for column in self.columns])
+        writer = self.new_writer(merged_file, schema)
+        for part_file in self.part_files:
+            for record_batch in self.read_part_batches(part_file):
+                table = self.pa.Table.from_batches([record_batch])
+                for field in schema:
+                    if field.name not in table.column_names:
+                        table = table.append_column(field, self.pa.nulls(table.num_rows, field.type))
+                writer.write_table(table.select(schema.names).cast(schema))
+        writer.close()
+
+
+class ParquetResultSink(ArrowResultSink):
+    """
+    Parquet output, one row group per flushed batch, with dictionary encoded IDs, float32 measurements and timestamp
+    dates
+    """
+
+    extension = '.parquet'
+
+    def __init__(self, file_path: str, flush_rows: int = DEFAULT_FLUSH_ROWS,
+                 flush_seconds: float = DEFAULT_FLUSH_SECONDS, shared_ids: set = None, id_col: str = None,
+                 options: ParquetOptions = None, column_order=None) -> None:
+        super().__init__(file_path, flush_rows, flush_seconds, shared_ids, id_col, column_order)
+        self.options: ParquetOptions = options or ParquetOptions()
+
+    def to_table(self, batch: pd.DataFrame):
+        dates_col: str = self.options.dates_col
+        if dates_col in batch.columns and not pd.api.types.is_datetime64_any_dtype(batch[dates_col]):
+            batch = batch.assign(**{dates_col: pd.to_datetime(batch[dates_col])})
+
+        table = self.pa.Table.from_pandas(batch, preserve_index=False)
+        for i, field in enumerate(table.schema):
+            if field.name == self.id_col and not self.pa.types.is_dictionary(field.type):
+                table = table.set_column(i, field.name, table.column(i).dictionary_encode())
+            elif self.options.float32 and self.pa.types.is_float64(field.type) and \
+                    field.name not in self.options.float64_columns:
+                table = table.set_column(i, field.name, table.column(i).cast(self.pa.float32()))
+        # the pandas metadata would still describe the columns before they were converted
+        return table.replace_schema_metadata(None)
+
+    def new_writer(self, part_file: str, schema):
+        return self.pa.parquet.ParquetWriter(part_file, schema, compression=self.options.compression,
+                                             coerce_timestamps='us', allow_truncated_timestamps=True)
+
+    def read_part_batches(self, part_file: str):
+        return self.pa.parquet.ParquetFile(part_file).iter_batches()
+
+
+class PartitionedParquetResultSink(ParquetResultSink):
+    """
+    Parquet dataset partitioned into key=value directories, e.g. country_code=US/year=2020, as read by
+    pandas.read_parquet, pyarrow.dataset and Spark. Every flushed batch adds one file to each of its partitions.
+    """
+
+    def __init__(self, file_path: str, flush_rows: int = DEFAULT_FLUSH_ROWS,
+                 flush_seconds: float = DEFAULT_FLUSH_SECONDS, shared_ids: set = None, id_col: str = None,
+                 options: ParquetOptions = None, column_order=None) -> None:
+        super().__init__(file_path, flush_rows, flush_seconds, shared_ids, id_col, options, column_order)
+        self.dataset_dir: str = f'{self.file_path}.tmp'
+        self.written_files: list = []
+        # left over by an interrupted run
+        if os.path.isdir(self.dataset_dir):
+            shutil.rmtree(self.dataset_dir)
+
+    def open_part(self, part_file: str):
+        pass
+
+    def close_part(self):
+        pass
+
+    @staticmethod
+    def partition_dir(column: str, value) -> str:
+        if pd.isna(value) or str(value) == '':
+            return f'{column}={HIVE_DEFAULT_PARTITION}'
+        return f'{column}={quote(str(value), safe="")}'
+
+    def write_batch(self, batch: pd.DataFrame):
+        partition_cols: list = []
+        for column in self.options.partition_cols:
+            if column == YEAR_PARTITION and self.options.dates_col in batch.columns:
+                batch = batch.assign(**{YEAR_PARTITION: pd.to_datetime(batch[self.options.dates_col]).dt.year})
+            if column in batch.columns:
+                partition_cols.append(column)
+        if len(partition_cols) == 0:
+            self.write_file(self.dataset_dir, batch)
+            return
+
+        for values, group in batch.groupby(partition_cols, sort=False, dropna=False):
+            values = values if isinstance(values, tuple) else (values,)
+            partition_path: str = os.path.join(self.dataset_dir, *[self.partition_dir(column, value)
+                                                                   for column, value in zip(partition_cols, values)])
+            self.write_file(partition_path, group.drop(columns=partition_cols))
+
+    def write_file(self, partition_path: str, rows: pd.DataFrame):
+        os.makedirs(partition_path, exist_ok=True)
+        part_file: str = os.path.join(partition_path, f'part-{self.batch_count:05d}.parquet')
+        table = self.to_table(rows)
+        writer = self.new_writer(part_file, table.schema)
+        writer.write_table(table)
+        writer.close()
+        self.written_files.append((part_file, table.schema))
+
+    def close(self) -> int:
+        """
+        Writes the remaining rows, gives every file of the dataset the same schema and renames the dataset directory
+        to the output directory.
+        :return: The number of rows written, no output directory is written if it is 0.
+        """
+        self.flush()
+        if len(self.written_files) == 0:
+            return 0
+
+        # files written before a batch brought new columns get the missing columns as nulls
+        schema = self.pa.unify_schemas([schema for part_file, schema in self.written_files],
+                                       promote_options='permissive')
+        schema = self.pa.schema([schema.field(column) for column in self.columns if column in schema.names])
+        for part_file, part_schema in self.written_files:
+            if part_schema.equals(schema):
+                continue
+            table = self.pa.parquet.read_table(part_file, partitioning=None)
+            for field in schema:
+                if field.name not in table.column_names:
+                    table = table.append_column(field, self.pa.nulls(table.num_rows, field.type))
+            writer = self.new_writer(part_file, schema)
+            writer.write_table(table.select(schema.names).cast(schema))
+            writer.close()
+
+        # a directory cannot replace another one, so a previous output is removed just before
+        if os.path.isdir(self.file_path):
+            shutil.rmtree(self.file_path)
+        elif os.path.exists(self.file_path):
+            os.remove(self.file_path)
+        os.replace(self.dataset_dir, self.file_path)
+        return self.row_count
+
+
+def open_result_sink(output_format: str, file_path: str, flush_rows: int = DEFAULT_FLUSH_ROWS,
+                     flush_seconds: float = DEFAULT_FLUSH_SECONDS, shared_ids: set = None, id_col: str = None,
+                     date_format: str = None, parquet_options: ParquetOptions = None, column_order=None) -> ResultSink:
+    """
+    Opens the result sink of an output format.
+    param output_format: One of OUTPUT_FORMATS.
+    param file_path: The path of the output file without its extension.
+    param flush_rows: The number of buffered rows written as one batch.
+    param flush_seconds: The maximum number of seconds rows stay buffered.
+    param shared_ids: The IDs of several records, duplicate rows of these IDs are only written once.
+    param id_col: The ID column.
+    param date_format: The format of the dates in CSV output.
+    param parquet_options: The encoding and partitions of Parquet output.
+    param column_order: A code_registry.ColumnOrder giving the order of the columns.
+    :return: A ResultSink.
+    """
+    if output_format == PARQUET_FORMAT:
+        if parquet_options is not None and len(parquet_options.partition_cols) > 0:
+            return PartitionedParquetResultSink(file_path, flush_rows, flush_seconds, shared_ids, id_col,
+                                                parquet_options, column_order)
+        return ParquetResultSink(file_path, flush_rows, flush_seconds, shared_ids, id_col, parquet_options,
+                                 column_order)
+    if output_format == ARROW_FORMAT:
+        return ArrowResultSink(file_path, flush_rows, flush_seconds, shared_ids, id_col, column_order)
+    return CsvResultSink(file_path, flush_rows, flush_seconds, shared_ids, id_col, date_format, column_order)
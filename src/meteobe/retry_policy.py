@@ -0,0 +1,203 @@
+"""Module to retry failed Meteoblue requests with exponential backoff depending on the kind of error"""
+__package__ = 'meteobe'
+
+import asyncio
+import random
+import time
+
+import aiohttp
+from meteoblue_dataset_sdk.client import ApiError
+
+# Error classes
+THROTTLED = 'throttled'
+SERVER_ERROR = 'server_error'
+TIMEOUT = 'timeout'
+CONNECTION_ERROR = 'connection_error'
+PERMANENT = 'permanent'
+
+RETRYABLE_ERROR_CLASSES = [THROTTLED, SERVER_ERROR, TIMEOUT, CONNECTION_ERROR]
+
+# A rejected request whose error names one of its locations may succeed for its other locations on their own, any
+# other permanent error, e.g. an invalid API key or query, fails for every location alike
+LOCATION_REJECTION_STATUSES = [400, 422]
+LOCATION_ERROR_KEYWORDS = ['location', 'coordinate', 'latitude', 'longitude', 'geometry']
+
+# Request outcomes
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BASE_DELAY_SECONDS = 1.0
+DEFAULT_MAX_DELAY_SECONDS = 60.0
+DEFAULT_REQUEST_DEADLINE_SECONDS = 600.0
+
+
+class HttpStatusError(ApiError):
+    """
+    Error response of the Meteoblue API, keeping the HTTP status so that the error can be classified and the Retry-After
+    delay asked for by a throttled or unavailable server
+    """
+
+    def __init__(self, status: int, message: str, retry_after: float = None) -> None:
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    def __str__(self) -> str:
+        return f'HTTP {self.status}: {self.message}'
+
+
+def classify_error(exception: BaseException) -> str:
+    """
+    Classifies an error raised while querying Meteoblue.
+    param exception: The raised error.
+    :return: One of the error classes, only the error classes in RETRYABLE_ERROR_CLASSES are worth retrying.
+    """
+    if isinstance(exception, HttpStatusError):
+        if exception.status == 429:
+            return THROTTLED
+        if exception.status == 408 or exception.status >= 500:
+            return SERVER_ERROR
+        return PERMANENT
+    if isinstance(exception, (asyncio.TimeoutError, aiohttp.ServerTimeoutError)):
+        return TIMEOUT
+    if isinstance(exception, (ConnectionError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)):
+        return CONNECTION_ERROR
+    # e.g. no coordinates was found for the geo location or the query is invalid
+    return PERMANENT
+
+
+def rejects_locations(exception: BaseException) -> bool:
+    """
+    Tells whether Meteoblue rejected a request because of some of its locations rather than the request as a whole.
+    param exception: The raised error.
+    :return: True for a 400 or 422 HTTP error whose message names a location or coordinate.
+    """
+    if not isinstance(exception, HttpStatusError) or exception.status not in LOCATION_REJECTION_STATUSES:
+        return False
+    message: str = str(exception.message).lower()
+    return any(keyword in message for keyword in LOCATION_ERROR_KEYWORDS)
+
+
+class RequestRecord:
+    """Attempts and outcome of one request, kept for later analysis"""
+
+    def __init__(self, request_hash: str, description: str) -> None:
+        self.request_hash = request_hash
+        self.description = description
+        self.attempts = 0
+        self.outcome = FAILED
+        self.error_class = ''
+        self.error = ''
+        self.rejects_locations = False
+        self.elapsed_seconds = 0.0
+
+
+class RetryPolicy:
+    """Retries retryable errors with exponential backoff and full jitter until the request deadline"""
+
+    def __init__(self, max_attempts: int = DEFAULT_MAX_ATTEMPTS, base_delay: float = DEFAULT_BASE_DELAY_SECONDS,
+                 max_delay: float = DEFAULT_MAX_DELAY_SECONDS,
+                 deadline: float = DEFAULT_REQUEST_DEADLINE_SECONDS) -> None:
+        """
+        Instance of a RetryPolicy.
+        param max_attempts: The maximum number of attempts per request, including the first one.
+        param base_delay: The backoff delay cap of the first retry in seconds, doubled for every further retry.
+        param max_delay: The maximum backoff delay cap in seconds.
+        param deadline: The maximum number of seconds spent on a request, including all its attempts.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.records: list = []
+        self.failures: dict = {}
+        self.first_request_at = None
+
+    def backoff_delay(self, retry: int) -> float:
+        """
+        Gets a random delay between 0 and the exponential backoff cap of a retry.
+        param retry: The number of the retry, starting at 0.
+        :return: The delay in seconds.
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+    async def run(self, send_once, request_hash: str, description: str):
+        """
+        Sends a request until it succeeds, fails with a permanent error, runs out of attempts or passes the deadline.
+        Backing off only awaits, so other requests in flight carry on in the meantime, and waits at least as long as
+        the Retry-After header of the error response asks for.
+        param send_once: A coroutine function sending the request once.
+        param request_hash: The hash of the request payload.
+        param description: A short description of the request for the logs.
+        :return: The result of the request, or None if it failed.
+        """
+        record: RequestRecord = RequestRecord(request_hash, description)
+        self.records.append(record)
+        started_at: float = time.monotonic()
+        if self.first_request_at is None:
+            self.first_request_at = started_at
+
+        while True:
+            record.attempts += 1
+            retry_after = None
+            remaining: float = self.deadline - (time.monotonic() - started_at)
+            try:
+                result = await asyncio.wait_for(send_once(), timeout=max(remaining, 0.001))
+                record.outcome = SUCCEEDED
+                record.elapsed_seconds = time.monotonic() - started_at
+                return result
+            except Exception as exception:
+                record.error_class = classify_error(exception)
+                record.error = str(exception) or type(exception).__name__
+                record.rejects_locations = rejects_locations(exception)
+                retry_after = getattr(exception, 'retry_after', None)
+
+            record.elapsed_seconds = time.monotonic() - started_at
+            if record.error_class not in RETRYABLE_ERROR_CLASSES or record.attempts >= self.max_attempts:
+                break
+
+            delay: float = self.backoff_delay(record.attempts - 1)
+            if retry_after is not None:
+                # the server knows best when it can take the request again
+                delay = max(delay, retry_after)
+            if record.elapsed_seconds + delay >= self.deadline:
+                break
+
+            print(f'Got {record.error_class} error <{record.error}> for {description}, retrying in {delay:.1f} '
+                  f'seconds')
+            await asyncio.sleep(delay)
+
+        print(f'Failed to get data for {description} after <{record.attempts}> attempts, '
+              f'{record.error_class} error is {record.error}')
+        self.failures[request_hash] = record
+        return None
+
+    def failure_reason(self, request_hash: str) -> str:
+        """
+        Gets the reason a request failed.
+        param request_hash: The hash of the request payload.
+        :return: The error class and error of the last attempt, empty if the request did not fail.
+        """
+        record: RequestRecord = self.failures.get(request_hash)
+        if record is None:
+            return ''
+        return f'{record.error_class}: {record.error}'
+
+    def rejected_locations(self, request_hash: str) -> bool:
+        """
+        Tells whether a request failed because Meteoblue rejected some of its locations, see rejects_locations.
+        param request_hash: The hash of the request payload.
+        :return: False if the request did not fail or failed for another reason.
+        """
+        record: RequestRecord = self.failures.get(request_hash)
+        return record is not None and record.rejects_locations
+
+    def records_as_dicts(self) -> list:
+        return [vars(record) for record in self.records]
+
+    def print_summary(self):
+        retried: int = len([record for record in self.records if record.attempts > 1])
+        failed: int = len([record for record in self.records if record.outcome == FAILED])
+        print(f'<{len(self.records)}> requests sent to Meteoblue, <{retried}> of them were retried and <{failed}> '
+              f'failed')
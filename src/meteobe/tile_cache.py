@@ -0,0 +1,181 @@
+"""Module to keep decoded Meteoblue time series on disk as day tiles so that overlapping date ranges are fetched once"""
+__package__ = 'meteobe'
+
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from . import response_decoder
+from .response_cache import DEFAULT_TTL_KEY, SECONDS_PER_DAY, ResponseCache
+
+
+def missing_range(first_day: int, last_day: int, cached_days: set) -> tuple:
+    """
+    Gets the smallest range of days covering every day that is not cached, so that it can be fetched with one request.
+    Cached days inside the range are fetched again rather than split the range into several requests.
+    param first_day: The proleptic Gregorian ordinal of the first requested day.
+    param last_day: The proleptic Gregorian ordinal of the last requested day.
+    param cached_days: The ordinals of the cached days.
+    :return: A (first, last) tuple of day ordinals, or None if every day is cached.
+    """
+    missing: list = [day for day in range(first_day, last_day + 1) if day not in cached_days]
+    if len(missing) == 0:
+        return None
+    return missing[0], missing[-1]
+
+
+class TileCache:
+    """
+    SQLite store of the decoded values of one location, one query (domain, codes and aggregation) and one day per tile,
+    keyed by (location key, query hash, day)
+    """
+
+    def __init__(self, cache_file: str, ttl_days: dict) -> None:
+        """
+        Instance of a TileCache.
+        param cache_file: The SQLite file storing the tiles, created if it does not exist.
+        param ttl_days: Number of days a tile stays valid per domain, DEFAULT is used for other domains.
+        """
+        self.cache_file = cache_file
+        self.ttl_seconds: dict = {domain.upper(): float(days) * SECONDS_PER_DAY for domain, days in ttl_days.items()}
+        self.codes: dict = {}
+        self.read_tiles = 0
+        self.stored_tiles = 0
+
+        cache_dir = os.path.dirname(cache_file)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        self.connection = sqlite3.connect(cache_file, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS tiles (location_key TEXT NOT NULL, '
+                                'query_hash TEXT NOT NULL, day INTEGER NOT NULL, lat REAL NOT NULL, '
+                                'lon REAL NOT NULL, start INTEGER NOT NULL, stride INTEGER NOT NULL, '
+                                'data BLOB NOT NULL, expires_at REAL NOT NULL, '
+                                'PRIMARY KEY (location_key, query_hash, day)) WITHOUT ROWID')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS query_codes (query_hash TEXT PRIMARY KEY, '
+                                'domain TEXT NOT NULL, codes TEXT NOT NULL)')
+        self.connection.execute('DELETE FROM tiles WHERE expires_at < ?', (time.time(),))
+        tile_count: int = self.connection.execute('SELECT COUNT(*) FROM tiles').fetchone()[0]
+        print(f'Loaded tile cache <{cache_file}> with <{tile_count}> day tiles')
+
+    @staticmethod
+    def location_key(lat, lon) -> str:
+        return f'{lat},{lon}'
+
+    @staticmethod
+    def hash_query(query: dict) -> str:
+        return ResponseCache.hash_payload(query)
+
+    def ttl_for_domain(self, domain: str) -> float:
+        return self.ttl_seconds.get(str(domain).upper(), self.ttl_seconds.get(DEFAULT_TTL_KEY, 0))
+
+    def cached_days(self, location_key: str, query_hash: str, first_day: int, last_day: int) -> set:
+        """
+        Gets the days of a date range that are cached for a location and a query.
+        param location_key: The key of the location.
+        param query_hash: The hash of the query.
+        param first_day: The ordinal of the first day.
+        param last_day: The ordinal of the last day.
+        :return: A set of day ordinals.
+        """
+        rows: list = self.connection.execute('SELECT day FROM tiles WHERE location_key = ? AND query_hash = ? AND '
+                                             'day BETWEEN ? AND ? AND expires_at >= ?',
+                                             (location_key, query_hash, first_day, last_day, time.time())).fetchall()
+        return {row[0] for row in rows}
+
+    def store_block(self, location_key: str, query_hash: str, block: response_decoder.GeometryBlock, location: int,
+                    first_day: int, last_day: int) -> bool:
+        """
+        Splits the time series of one location of a geometry block into day tiles and stores them.
+        param location_key: The key of the location.
+        param query_hash: The hash of the query of the geometry.
+        param block: The decoded geometry.
+        param location: The index of the location in the geometry.
+        param first_day: The ordinal of the first requested day.
+        param last_day: The ordinal of the last requested day.
+        :return: True if the block was stored, False if its time steps do not split into days, e.g. monthly values.
+        """
+        day_count: int = last_day - first_day + 1
+        values: np.ndarray = block.location_values(location)
+        if not block.stride or SECONDS_PER_DAY % block.stride != 0 or \
+                len(values) != day_count * (SECONDS_PER_DAY // block.stride):
+            return False
+
+        ttl: float = self.ttl_for_domain(block.domain)
+        if ttl <= 0:
+            return False
+
+        if query_hash not in self.codes:
+            self.connection.execute('INSERT OR REPLACE INTO query_codes (query_hash, domain, codes) VALUES (?, ?, ?)',
+                                    (query_hash, block.domain, json.dumps([list(code) for code in block.codes])))
+            self.codes[query_hash] = (block.domain, block.codes)
+
+        steps_per_day: int = SECONDS_PER_DAY // block.stride
+        expires_at: float = time.time() + ttl
+        self.connection.execute('BEGIN')
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO tiles (location_key, query_hash, day, lat, lon, start, stride, data, expires_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(location_key, query_hash, first_day + k, block.lats[location], block.lons[location],
+              block.start + k * SECONDS_PER_DAY, block.stride,
+              sqlite3.Binary(np.ascontiguousarray(values[k * steps_per_day:(k + 1) * steps_per_day],
+                                                  dtype=np.float64).tobytes()), expires_at)
+             for k in range(day_count)])
+        self.connection.execute('COMMIT')
+        self.stored_tiles += day_count
+        return True
+
+    def get_codes(self, query_hash: str):
+        codes = self.codes.get(query_hash)
+        if codes is None:
+            row = self.connection.execute('SELECT domain, codes FROM query_codes WHERE query_hash = ?',
+                                          (query_hash,)).fetchone()
+            if row is None:
+                return None
+            codes = (row[0], [response_decoder.CodeInfo(*code) for code in json.loads(row[1])])
+            self.codes[query_hash] = codes
+        return codes
+
+    def load_block(self, location_key: str, query_hash: str, first_day: int,
+                   last_day: int) -> response_decoder.GeometryBlock:
+        """
+        Stitches the day tiles of a date range into a single location geometry block.
+        param location_key: The key of the location.
+        param query_hash: The hash of the query.
+        param first_day: The ordinal of the first day.
+        param last_day: The ordinal of the last day.
+        :return: A GeometryBlock, or None if a tile is missing or the tiles are not contiguous.
+        """
+        codes = self.get_codes(query_hash)
+        if codes is None:
+            return None
+        domain, code_infos = codes
+
+        rows: list = self.connection.execute('SELECT day, lat, lon, start, stride, data FROM tiles WHERE '
+                                             'location_key = ? AND query_hash = ? AND day BETWEEN ? AND ? AND '
+                                             'expires_at >= ? ORDER BY day',
+                                             (location_key, query_hash, first_day, last_day, time.time())).fetchall()
+        if len(rows) != last_day - first_day + 1:
+            return None
+
+        start: int = rows[0][3]
+        stride: int = rows[0][4]
+        for k, row in enumerate(rows):
+            if row[3] != start + k * SECONDS_PER_DAY or row[4] != stride:
+                return None
+
+        values: np.ndarray = np.frombuffer(b''.join([row[5] for row in rows]), dtype=np.float64)
+        values = values.reshape(1, -1, len(code_infos))
+        self.read_tiles += len(rows)
+        return response_decoder.GeometryBlock.from_values(domain, [rows[0][1]], [rows[0][2]], start,
+                                                          start + len(rows) * SECONDS_PER_DAY, stride, code_infos,
+                                                          values)
+
+    def close(self):
+        print(f'Tile cache stored <{self.stored_tiles}> and read <{self.read_tiles}> day tiles')
+        self.connection.close()
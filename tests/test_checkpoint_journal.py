@@ -0,0 +1,94 @@
+import json
+
+import numpy as np
+
+from meteobe.checkpoint_journal import CheckpointJournal
+
+
+def test_resume_reloads_completed_units(tmp_path):
+    journal_file = str(tmp_path / 'weather_checkpoint.jsonl')
+    journal = CheckpointJournal(journal_file, resume=False)
+    journal.record(1, 'hash-a', {'temperature': np.array([1.5, 2.5])})
+    journal.record('P2', 'hash-b', {'temperature': [3.0]}, failed_queries=['query-x'])
+    journal.close()
+
+    resumed = CheckpointJournal(journal_file, resume=True)
+    assert resumed.get(1, 'hash-a') == {'temperature': [1.5, 2.5]}
+    # IDs are compared as text, so an ID read as a number or as text finds the same unit
+    assert resumed.get('1', 'hash-a') == {'temperature': [1.5, 2.5]}
+    assert resumed.get_failed_queries('P2', 'hash-b') == ['query-x']
+    assert resumed.get_failed_queries(1, 'hash-a') == []
+    # a unit is only completed for the payload it was requested with
+    assert resumed.get(1, 'hash-b') is None
+    resumed.close()
+
+
+def test_resume_appends_and_later_records_replace_earlier_ones(tmp_path):
+    journal_file = str(tmp_path / 'weather_checkpoint.jsonl')
+    journal = CheckpointJournal(journal_file, resume=False)
+    journal.record('P1', 'hash-a', {'value': [1]}, failed_queries=['query-x'])
+    journal.close()
+
+    resumed = CheckpointJournal(journal_file, resume=True)
+    resumed.record('P1', 'hash-a', {'value': [2]})
+    resumed.close()
+
+    reloaded = CheckpointJournal(journal_file, resume=True)
+    assert reloaded.get('P1', 'hash-a') == {'value': [2]}
+    assert reloaded.get_failed_queries('P1', 'hash-a') == []
+    reloaded.close()
+
+
+def test_resume_only_keeps_the_position_of_each_result(tmp_path):
+    journal_file = str(tmp_path / 'weather_checkpoint.jsonl')
+    journal = CheckpointJournal(journal_file, resume=False)
+    journal.record('P1', 'hash-a', {'value': [1]})
+    journal.record('P2', 'hash-b', {'value': [2]}, failed_queries=['query-x'])
+    journal.close()
+
+    resumed = CheckpointJournal(journal_file, resume=True)
+    first_line: bytes = (tmp_path / 'weather_checkpoint.jsonl').read_bytes().splitlines(keepends=True)[0]
+    assert resumed.offsets == {('P1', 'hash-a'): 0, ('P2', 'hash-b'): len(first_line)}
+    assert resumed.failed_queries == {('P2', 'hash-b'): ['query-x']}
+    assert resumed.is_completed('P2', 'hash-b') and not resumed.is_completed('P2', 'hash-a')
+    # the results are read from the journal, also after a record was appended
+    resumed.record('P3', 'hash-c', {'value': [3]})
+    assert resumed.get('P2', 'hash-b') == {'value': [2]}
+    assert resumed.get('P1', 'hash-a') == {'value': [1]}
+    resumed.close()
+
+
+def test_resume_skips_an_incomplete_last_record(tmp_path):
+    journal_file = tmp_path / 'weather_checkpoint.jsonl'
+    complete: str = json.dumps({'id': 'P1', 'request_hash': 'hash-a', 'result': {'value': [1]}})
+    journal_file.write_text(complete + '\n' + complete[:20], encoding='UTF-8')
+
+    resumed = CheckpointJournal(str(journal_file), resume=True)
+    assert list(resumed.offsets) == [('P1', 'hash-a')]
+    # the incomplete record is removed, so that the next record starts on a line of its own
+    resumed.record('P2', 'hash-b', {'value': [2]})
+    resumed.close()
+
+    reloaded = CheckpointJournal(str(journal_file), resume=True)
+    assert reloaded.get('P1', 'hash-a') == {'value': [1]}
+    assert reloaded.get('P2', 'hash-b') == {'value': [2]}
+    reloaded.close()
+
+
+def test_new_run_starts_an_empty_journal_and_keeps_the_previous_one(tmp_path):
+    journal_file = str(tmp_path / 'weather_checkpoint.jsonl')
+    journal = CheckpointJournal(journal_file, resume=False)
+    journal.record('P1', 'hash-a', {'value': [1]})
+    journal.close()
+
+    restarted = CheckpointJournal(journal_file, resume=False)
+    assert restarted.get('P1', 'hash-a') is None
+    restarted.close()
+    assert (tmp_path / 'weather_checkpoint.jsonl').read_text(encoding='UTF-8') == ''
+    backups: list = list(tmp_path.glob('weather_checkpoint.jsonl.*'))
+    assert len(backups) == 1
+    # the previous journal can be renamed back to resume from it
+    backups[0].replace(journal_file)
+    resumed = CheckpointJournal(journal_file, resume=True)
+    assert resumed.get('P1', 'hash-a') == {'value': [1]}
+    resumed.close()
@@ -0,0 +1,276 @@
+import asyncio
+import threading
+import time
+from datetime import date
+
+import pytest
+from aiohttp import web
+from meteoblue_dataset_sdk.protobuf.dataset_pb2 import DatasetApiProtobuf
+
+from meteobe import configurator, constants
+from meteobe.client_pool import MeteoBlueClientPool, parse_retry_after
+from meteobe.meteoblue_data_extractor import MeteoBlueConnector
+from meteobe.rate_limiter import AdaptiveRateLimiter, AimdConcurrencyController, TokenBucket
+from meteobe.response_cache import ResponseCache
+from meteobe.retry_policy import SUCCEEDED, HttpStatusError, RetryPolicy
+
+QUERIES: list = [{'domain': 'ERA5T', 'codes': [{'code': 11, 'level': '2 m above gnd'}]}]
+
+
+def response_for(lat) -> DatasetApiProtobuf:
+    response = DatasetApiProtobuf()
+    response.geometries.add(domain='ERA5T', lats=[lat], lons=[0.0])
+    return response
+
+
+@pytest.fixture
+def connector(tmp_path):
+    """A connector with a response cache, whose client pool answers every query without sending it"""
+    response_cache = ResponseCache(str(tmp_path / 'response_cache.sqlite'), 1024 * 1024, {'DEFAULT': 1})
+    mb = MeteoBlueConnector('key', 'id', 'lat', 'lon', 'country_code',
+                            configurator.normalise_file_path(constants.CODE_JSON), response_cache)
+    sent: list = []
+
+    async def query(params: dict):
+        sent.append((threading.current_thread().name, params))
+        return response_for(params['geometry']['coordinates'][0][1])
+
+    mb.get_client_pool().query = query
+    mb.sent = sent
+    yield mb
+    mb.close()
+    response_cache.close()
+
+
+def test_concurrent_requests_use_the_response_cache_through_the_pool(connector):
+    requests: list = [(10.0, 0.0, date(2021, 1, 1), date(2021, 1, 31), QUERIES),
+                      (20.0, 0.0, date(2021, 1, 1), date(2021, 1, 31), QUERIES)]
+
+    first: list = connector.get_meteoblue_data_concurrently(requests)
+    assert [response.geometries[0].lats[0] for response in first] == [10.0, 20.0]
+    # the requests are sent on the event loop thread of the pool, the cache is used on the calling thread
+    assert [thread_name for thread_name, params in connector.sent] == ['meteoblue-client-pool'] * 2
+
+    second: list = connector.get_meteoblue_data_concurrently(requests + [(30.0, 0.0, date(2021, 1, 1),
+                                                                          date(2021, 1, 31), QUERIES)])
+    assert [response.geometries[0].lats[0] for response in second] == [10.0, 20.0, 30.0]
+    assert len(connector.sent) == 3
+    assert connector.response_cache.hits == 2
+
+
+def test_sync_requests_use_the_response_cache_through_the_pool(connector):
+    first = connector.get_meteoblue_data(10.0, 0.0, date(2021, 1, 1), date(2021, 1, 31), QUERIES)
+    second = connector.get_meteoblue_data(10.0, 0.0, date(2021, 1, 1), date(2021, 1, 31), QUERIES)
+
+    assert first.geometries[0].lats[0] == second.geometries[0].lats[0] == 10.0
+    assert [thread_name for thread_name, params in connector.sent] == ['meteoblue-client-pool']
+    assert (connector.response_cache.hits, connector.response_cache.misses) == (1, 1)
+
+
+class MockMeteoblue:
+    """A local dataset API answering the queries of a client pool, whose handlers can be replaced by the tests"""
+
+    def __init__(self, pool: MeteoBlueClientPool) -> None:
+        self.pool = pool
+        self.received: list = []
+        self.query_handler = self.answer
+        app = web.Application()
+        app.router.add_post('/dataset/query', self.query)
+        app.router.add_get('/queue/status/{job_id}', self.job_status)
+        app.router.add_get('/queue/result/{job_id}', self.job_result)
+        self.runner = web.AppRunner(app)
+        pool.run(self.runner.setup())
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        pool.run(site.start())
+        base_url: str = f'http://127.0.0.1:{self.runner.addresses[0][1]}'
+        pool.query_url = base_url + '/dataset/query?apikey={}'
+        pool.job_status_url = base_url + '/queue/status/{}'
+        pool.job_result_url = base_url + '/queue/result/{}'
+
+    async def query(self, request: web.Request) -> web.Response:
+        params: dict = await request.json()
+        self.received.append((request.query.get('apikey'), params))
+        return await self.query_handler(params)
+
+    @staticmethod
+    async def answer(params: dict) -> web.Response:
+        return web.Response(body=response_for(params['geometry']['coordinates'][0][1]).SerializeToString())
+
+    @staticmethod
+    async def job_status(request: web.Request) -> web.Response:
+        return web.json_response({'status': 'finished'})
+
+    @staticmethod
+    async def job_result(request: web.Request) -> web.Response:
+        return web.Response(body=response_for(float(request.match_info['job_id'])).SerializeToString())
+
+    def close(self):
+        self.pool.run(self.runner.cleanup())
+
+
+@pytest.fixture
+def mock_meteoblue():
+    pool = MeteoBlueClientPool('key', pool_size=2)
+    server = MockMeteoblue(pool)
+    yield server
+    server.close()
+    pool.close()
+
+
+def payload_for(lat: float) -> dict:
+    return MeteoBlueConnector.build_json_payload(lat, 0.0, date(2021, 1, 1), date(2021, 1, 31), QUERIES)
+
+
+def test_the_pool_sends_queries_and_decodes_their_protobuf_responses(mock_meteoblue):
+    params: dict = payload_for(10.0)
+
+    response: DatasetApiProtobuf = mock_meteoblue.pool.query_sync(params)
+
+    assert response.geometries[0].lats[0] == 10.0
+    api_key, sent = mock_meteoblue.received[0]
+    assert api_key == 'key'
+    assert sent == {**params, 'format': 'protobuf', 'runOnJobQueue': False}
+    # the payload of the caller is left as it is
+    assert params['format'] == 'json'
+
+
+def test_an_error_response_raises_an_http_status_error(mock_meteoblue):
+    async def reject(params: dict) -> web.Response:
+        return web.json_response({'error_message': 'invalid api key'}, status=401)
+
+    mock_meteoblue.query_handler = reject
+
+    with pytest.raises(HttpStatusError) as error:
+        mock_meteoblue.pool.query_sync(payload_for(10.0))
+    assert (error.value.status, error.value.message) == (401, 'invalid api key')
+    # the pool does not retry on its own, that is left to the retry policy
+    assert len(mock_meteoblue.received) == 1
+
+
+def test_a_query_meteoblue_only_runs_on_a_job_queue_is_sent_to_a_job_queue(mock_meteoblue):
+    async def job_queue(params: dict) -> web.Response:
+        if not params.get('runOnJobQueue'):
+            return web.json_response({'error_message': 'This job must be executed on a job-queue'}, status=400)
+        return web.json_response({'id': str(params['geometry']['coordinates'][0][1])})
+
+    mock_meteoblue.query_handler = job_queue
+
+    response: DatasetApiProtobuf = mock_meteoblue.pool.query_sync(payload_for(12.0))
+
+    assert response.geometries[0].lats[0] == 12.0
+    assert [params.get('runOnJobQueue') for api_key, params in mock_meteoblue.received] == [False, True]
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('3') == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('soon') is None
+    # an HTTP date in the past asks for no delay
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+
+
+@pytest.fixture
+def throttled_connector():
+    """A connector in async mode sending its queries to a mock Meteoblue, limited to 4 requests at a time"""
+    retry_policy = RetryPolicy(max_attempts=3, base_delay=0, max_delay=0)
+    rate_limiter = AdaptiveRateLimiter(TokenBucket(rate=0, capacity=1),
+                                       AimdConcurrencyController(initial_limit=4, min_limit=1, max_limit=4))
+    mb = MeteoBlueConnector('key', 'id', 'lat', 'lon', 'country_code',
+                            configurator.normalise_file_path(constants.CODE_JSON), pool_size=4,
+                            retry_policy=retry_policy, rate_limiter=rate_limiter)
+    server = MockMeteoblue(mb.get_client_pool())
+    yield mb, server
+    server.close()
+    mb.close()
+
+
+def requests_for(lats: list) -> list:
+    return [(lat, 0.0, date(2021, 1, 1), date(2021, 1, 31), QUERIES) for lat in lats]
+
+
+def test_throttled_requests_are_retried_after_the_delay_the_server_asks_for(throttled_connector):
+    mb, server = throttled_connector
+    throttled_at: dict = {}
+
+    async def throttle_once(params: dict) -> web.Response:
+        lat: float = params['geometry']['coordinates'][0][1]
+        if lat not in throttled_at:
+            throttled_at[lat] = time.monotonic()
+            return web.json_response({'error_message': 'too many requests'}, status=429, headers={'Retry-After': '1'})
+        assert time.monotonic() - throttled_at[lat] >= 1
+        return await MockMeteoblue.answer(params)
+
+    server.query_handler = throttle_once
+
+    responses: list = mb.get_meteoblue_data_concurrently(requests_for([10.0, 11.0, 12.0, 13.0]))
+
+    assert [response.geometries[0].lats[0] for response in responses] == [10.0, 11.0, 12.0, 13.0]
+    # every request is sent once more, after the Retry-After delay rather than the zero backoff of the policy
+    assert len(server.received) == 8
+    assert [(record.attempts, record.outcome) for record in mb.retry_policy.records] == [(2, SUCCEEDED)] * 4
+    assert all(record.elapsed_seconds >= 1 for record in mb.retry_policy.records)
+    # throttling lowers the concurrency limit
+    controller: AimdConcurrencyController = mb.rate_limiter.controller
+    assert controller.throttled == 4
+    assert controller.decreases >= 1 and controller.limit < 4
+
+
+def test_server_errors_are_retried_until_max_attempts(throttled_connector):
+    mb, server = throttled_connector
+
+    async def unavailable(params: dict) -> web.Response:
+        return web.json_response({'error_message': 'unavailable'}, status=503)
+
+    server.query_handler = unavailable
+
+    assert mb.get_meteoblue_data_concurrently(requests_for([10.0, 11.0])) == [None, None]
+    assert len(server.received) == 2 * 3
+    assert [record.attempts for record in mb.retry_policy.records] == [3, 3]
+    assert mb.retry_policy.failure_reason(mb.retry_policy.records[0].request_hash) == \
+        'server_error: HTTP 503: unavailable'
+    assert mb.rate_limiter.controller.server_errors == 6
+
+
+class ConcurrencyProbe:
+    """A mock Meteoblue handler answering after a delay and counting the requests it is answering at the same time"""
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, params: dict) -> web.Response:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            return await MockMeteoblue.answer(params)
+        finally:
+            self.in_flight -= 1
+
+
+def test_async_requests_stay_under_the_concurrency_limit(throttled_connector):
+    mb, server = throttled_connector
+    mb.rate_limiter.controller = AimdConcurrencyController(initial_limit=2, min_limit=1, max_limit=3)
+    server.query_handler = probe = ConcurrencyProbe(0.05)
+
+    responses: list = mb.get_meteoblue_data_concurrently(requests_for([float(lat) for lat in range(20)]))
+
+    assert [response.geometries[0].lats[0] for response in responses] == [float(lat) for lat in range(20)]
+    # the limit starts at 2 and is raised up to 3 while the server keeps up
+    assert probe.max_in_flight == mb.rate_limiter.controller.max_in_flight == 3
+    assert mb.rate_limiter.controller.increases > 0
+
+
+def test_async_requests_stay_under_the_connection_pool_size(throttled_connector):
+    mb, server = throttled_connector
+    mb.rate_limiter.controller = AimdConcurrencyController(max_limit=8, adaptive=False)
+    server.query_handler = probe = ConcurrencyProbe(0.05)
+    # the connector of the session is limited to the pool size of 4
+    mb.get_meteoblue_data_concurrently(requests_for([float(lat) for lat in range(16)]))
+
+    assert mb.rate_limiter.controller.max_in_flight == 8
+    assert probe.max_in_flight == 4
+    pool: MeteoBlueClientPool = mb.get_client_pool()
+    assert pool.connections_created == 4
+    assert pool.connections_reused == 12
@@ -0,0 +1,38 @@
+import pytest
+
+from meteobe.code_registry import CodeRegistry
+from meteobe.response_decoder import CodeInfo
+
+CODES_LST: list = [{'code': 11, 'variable': 'Temperature', 'defaultUnit': '°C'},
+                   {'code': 808, 'variable': 'Bulk Density', 'defaultUnit': 'kg/m³'}]
+
+
+def test_column_names_are_built_from_the_codes():
+    code_registry = CodeRegistry(CODES_LST)
+
+    assert code_registry.weather_column_name(CodeInfo(11, '2 m above gnd', 'max', '°C', 0, 0)) == \
+        'Temperature_(Max)_(°C)'
+    assert code_registry.soil_column_name(CodeInfo(808, 'aggregated', '', 'cg/cm³', 0, 30)) == \
+        'Bulk_Density_(0-30)_(cg/cm³)'
+    assert code_registry.lookup_variable(1) == ''
+
+
+def test_schema_ids_only_depend_on_the_column_name():
+    first_run = CodeRegistry(CODES_LST)
+    second_run = CodeRegistry(CODES_LST)
+    second_run.schema_id('Bulk_Density_(0-30)_(cg/cm³)')
+
+    assert first_run.schema_id('Temperature_(Max)_(°C)') == second_run.schema_id('Temperature_(Max)_(°C)') == \
+        1265096339
+    assert first_run.schema_id('Temperature_(Max)_(°C)') != first_run.schema_id('Temperature_(Min)_(°C)')
+    assert first_run.describe_column('Temperature_(Max)_(°C)') == {'schema_id': 1265096339,
+                                                                   'column': 'Temperature_(Max)_(°C)'}
+
+
+def test_columns_with_the_same_schema_id_are_rejected():
+    code_registry = CodeRegistry(CODES_LST)
+    # both names have the CRC-32 67725006
+    assert code_registry.schema_id('Column_3985819') == 67725006
+
+    with pytest.raises(ValueError, match='same schema id 67725006'):
+        code_registry.schema_id('Column_4420602')
@@ -0,0 +1,67 @@
+import os
+import pathlib
+
+import pytest
+
+from meteobe.input_loader import excel_cache_path, iter_cached_excel_chunks, optional_pyarrow
+
+openpyxl = pytest.importorskip('openpyxl')
+
+
+@pytest.fixture
+def pa():
+    pa = optional_pyarrow()
+    if pa is None:
+        pytest.skip('the Excel input cache needs pyarrow')
+    return pa
+
+
+def write_workbook(file_path: pathlib.Path, rows: list) -> pathlib.Path:
+    workbook = openpyxl.Workbook()
+    worksheet = workbook.active
+    worksheet.title = 'Trials'
+    worksheet.append(['plot_id', 'lat'])
+    for row in rows:
+        worksheet.append(row)
+    workbook.save(file_path)
+    return file_path
+
+
+def test_the_sheet_is_read_from_its_conversion_the_next_time(tmp_path, pa):
+    workbook: pathlib.Path = write_workbook(tmp_path / 'trials.xlsx', [['a', 1.5], ['b', 2.5], ['c', 3.5]])
+    first: list = list(iter_cached_excel_chunks(workbook, 'Trials', ['plot_id', 'lat'], 2))
+    assert excel_cache_path(workbook, 'Trials').exists()
+
+    second: list = list(iter_cached_excel_chunks(workbook, 'Trials', ['plot_id', 'lat'], 2))
+    assert [chunk['plot_id'].tolist() for chunk in second] == [chunk['plot_id'].tolist() for chunk in first] == \
+        [['a', 'b'], ['c']]
+
+
+def test_a_sheet_that_cannot_be_converted_is_still_read_completely(tmp_path, pa):
+    # the latitude of the second chunk is text, which does not fit the type of the first chunk
+    workbook: pathlib.Path = write_workbook(tmp_path / 'trials.xlsx', [['a', 1.5], ['b', 2.5], ['c', 'north'],
+                                                                     ['d', 4.5], ['e', 5.5]])
+    chunks: list = list(iter_cached_excel_chunks(workbook, 'Trials', ['plot_id', 'lat'], 2))
+
+    assert [chunk['plot_id'].tolist() for chunk in chunks] == [['a', 'b'], ['c', 'd'], ['e']]
+    assert os.listdir(tmp_path) == ['trials.xlsx']
+
+
+def test_a_conversion_left_unfinished_is_not_kept(tmp_path, pa):
+    workbook: pathlib.Path = write_workbook(tmp_path / 'trials.xlsx', [['a', 1.5], ['b', 2.5], ['c', 3.5]])
+    chunks = iter_cached_excel_chunks(workbook, 'Trials', ['plot_id', 'lat'], 2)
+    next(chunks)
+    chunks.close()
+
+    assert os.listdir(tmp_path) == ['trials.xlsx']
+
+
+def test_a_sheet_is_still_read_when_its_conversion_cannot_be_written(tmp_path, pa):
+    workbook: pathlib.Path = write_workbook(tmp_path / 'trials.xlsx', [['a', 1.5], ['b', 2.5], ['c', 3.5]])
+    # e.g. a read-only input directory, the conversion can not be created
+    os.mkdir(f'{excel_cache_path(workbook, "Trials")}.tmp')
+
+    chunks: list = list(iter_cached_excel_chunks(workbook, 'Trials', ['plot_id', 'lat'], 2))
+
+    assert [chunk['plot_id'].tolist() for chunk in chunks] == [['a', 'b'], ['c']]
+    assert not excel_cache_path(workbook, 'Trials').exists()
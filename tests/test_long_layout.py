@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+from meteobe.code_registry import CodeRegistry
+from meteobe.long_layout import LongLayout
+from meteobe.response_decoder import CodeInfo
+from meteobe.result_sink import ARROW_FORMAT, CSV_FORMAT, PARQUET_FORMAT, import_pyarrow
+
+CODE_REGISTRY = CodeRegistry([{'code': 11, 'variable': 'Temperature', 'defaultUnit': '°C'}])
+
+
+@pytest.mark.parametrize('output_format', [CSV_FORMAT, PARQUET_FORMAT, ARROW_FORMAT])
+def test_the_schema_is_loaded_back_from_the_format_it_was_written_in(tmp_path, output_format):
+    if output_format != CSV_FORMAT:
+        try:
+            import_pyarrow()
+        except ImportError as error:
+            pytest.skip(f'pyarrow is not available: {error}')
+    column_name: str = CODE_REGISTRY.weather_column_name(CodeInfo(11, '2 m above gnd', 'max', '°C', 0, 0))
+    first_run = LongLayout(CODE_REGISTRY, ['plot_id'], ['lat', 'lon'], 'Dates')
+    first_run.to_long({'plot_id': 'a', 'Dates': [0, 1], column_name: [1.0, 2.0]})
+    schema_file: str = first_run.write_schema(str(tmp_path / 'weather_schema'), output_format)
+    assert schema_file == str(tmp_path / f'weather_schema.{output_format}')
+    assert os.listdir(tmp_path) == [f'weather_schema.{output_format}']
+
+    # the columns resumed from a checkpoint journal are not named by the code registry of the next run
+    second_run = LongLayout(CodeRegistry([]), ['plot_id'], ['lat', 'lon'], 'Dates')
+    second_run.load_schema(str(tmp_path / 'weather_schema'), CSV_FORMAT)
+    second_run.to_long({'plot_id': 'a', 'Dates': [0, 1], column_name: [1.0, 2.0]})
+    description: dict = second_run.schema_frame().iloc[0].to_dict()
+    assert (description['column'], description['code'], description['aggregation'], description['unit']) == \
+        (column_name, 11, 'max', '°C')
@@ -0,0 +1,323 @@
+import json
+import re
+from datetime import date, datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+from meteoblue_dataset_sdk.protobuf.dataset_pb2 import DatasetApiProtobuf
+
+from meteobe import configurator, constants, meteoblue_data_extractor
+from meteobe.checkpoint_journal import CheckpointJournal
+from meteobe.client_pool import MeteoBlueClientPool
+from meteobe.meteoblue_data_extractor import END_DATE_COLUMN, EXECUTION_MODE_SYNC, FAILED_DOMAIN_COLUMN, \
+    FAILURE_REASON_COLUMN, START_DATE_COLUMN, ChunkExtractor, MeteoBlueConnector, RecordWriter
+from meteobe.request_planner import PlannedRequest, plan_soil_requests
+from meteobe.response_decoder import CodeInfo, GeometryBlock
+from meteobe.retry_policy import HttpStatusError, RetryPolicy
+from meteobe.tile_cache import TileCache
+
+QUERIES: list = [{'domain': 'ERA5T', 'codes': [{'code': 11, 'level': '2 m above gnd'}]}]
+# Meteoblue rejects every request containing this latitude
+REJECTED_LAT = 66.6
+
+
+def response_for(params: dict) -> DatasetApiProtobuf:
+    """A response with one geometry listing the requested locations"""
+    coordinates: list = params['geometry']['coordinates']
+    response = DatasetApiProtobuf()
+    response.geometries.add(domain='ERA5T', lats=[lat for lon, lat in coordinates],
+                            lons=[lon for lon, lat in coordinates])
+    return response
+
+
+@pytest.fixture
+def connector():
+    """A connector whose client pool answers every query without sending it, and rejects REJECTED_LAT"""
+    mb = MeteoBlueConnector('key', 'id', 'lat', 'lon', 'country_code',
+                            configurator.normalise_file_path(constants.CODE_JSON),
+                            retry_policy=RetryPolicy(max_attempts=2, base_delay=0))
+    sent: list = []
+
+    async def query(params: dict):
+        lats: list = [lat for lon, lat in params['geometry']['coordinates']]
+        sent.append(lats)
+        if REJECTED_LAT in lats:
+            raise HttpStatusError(400, 'invalid location')
+        return response_for(params)
+
+    mb.get_client_pool().query = query
+    mb.sent = sent
+    yield mb
+    mb.close()
+
+
+def plan_of(lats: list) -> PlannedRequest:
+    planned_request = PlannedRequest(date(2021, 1, 1), date(2021, 1, 31), QUERIES)
+    for row_index, lat in enumerate(lats):
+        planned_request.add_location([row_index], lat, 0.0)
+    return planned_request
+
+
+def test_a_rejected_location_only_fails_its_own_row(connector):
+    lats: list = [10.0, 11.0, REJECTED_LAT, 12.0, 13.0]
+    failure_reasons: list = [''] * len(lats)
+
+    row_responses: list = connector.get_meteoblue_data_by_plan([plan_of(lats)], len(lats), EXECUTION_MODE_SYNC,
+                                                               failure_reasons)
+
+    assert [None if response is None else response.blocks[0].lats[response.location]
+            for response in row_responses] == [10.0, 11.0, None, 12.0, 13.0]
+    assert failure_reasons == ['', '', 'permanent: HTTP 400: invalid location', '', '']
+    # the permanent error is not retried, the request is split in halves until the rejected location is on its own
+    assert connector.sent == [lats, [10.0, 11.0, REJECTED_LAT], [12.0, 13.0], [10.0, 11.0], [REJECTED_LAT]]
+
+
+def test_a_retryable_failure_is_not_split(connector):
+    async def query(params: dict):
+        connector.sent.append(params)
+        raise HttpStatusError(503, 'unavailable')
+
+    connector.get_client_pool().query = query
+    failure_reasons: list = [''] * 2
+
+    assert connector.get_meteoblue_data_by_plan([plan_of([10.0, 11.0])], 2, EXECUTION_MODE_SYNC,
+                                                failure_reasons) == [None, None]
+    assert len(connector.sent) == 2
+    assert failure_reasons == ['server_error: HTTP 503: unavailable'] * 2
+
+
+@pytest.mark.parametrize('error', [HttpStatusError(401, 'invalid api key'), HttpStatusError(403, 'forbidden'),
+                                   HttpStatusError(404, 'not found'), HttpStatusError(400, 'unknown domain ERA6'),
+                                   ValueError('payload bug')])
+def test_a_failure_not_naming_a_location_fails_the_whole_request_at_once(connector, error):
+    async def query(params: dict):
+        connector.sent.append(params)
+        raise error
+
+    connector.get_client_pool().query = query
+    failure_reasons: list = [''] * 4
+
+    assert connector.get_meteoblue_data_by_plan([plan_of([10.0, 11.0, 12.0, 13.0])], 4, EXECUTION_MODE_SYNC,
+                                                failure_reasons) == [None] * 4
+    # neither retried nor split
+    assert len(connector.sent) == 1
+    assert len(set(failure_reasons)) == 1 and failure_reasons[0].startswith('permanent: ')
+
+
+def test_a_rejected_soil_location_only_fails_its_own_rows(connector):
+    lats: list = [10.0, REJECTED_LAT, 11.0, 10.0]
+    plan: list = plan_soil_requests(lats, [0.0] * len(lats), '2020-01-01', '2020-01-01', QUERIES, 50, 4)
+
+    row_responses: list = connector.get_meteoblue_data_by_plan(plan, len(lats), EXECUTION_MODE_SYNC)
+
+    assert [None if response is None else response.blocks[0].lats[response.location]
+            for response in row_responses] == [10.0, None, 11.0, 10.0]
+
+
+def test_rows_without_dates_are_not_looked_up_in_the_tile_cache(connector, tmp_path):
+    tile_cache = TileCache(str(tmp_path / 'tiles.sqlite'), {'DEFAULT': 1})
+    # 2021-01-01 to 2021-01-02 is cached for the first row, so nothing is sent
+    block: GeometryBlock = GeometryBlock.from_values('ERA5T', [10.0], [0.0], 1609459200, 1609459200 + 2 * 86400,
+                                                     86400, [CodeInfo(11, '2 m above gnd', 'mean', 'C', 0, 0)],
+                                                     np.array([[[1.0], [2.0]]]))
+    first_day: int = date(2021, 1, 1).toordinal()
+    query_hash: str = tile_cache.hash_query(QUERIES[0])
+    assert tile_cache.store_block(TileCache.location_key(10.0, 0.0), query_hash, block, 0, first_day, first_day + 1)
+
+    row_responses: list = connector.get_meteoblue_data_by_tiles(
+        tile_cache, [(10.0, 0.0), (11.0, 0.0)], [date(2021, 1, 1), None], [date(2021, 1, 2), None],
+        [QUERIES, QUERIES], ['payload-a', 'payload-b'], [0, 1], 50, EXECUTION_MODE_SYNC)
+
+    assert row_responses[1] is None
+    assert row_responses[0].failed_queries == []
+    np.testing.assert_array_equal(row_responses[0].blocks[0].location_values(0), [[1.0], [2.0]])
+    assert connector.sent == []
+    tile_cache.close()
+
+
+INPUT_CSV = """plot_id,lat,lon,country_code,planting,harvest
+a,10.0,20.0,US,2021-01-05,2021-01-07
+b,11.0,21.0,BR,2021-02-01,
+c,12.0,22.0,US,,
+a,10.0,20.0,US,2021-01-05,2021-01-07
+d,,23.0,US,2021-03-01,2021-03-02
+b,11.0,21.0,BR,2021-02-01,
+e,13.0,23.0,CA,2021-01-10,2021-01-11
+b,11.0,21.0,BR,2021-02-01,
+f,14.0,24.0,US,2021-04-03,2021-04-03
+"""
+# Meteoblue rejects every request for the location of record f
+FAILING_LAT = 14.0
+
+
+async def query_all_codes(pool, params: dict) -> DatasetApiProtobuf:
+    """
+    A daily response for every query and location, whose values depend on the latitude, day and code, except for
+    FAILING_LAT.
+    """
+    first_day, last_day = [datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+                           for day in re.findall(r'\d{4}-\d{2}-\d{2}', params['timeIntervals'][0])]
+    start: int = int(first_day.timestamp())
+    day_count: int = (last_day - first_day).days + 1
+    coordinates: list = params['geometry']['coordinates']
+    if FAILING_LAT in [lat for lon, lat in coordinates]:
+        raise HttpStatusError(400, 'unknown error')
+    response = DatasetApiProtobuf()
+    for query in params['queries']:
+        geometry = response.geometries.add(domain=query['domain'], lats=[lat for lon, lat in coordinates],
+                                           lons=[lon for lon, lat in coordinates])
+        geometry.timeIntervals.add(start=start, end=start + day_count * 86400, stride=86400)
+        for code in query['codes']:
+            geometry.codes.add(code=code['code'], level=code.get('level', ''),
+                               aggregation=code.get('aggregation', ''), unit='x').timeIntervals.add(
+                data=[lat + day + code['code'] / 1000 for lon, lat in coordinates for day in range(day_count)])
+    return response
+
+
+def run_extract(tmp_path, monkeypatch, output_dir: str, input_chunk_rows: int, **ini_properties) -> dict:
+    """
+    Runs extract on INPUT_CSV against query_all_codes.
+    param ini_properties: Properties of the ini file overriding the defaults of the test.
+    :return: The text of each output file by its name, except the request log.
+    """
+    (tmp_path / 'trials.csv').write_text(INPUT_CSV)
+    properties: dict = {'input_file_dir': tmp_path, 'output_file_dir': tmp_path / output_dir,
+                        'source_data_filename': 'trials.csv', 'input_chunk_rows': input_chunk_rows,
+                        'flush_rows': 5, 'api_key': 'key', 'id_col': 'plot_id', 'latitude_col': 'lat',
+                        'longitude_col': 'lon', 'country_code_col': 'country_code',
+                        'user_interested_date_columns': 'planting,harvest', 'max_points_per_request': 2,
+                        **ini_properties}
+    with open(configurator.normalise_file_path(constants.INI_FILE)) as f:
+        ini: str = f.read()
+    for key, value in properties.items():
+        ini = re.sub(rf'^{key} = .*$', f'{key} = {value}', ini, flags=re.MULTILINE)
+    (tmp_path / 'mbe.ini').write_text(ini)
+
+    monkeypatch.setattr(meteoblue_data_extractor.constants, 'INI_FILE', str(tmp_path / 'mbe.ini'))
+    monkeypatch.setattr('builtins.input', lambda prompt: 'n')
+    monkeypatch.setattr(MeteoBlueClientPool, 'query', query_all_codes)
+    meteoblue_data_extractor.extract()
+    return {file.name: file.read_text(encoding='UTF-8-sig') for file in (tmp_path / output_dir).glob('*.csv')
+            if not file.name.endswith('_request_log.csv')}
+
+
+@pytest.mark.parametrize('input_chunk_rows, ini_properties', [
+    (2, {}), (1, {'flush_rows': 1}), (0, {'max_points_per_request': 1}), (0, {'split_queries_by_domain': 'y'})])
+def test_streamed_chunks_give_the_output_of_the_whole_file(tmp_path, monkeypatch, input_chunk_rows, ini_properties):
+    whole_file: dict = run_extract(tmp_path, monkeypatch, 'whole', 0)
+    streamed: dict = run_extract(tmp_path, monkeypatch, 'streamed', input_chunk_rows, **ini_properties)
+
+    assert streamed == whole_file
+    # every repeated record is written once, b only has a planting date
+    weather_rows: list = whole_file['trials_weather_data_only_best_domains.csv'].splitlines()[1:]
+    assert [row.split(',')[0] for row in weather_rows] == ['a'] * 5 + ['b'] * 3 + ['e'] * 4
+    soil_rows: list = whole_file['trials_soil_data_only.csv'].splitlines()[1:]
+    assert [row.split(',')[0] for row in soil_rows] == ['a', 'b', 'c', 'e']
+    # the record without dates and the record without latitude are reported once instead of being requested, the
+    # failed record is reported once per domain whatever the case of the domain in the ini file
+    failed_weather: list = whole_file['trials_weather_data_only_best_domains_failed.csv'].splitlines()
+    assert failed_weather == ['plot_id,lat,lon,country_code,Start_Date,End_Date,Failed_Domain,Failure_Reason',
+                              'c,12.0,22.0,US,,,,missing dates',
+                              'd,,23.0,US,2021-02-27,2021-03-02,,invalid coordinates'] + [
+        f'f,14.0,24.0,US,2021-04-01,2021-04-03,{domain},permanent: HTTP 400: unknown error'
+        for domain in ['NEMSGLOBAL', 'CPCGBAUS', 'ERA5T', 'ERA5']]
+    failed_soil: list = whole_file['trials_soil_data_only_failed.csv'].splitlines()
+    assert [row.split(',')[0] for row in failed_soil[1:]] == ['d', 'f']
+
+
+class ListSink:
+    """A result sink keeping the added results in memory"""
+
+    def __init__(self) -> None:
+        self.rows: list = []
+
+    def add(self, response_dict: dict):
+        self.rows.append(response_dict)
+
+    def close(self) -> int:
+        return len(self.rows)
+
+
+@pytest.fixture
+def chunk_extractor(tmp_path):
+    """A ChunkExtractor requesting QUERIES and a soil query from query_all_codes, writing to ListSinks"""
+    mb = MeteoBlueConnector('key', 'plot_id', 'lat', 'lon', 'country_code',
+                            configurator.normalise_file_path(constants.CODE_JSON),
+                            retry_policy=RetryPolicy(max_attempts=1, base_delay=0))
+    sent: list = []
+
+    async def query(params: dict):
+        sent.append([lat for lon, lat in params['geometry']['coordinates']])
+        return await query_all_codes(None, params)
+
+    mb.get_client_pool().query = query
+    weather_writer = RecordWriter(ListSink(), CheckpointJournal(str(tmp_path / 'weather.jsonl'), False))
+    soil_writer = RecordWriter(ListSink(), CheckpointJournal(str(tmp_path / 'soil.jsonl'), False))
+    extractor = ChunkExtractor(mb, weather_writer, soil_writer, mb.query_template([mb.build_soil_query(0, 30)]),
+                               mb.query_template(QUERIES))
+    extractor.sent = sent
+    yield extractor
+    weather_writer.close()
+    soil_writer.close()
+    mb.close()
+
+
+def journaled_ids(journal: CheckpointJournal) -> list:
+    with open(journal.journal_file) as f:
+        return [json.loads(line)['id'] for line in f]
+
+
+def chunk_of(rows: list) -> pd.DataFrame:
+    return pd.DataFrame(rows, columns=['plot_id', 'lat', 'lon', 'country_code', START_DATE_COLUMN, END_DATE_COLUMN])
+
+
+def test_a_weather_chunk_writes_and_journals_its_records_and_collects_its_failures(chunk_extractor):
+    weather_writer: RecordWriter = chunk_extractor.weather_writer
+    chunk_extractor.process_weather_chunk(chunk_of([
+        ['a', 10.0, 20.0, 'US', date(2021, 1, 5), date(2021, 1, 6)],
+        ['b', FAILING_LAT, 21.0, 'US', date(2021, 2, 5), date(2021, 2, 6)],
+        ['c', np.nan, 22.0, 'US', date(2021, 1, 5), date(2021, 1, 6)],
+        ['d', 13.0, 23.0, 'US', None, None]]))
+
+    assert [(row['plot_id'], len(row[meteoblue_data_extractor.DATES])) for row in weather_writer.sink.rows] == \
+        [('a', 2)]
+    assert journaled_ids(weather_writer.journal) == ['a']
+    failed_df: pd.DataFrame = weather_writer.failed_df()
+    assert failed_df[['plot_id', FAILED_DOMAIN_COLUMN, FAILURE_REASON_COLUMN]].values.tolist() == [
+        ['b', 'ERA5T', 'permanent: HTTP 400: unknown error'], ['c', '', 'invalid coordinates'],
+        ['d', '', 'missing dates']]
+    assert (weather_writer.failed_record_count, weather_writer.failure_count) == (3, 3)
+
+    # a record requested by an earlier chunk is neither requested nor written again
+    sent_count: int = len(chunk_extractor.sent)
+    chunk_extractor.process_weather_chunk(chunk_of([['a', 10.0, 20.0, 'US', date(2021, 1, 5), date(2021, 1, 6)]]))
+    assert len(chunk_extractor.sent) == sent_count
+    assert len(weather_writer.sink.rows) == 1
+
+
+def test_a_soil_chunk_requests_each_location_once_and_reports_invalid_coordinates(chunk_extractor):
+    soil_writer: RecordWriter = chunk_extractor.soil_writer
+    chunk_extractor.process_soil_chunk(chunk_of([['a', 10.0, 20.0, 'US', date(2021, 1, 5), date(2021, 1, 6)],
+                                                 ['a', 10.0, 20.0, 'US', date(2021, 3, 5), date(2021, 3, 6)],
+                                                 ['c', 95.0, 22.0, 'US', None, None]]))
+
+    assert [row['plot_id'] for row in soil_writer.sink.rows] == ['a']
+    assert chunk_extractor.sent == [[10.0]]
+    failed_df: pd.DataFrame = soil_writer.failed_df()
+    assert failed_df['plot_id'].tolist() == ['c']
+    assert FAILED_DOMAIN_COLUMN not in failed_df.columns
+
+
+def test_the_record_writer_adds_the_partition_column_and_only_journals_new_results(tmp_path):
+    writer = RecordWriter(ListSink(), CheckpointJournal(str(tmp_path / 'soil.jsonl'), False),
+                          country_code_col='country_code')
+
+    writer.write('a', 'hash-a', {'plot_id': 'a', 'Clay': 1.0}, 'US')
+    writer.write('b', 'hash-b', {'plot_id': 'b', 'Clay': 2.0}, 'BR', journal=False)
+
+    assert writer.sink.rows == [{'plot_id': 'a', 'Clay': 1.0, 'country_code': 'US'},
+                                {'plot_id': 'b', 'Clay': 2.0, 'country_code': 'BR'}]
+    assert journaled_ids(writer.journal) == ['a']
+    assert writer.failed_df().empty
+    assert writer.close() == 2
@@ -0,0 +1,67 @@
+from meteobe.query_compiler import CompiledQueries, compile_queries
+
+TEMP_MAX: dict = {'code': 11, 'level': '2 m elevation corrected', 'aggregation': 'max'}
+TEMP_MIN: dict = {'code': 11, 'level': '2 m elevation corrected', 'aggregation': 'min'}
+HUMIDITY_MAX: dict = {'code': 52, 'level': '2 m above gnd', 'aggregation': 'max'}
+PRECIPITATION: dict = {'code': 61, 'level': 'sfc', 'aggregation': 'sum'}
+
+
+def daily(domain: str, codes: list) -> dict:
+    return {'domain': domain, 'timeResolution': 'daily', 'codes': codes}
+
+
+def test_consecutive_queries_of_the_same_domain_are_merged():
+    # the best domains are read from the ini file in lower case
+    compiled: CompiledQueries = compile_queries([daily('NEMSGLOBAL', [HUMIDITY_MAX]),
+                                                 daily('nemsglobal', [TEMP_MAX, TEMP_MIN]),
+                                                 daily('CHIRPS2', [PRECIPITATION])])
+
+    assert compiled.queries == [daily('NEMSGLOBAL', [HUMIDITY_MAX, TEMP_MAX, TEMP_MIN]),
+                                daily('CHIRPS2', [PRECIPITATION])]
+    assert compiled.source_indices == [[0, 1], [2]]
+    assert compiled.source_query_count == 3
+
+
+def test_queries_with_other_settings_or_apart_are_not_merged():
+    hourly: dict = {'domain': 'NEMSGLOBAL', 'timeResolution': 'hourly', 'codes': [TEMP_MAX]}
+    queries: list = [daily('NEMSGLOBAL', [HUMIDITY_MAX]), hourly, daily('CHIRPS2', [PRECIPITATION]),
+                     daily('NEMSGLOBAL', [TEMP_MIN])]
+
+    compiled: CompiledQueries = compile_queries(queries)
+    # merging the last query into the first one would change the order of the codes and of the output columns
+    assert compiled.queries == queries
+    assert compiled.source_indices == [[0], [1], [2], [3]]
+
+
+def test_duplicate_codes_of_merged_queries_are_removed():
+    compiled: CompiledQueries = compile_queries([daily('NEMSGLOBAL', [TEMP_MAX, TEMP_MAX]),
+                                                 daily('NEMSGLOBAL', [TEMP_MIN, dict(reversed(TEMP_MAX.items()))])])
+
+    assert compiled.queries == [daily('NEMSGLOBAL', [TEMP_MAX, TEMP_MIN])]
+    assert compiled.removed_codes == 2
+
+
+def test_unmerged_queries_keep_the_base_query_whatever_the_other_domains():
+    base: dict = daily('NEMSGLOBAL', [HUMIDITY_MAX, TEMP_MAX])
+    # the temperature domain of one country is the domain of the base query, the other country has its own
+    same_domain: CompiledQueries = compile_queries([base, daily('NEMSGLOBAL', [TEMP_MAX, TEMP_MIN])], merge=False)
+    other_domain: CompiledQueries = compile_queries([base, daily('ERA5T', [TEMP_MAX, TEMP_MIN])], merge=False)
+
+    assert same_domain.queries[0] == other_domain.queries[0] == base
+    # the codes already requested by the base query are still removed
+    assert same_domain.queries[1] == daily('NEMSGLOBAL', [TEMP_MIN])
+    assert same_domain.source_indices == [[0], [1]]
+    assert same_domain.removed_codes == 1
+
+
+def test_unmerged_queries_left_without_codes_are_dropped():
+    # the temperature domain of the country is the domain of the base query, which already requests its codes
+    compiled: CompiledQueries = compile_queries([daily('NEMSGLOBAL', [HUMIDITY_MAX, TEMP_MAX, TEMP_MIN]),
+                                                 daily('nemsglobal', [TEMP_MAX, TEMP_MIN]),
+                                                 daily('CHIRPS2', [PRECIPITATION])], merge=False)
+
+    assert compiled.queries == [daily('NEMSGLOBAL', [HUMIDITY_MAX, TEMP_MAX, TEMP_MIN]),
+                                daily('CHIRPS2', [PRECIPITATION])]
+    assert compiled.source_indices == [[0], [2]]
+    assert compiled.dropped_indices == [1]
+    assert (compiled.source_query_count, compiled.removed_codes) == (3, 2)
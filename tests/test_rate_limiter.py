@@ -0,0 +1,141 @@
+import asyncio
+import time
+
+import pytest
+
+from meteobe.rate_limiter import AdaptiveRateLimiter, AimdConcurrencyController, TokenBucket
+from meteobe.retry_policy import PERMANENT, SERVER_ERROR, THROTTLED, HttpStatusError
+
+
+def test_token_bucket_starts_full_and_refills_at_its_rate():
+    bucket = TokenBucket(rate=10.0, capacity=5)
+    assert bucket.tokens == 5
+
+    bucket.tokens = 0
+    bucket.updated_at -= 0.2
+    bucket.refill()
+    assert bucket.tokens == pytest.approx(2, abs=0.1)
+
+    # the bucket never holds more than its capacity
+    bucket.updated_at -= 60
+    bucket.refill()
+    assert bucket.tokens == 5
+
+
+def test_token_bucket_allows_a_burst_then_paces_requests():
+    bucket = TokenBucket(rate=50.0, capacity=3)
+
+    async def acquire(count: int) -> float:
+        started_at: float = time.monotonic()
+        for _ in range(count):
+            await bucket.acquire()
+        return time.monotonic() - started_at
+
+    assert asyncio.run(acquire(3)) < 0.02
+    # 5 more tokens are added at 50 per second
+    assert asyncio.run(acquire(5)) >= 0.09
+
+
+def test_token_bucket_without_rate_does_not_wait():
+    bucket = TokenBucket(rate=0, capacity=1)
+
+    async def acquire_many():
+        for _ in range(1000):
+            await bucket.acquire()
+
+    asyncio.run(acquire_many())
+    assert bucket.tokens == 1
+
+
+def test_aimd_limit_starts_between_min_and_max():
+    assert AimdConcurrencyController(initial_limit=20, min_limit=1, max_limit=8).limit == 8
+    assert AimdConcurrencyController(initial_limit=0, min_limit=2, max_limit=8).limit == 2
+    assert AimdConcurrencyController(initial_limit=2, max_limit=8, adaptive=False).limit == 8
+
+
+def test_aimd_limit_increases_additively_on_success():
+    controller = AimdConcurrencyController(initial_limit=2, max_limit=3)
+    controller.on_success(0.1)
+    assert controller.limit == pytest.approx(2.5)
+    # about one more per round trip of limit requests, up to the maximum
+    for _ in range(10):
+        controller.on_success(0.1)
+    assert controller.limit == 3
+
+
+def test_aimd_limit_decreases_multiplicatively_once_per_round_trip():
+    controller = AimdConcurrencyController(initial_limit=8, min_limit=1, max_limit=8)
+    controller.average_latency = 10.0
+
+    controller.decrease(THROTTLED)
+    assert controller.limit == 4
+    # requests failing together within the same round trip only count once
+    controller.decrease(THROTTLED)
+    assert controller.limit == 4
+
+    controller.last_decrease_at -= 10.0
+    controller.decrease(SERVER_ERROR)
+    assert controller.limit == 2
+    for _ in range(5):
+        controller.last_decrease_at -= 10.0
+        controller.decrease(SERVER_ERROR)
+    assert controller.limit == 1
+
+
+def test_aimd_limit_decreases_on_latency_spikes_after_warmup():
+    controller = AimdConcurrencyController(initial_limit=8, max_limit=8, latency_spike_factor=3.0)
+    for _ in range(6):
+        controller.on_success(0.1)
+    assert controller.limit == 8
+
+    controller.on_success(1.0)
+    assert (controller.limit, controller.latency_spikes) == (4, 1)
+
+
+def test_non_adaptive_limit_stays_at_the_maximum():
+    controller = AimdConcurrencyController(initial_limit=2, max_limit=6, adaptive=False)
+    controller.decrease(THROTTLED)
+    controller.on_success(0.1)
+    assert controller.limit == 6
+
+
+def test_rate_limiter_keeps_requests_in_flight_under_the_limit_and_counts_errors():
+    controller = AimdConcurrencyController(initial_limit=3, max_limit=3)
+    limiter = AdaptiveRateLimiter(TokenBucket(0, 1), controller)
+
+    async def send_request():
+        await asyncio.sleep(0.01)
+        return 'response'
+
+    async def send_throttled():
+        raise HttpStatusError(429, 'slow down')
+
+    async def send_invalid():
+        raise HttpStatusError(400, 'invalid query')
+
+    async def run_all() -> list:
+        responses: list = await asyncio.gather(*[limiter.run(send_request) for _ in range(12)])
+        for send in [send_throttled, send_invalid]:
+            with pytest.raises(HttpStatusError):
+                await limiter.run(send)
+        return responses
+
+    assert asyncio.run(run_all()) == ['response'] * 12
+    assert controller.max_in_flight == 3
+    assert controller.in_flight == 0
+    assert controller.throttled == 1
+    assert controller.limit < 3
+    # a permanent error says nothing about the load of the server
+    assert controller.server_errors == 0
+    assert limiter.metrics()['throttled'] == 1
+
+
+def test_permanent_errors_do_not_change_the_limit():
+    controller = AimdConcurrencyController(initial_limit=4, max_limit=4)
+
+    async def release():
+        await controller.acquire()
+        await controller.release(0.1, PERMANENT)
+
+    asyncio.run(release())
+    assert (controller.limit, controller.decreases) == (4, 0)
@@ -0,0 +1,159 @@
+import math
+
+import numpy as np
+
+from meteobe.request_planner import grid_cell_key, plan_multipoint_requests, plan_soil_requests, \
+    plan_time_windows, snap_to_domain_grid_cells, snap_to_grid_cells, valid_coordinates
+
+GRID_RESOLUTIONS: dict = {'CHIRPS2': 0.05, 'NEMSGLOBAL': 0.25}
+
+
+def test_grid_cell_key_floors_to_the_cell_of_each_domain():
+    assert grid_cell_key(-20.01, -50.24, ['NEMSGLOBAL', 'chirps2', 'NEMSGLOBAL'], GRID_RESOLUTIONS, 4) == \
+        (('NEMSGLOBAL', -81, -201), ('chirps2', -401, -1005))
+    # a location on the edge of a cell belongs to the cell it starts, despite the floating point division
+    assert grid_cell_key(0.15, 0.3, ['CHIRPS2'], GRID_RESOLUTIONS, 4) == (('CHIRPS2', 3, 6),)
+    # domains without a grid resolution only round the coordinates
+    assert grid_cell_key(1.234567, 2.345678, ['ERA5T'], GRID_RESOLUTIONS, 2) == (('ERA5T', 1.23, 2.35),)
+
+
+def test_snap_to_grid_cells_uses_the_first_location_of_each_cell_of_every_domain():
+    lats: list = [10.01, 10.02, 10.07, 10.03]
+    lons: list = [20.01, 20.02, 20.01, 20.04]
+    domains: list = [['CHIRPS2', 'NEMSGLOBAL']] * 3 + [['NEMSGLOBAL']]
+
+    assert snap_to_grid_cells(lats, lons, domains, GRID_RESOLUTIONS, 4) == \
+        [(10.01, 20.01), (10.01, 20.01), (10.07, 20.01), (10.03, 20.04)]
+
+
+def test_snap_to_domain_grid_cells_snaps_each_domain_on_its_own():
+    lats: list = [10.01, 10.07, 10.12, 10.30]
+    lons: list = [20.01, 20.01, 20.01, 20.01]
+    domains: list = [['CHIRPS2', 'NEMSGLOBAL', 'ERA5T']] * 4
+
+    locations: list = snap_to_domain_grid_cells(lats, lons, domains, GRID_RESOLUTIONS, 4)
+    # the 0.05 degree cells of CHIRPS2 tell the first three locations apart, the 0.25 degree cell of NEMSGLOBAL does
+    # not, so NEMSGLOBAL is requested for the first location only
+    assert [location['CHIRPS2'] for location in locations] == [(10.01, 20.01), (10.07, 20.01), (10.12, 20.01),
+                                                               (10.3, 20.01)]
+    assert [location['NEMSGLOBAL'] for location in locations] == [(10.01, 20.01)] * 3 + [(10.3, 20.01)]
+    # ERA5T has no grid resolution here, so every location is requested as it is
+    assert [location['ERA5T'] for location in locations] == [(10.01, 20.01), (10.07, 20.01), (10.12, 20.01),
+                                                             (10.3, 20.01)]
+
+
+def test_valid_coordinates_are_finite_and_within_range():
+    assert valid_coordinates(-90, 180) and valid_coordinates('10.5', -20)
+    assert not valid_coordinates(math.nan, 20.0)
+    assert not valid_coordinates(10.0, math.inf)
+    assert not valid_coordinates(90.5, 20.0)
+    assert not valid_coordinates(10.0, -180.5)
+    assert not valid_coordinates(None, 20.0)
+
+
+def test_rows_with_invalid_coordinates_are_not_planned():
+    lats: list = [10.0, math.nan, 11.0, 95.0]
+    lons: list = [20.0, 20.0, 21.0, 20.0]
+    plan: list = plan_multipoint_requests(lats, lons, ['2021-01-01'] * 4, ['2021-01-31'] * 4, [['query']] * 4,
+                                          ['ERA5T'] * 4, 50)
+
+    assert len(plan) == 1
+    assert plan[0].location_rows == [[0], [2]]
+    assert (plan[0].lats, plan[0].lons) == ([10.0, 11.0], [20.0, 21.0])
+
+
+def test_invalid_coordinates_are_not_snapped():
+    locations: list = snap_to_grid_cells([10.01, math.nan], [20.01, 20.01], [['CHIRPS2']] * 2, GRID_RESOLUTIONS, 4)
+    assert locations[0] == (10.01, 20.01)
+    assert math.isnan(locations[1][0])
+
+    domain_locations: list = snap_to_domain_grid_cells([math.nan], [20.01], [['CHIRPS2']], GRID_RESOLUTIONS, 4)
+    assert math.isnan(domain_locations[0]['CHIRPS2'][0])
+
+
+def test_soil_requests_are_planned_once_per_rounded_location():
+    lats: list = [10.00001, 10.0, 11.0, 12.0, 10.0]
+    lons: list = [20.00001, 20.0, 21.0, 22.0, 20.0]
+    plan: list = plan_soil_requests(lats, lons, '2020-01-01', '2020-01-01', ['soil query'], 2, 4)
+
+    # the rows of the same rounded location share its result, whatever their dates
+    assert [planned_request.location_rows for planned_request in plan] == [[[0, 1, 4], [2]], [[3]]]
+    assert [(planned_request.lats, planned_request.lons) for planned_request in plan] == \
+        [([10.0, 11.0], [20.0, 21.0]), ([12.0], [22.0])]
+    assert all(planned_request.as_request()[2:] == ('2020-01-01', '2020-01-01', ['soil query'])
+               for planned_request in plan)
+
+
+def test_soil_rows_with_invalid_coordinates_are_not_planned():
+    lats: list = [math.nan, 10.0, math.nan, -91.0]
+    lons: list = [20.0, 20.0, 20.0, 20.0]
+    plan: list = plan_soil_requests(lats, lons, '2020-01-01', '2020-01-01', ['soil query'], 50, 4,
+                                    row_indices=[0, 1, 2, 3])
+
+    assert len(plan) == 1
+    assert plan[0].location_rows == [[1]]
+
+
+def test_time_windows_ignore_missing_dates():
+    dates: np.ndarray = np.array([['2021-03-10', '2021-03-01'],
+                                  ['NaT', '2021-05-20'],
+                                  ['NaT', 'NaT']], dtype='datetime64[ns]')
+    start_dates, end_dates = plan_time_windows(dates, -2, 3)
+
+    np.testing.assert_array_equal(start_dates, np.array(['2021-02-27', '2021-05-18', 'NaT'], dtype='datetime64[D]'))
+    np.testing.assert_array_equal(end_dates, np.array(['2021-03-13', '2021-05-23', 'NaT'], dtype='datetime64[D]'))
+    # a row without any date has no window, which is None once the dates are converted for the payloads
+    assert start_dates.astype(object).tolist()[2] is None
+
+
+def test_rows_are_packed_by_dates_and_group_key_up_to_the_limit():
+    lats: list = [10.0, 11.0, 12.0, 13.0, 14.0, 15.0]
+    lons: list = [20.0] * 6
+    start_dates: list = ['2021-01-01', '2021-01-01', '2021-02-01', '2021-01-01', '2021-01-01', '2021-01-01']
+    end_dates: list = ['2021-01-31', '2021-01-31', '2021-02-28', '2021-01-31', '2021-01-31', '2021-01-31']
+    group_keys: list = ['US', 'US', 'US', 'US', 'BR', 'US']
+    queries: list = [['US query'] if group_key == 'US' else ['BR query'] for group_key in group_keys]
+
+    plan: list = plan_multipoint_requests(lats, lons, start_dates, end_dates, queries, group_keys, 2)
+
+    # a full request is closed and the next row of its dates and group key starts a new one
+    assert [planned_request.location_rows for planned_request in plan] == [[[0], [1]], [[2]], [[3], [5]], [[4]]]
+    assert [planned_request.as_request()[2:] for planned_request in plan] == [
+        ('2021-01-01', '2021-01-31', ['US query']), ('2021-02-01', '2021-02-28', ['US query']),
+        ('2021-01-01', '2021-01-31', ['US query']), ('2021-01-01', '2021-01-31', ['BR query'])]
+
+
+def test_one_point_per_request_plans_every_row_on_its_own():
+    plan: list = plan_multipoint_requests([10.0, 11.0, 12.0], [20.0] * 3, ['2021-01-01'] * 3, ['2021-01-31'] * 3,
+                                          [['query']] * 3, ['US'] * 3, 1, row_indices=[2, 0])
+
+    assert [planned_request.location_rows for planned_request in plan] == [[[2]], [[0]]]
+    assert [(planned_request.lats, planned_request.lons) for planned_request in plan] == \
+        [([12.0], [20.0]), ([10.0], [20.0])]
+
+
+def test_split_halves_a_request_keeping_its_dates_and_queries():
+    plan: list = plan_multipoint_requests([10.0, 11.0, 12.0], [20.0] * 3, ['2021-01-01'] * 3, ['2021-01-31'] * 3,
+                                          [['query']] * 3, ['US'] * 3, 50)
+    halves: list = plan[0].split()
+
+    assert [half.location_rows for half in halves] == [[[0], [1]], [[2]]]
+    assert [half.lats for half in halves] == [[10.0, 11.0], [12.0]]
+    assert all(half.as_request()[2:] == ('2021-01-01', '2021-01-31', ['query']) for half in halves)
+
+
+def test_rows_with_the_same_payload_are_requested_once_and_fanned_out():
+    lats: list = [10.0, 10.0, 11.0, 10.0]
+    lons: list = [20.0] * 4
+    payload_hashes: list = ['payload-a', 'payload-a', 'payload-b', 'payload-a']
+    plan: list = plan_multipoint_requests(lats, lons, ['2021-01-01'] * 4, ['2021-01-31'] * 4, [['query']] * 4,
+                                          ['US'] * 4, 1, payload_hashes=payload_hashes)
+
+    # the rows of a payload share its location, even when its request is full, and take no room in another request
+    assert [planned_request.location_rows for planned_request in plan] == [[[0, 1, 3]], [[2]]]
+    assert [planned_request.lats for planned_request in plan] == [[10.0], [11.0]]
+
+    # without payload hashes every row is its own location
+    plan = plan_multipoint_requests(lats, lons, ['2021-01-01'] * 4, ['2021-01-31'] * 4, [['query']] * 4, ['US'] * 4,
+                                    50)
+    assert plan[0].location_rows == [[0], [1], [2], [3]]
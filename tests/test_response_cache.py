@@ -0,0 +1,72 @@
+import pytest
+
+from meteobe import response_cache as response_cache_module
+from meteobe.response_cache import SECONDS_PER_DAY, ResponseCache
+
+
+class Clock:
+    """A wall clock that only moves when told to"""
+
+    def __init__(self, now: float = 1_600_000_000.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache_module.time, 'time', clock)
+    return clock
+
+
+def test_payloads_are_hashed_independently_of_key_order():
+    assert ResponseCache.hash_payload({'a': 1, 'b': [1, 2]}) == ResponseCache.hash_payload({'b': [1, 2], 'a': 1})
+    assert ResponseCache.hash_payload({'a': 1}) != ResponseCache.hash_payload({'a': 2})
+
+
+def test_a_response_lives_as_long_as_its_shortest_lived_domain(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), 1024, {'ERA5T': 7, 'ERA5': 365, 'DEFAULT': 1})
+
+    assert cache.ttl_for_payload({'queries': [{'domain': 'ERA5'}]}) == 365 * SECONDS_PER_DAY
+    assert cache.ttl_for_payload({'queries': [{'domain': 'ERA5'}, {'domain': 'era5t'}]}) == 7 * SECONDS_PER_DAY
+    assert cache.ttl_for_payload({'queries': [{'domain': 'CHIRPS2'}]}) == SECONDS_PER_DAY
+    cache.close()
+
+
+def test_expired_responses_are_misses_and_dropped_by_the_next_run(tmp_path, clock):
+    cache_file: str = str(tmp_path / 'cache.sqlite')
+    cache = ResponseCache(cache_file, 1024, {'DEFAULT': 1})
+    cache.set('short', b'short lived', 60)
+    cache.set('long', b'long lived', 3600)
+    # a domain without time to live is not stored
+    cache.set('none', b'not stored', 0)
+
+    clock.now += 120
+    assert cache.get('short') is None
+    assert cache.get('long') == b'long lived'
+    assert cache.get('none') is None
+    assert (cache.hits, cache.misses) == (1, 2)
+    cache.close()
+
+    next_run = ResponseCache(cache_file, 1024, {'DEFAULT': 1})
+    assert next_run.size_bytes == len(b'long lived')
+    next_run.close()
+
+
+def test_the_least_recently_used_responses_are_evicted(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), 30, {'DEFAULT': 1})
+    for key in ['a', 'b', 'c']:
+        cache.set(key, key.encode() * 10, 3600)
+        clock.now += 1
+    assert cache.size_bytes == 30
+
+    # reading a makes b the least recently used response, which makes room for d
+    assert cache.get('a') == b'a' * 10
+    clock.now += 1
+    cache.set('d', b'd' * 10, 3600)
+
+    assert cache.size_bytes == 30
+    assert [cache.get(key) is not None for key in ['a', 'b', 'c', 'd']] == [True, False, True, True]
+    cache.close()
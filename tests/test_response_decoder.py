@@ -0,0 +1,66 @@
+import time
+
+import numpy as np
+import pytest
+from meteoblue_dataset_sdk.protobuf.dataset_pb2 import DatasetApiProtobuf
+
+from meteobe.response_decoder import build_time_axis, decode_locations
+
+# 2021-03-27 00:00 UTC, the night before the change to summer time in Central Europe
+MARCH_27_2021 = 1616803200
+
+
+def response_of(location_count: int, step_count: int, codes: list = (11, 61)) -> DatasetApiProtobuf:
+    """A response of one geometry whose values are location * 100 + step * 10 + code index"""
+    response = DatasetApiProtobuf()
+    geometry = response.geometries.add(domain='ERA5T', lats=[10.0 + i for i in range(location_count)],
+                                       lons=[20.0] * location_count)
+    geometry.timeIntervals.add(start=1609459200, end=1609459200 + step_count * 86400, stride=86400)
+    for j, code in enumerate(codes):
+        geometry.codes.add(code=code, level='sfc', aggregation='mean', unit='x').timeIntervals.add(
+            data=[location * 100 + step * 10 + j for location in range(location_count) for step in range(step_count)])
+    return response
+
+
+def test_a_multipoint_response_is_split_into_one_result_per_location():
+    location_results: list = decode_locations(response_of(3, 2), 3)
+
+    assert [location_result.location for location_result in location_results] == [0, 1, 2]
+    block = location_results[2].blocks[0]
+    assert block.lats[location_results[2].location] == 12.0
+    np.testing.assert_array_equal(block.location_values(2), [[200, 201], [210, 211]])
+
+
+def test_a_response_with_the_wrong_number_of_locations_is_not_split():
+    assert decode_locations(response_of(2, 2), 3) == [None] * 3
+    assert decode_locations(response_of(4, 2), 3) == [None] * 3
+    assert decode_locations(None, 2) == [None] * 2
+
+
+@pytest.fixture
+def zurich_time(monkeypatch):
+    """Runs a test in the Europe/Zurich time zone"""
+    monkeypatch.setenv('TZ', 'Europe/Zurich')
+    time.tzset()
+    build_time_axis.cache_clear()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+    build_time_axis.cache_clear()
+
+
+def test_a_time_axis_crossing_a_daylight_saving_time_change_gets_the_offset_of_each_time(zurich_time):
+    time_axis: np.ndarray = build_time_axis(MARCH_27_2021, MARCH_27_2021 + 3 * 86400, 86400)
+
+    # the clocks moved forward at 01:00 UTC on 2021-03-28
+    np.testing.assert_array_equal(time_axis, np.array(['2021-03-27T01:00:00', '2021-03-28T01:00:00',
+                                                       '2021-03-29T02:00:00'], dtype='datetime64[s]'))
+    assert not time_axis.flags.writeable
+
+
+def test_a_time_axis_within_one_utc_offset_is_shifted_at_once(zurich_time):
+    time_axis: np.ndarray = build_time_axis(MARCH_27_2021 + 86400 * 7, MARCH_27_2021 + 86400 * 7 + 3 * 3600, 3600)
+
+    np.testing.assert_array_equal(time_axis, np.array(['2021-04-03T02:00:00', '2021-04-03T03:00:00',
+                                                       '2021-04-03T04:00:00'], dtype='datetime64[s]'))
+    assert build_time_axis(MARCH_27_2021, MARCH_27_2021, 3600).shape == (0,)
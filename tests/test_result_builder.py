@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from meteobe.result_builder import ResultBuilder
+
+
+def test_scalars_are_repeated_for_every_row_of_their_location():
+    builder = ResultBuilder()
+    builder.add({'plot_id': 'a', 'lat': 10.0, 'Temp': np.array([1.0, 2.0, 3.0])})
+    builder.add({'plot_id': 'b', 'lat': 11.0, 'Temp': [4.0]})
+
+    pd.testing.assert_frame_equal(builder.to_dataframe(), pd.DataFrame({
+        'plot_id': ['a', 'a', 'a', 'b'], 'lat': [10.0, 10.0, 10.0, 11.0], 'Temp': [1.0, 2.0, 3.0, 4.0]}))
+    assert builder.row_count == 4
+
+
+def test_missing_columns_are_filled_with_nan_on_either_side():
+    builder = ResultBuilder()
+    builder.add({'plot_id': 'a', 'Temp': [1.0, 2.0]})
+    builder.add({'plot_id': 'b', 'Precipitation': [3.0]})
+    builder.add({'plot_id': 'c', 'Temp': [4.0]})
+
+    pd.testing.assert_frame_equal(builder.to_dataframe(), pd.DataFrame({
+        'plot_id': ['a', 'a', 'b', 'c'], 'Temp': [1.0, 2.0, np.nan, 4.0],
+        'Precipitation': [np.nan, np.nan, 3.0, np.nan]}))
+
+
+def test_missing_datetime_columns_are_filled_with_nat():
+    dates: np.ndarray = np.array(['2021-01-01', '2021-01-02'], dtype='datetime64[s]')
+    builder = ResultBuilder()
+    # e.g. a soil-like result without dates before and after a weather-like result with dates
+    builder.add({'plot_id': 'a', 'Temp': np.array([1.0], dtype=np.float32)})
+    builder.add({'plot_id': 'b', 'Dates': dates, 'Temp': np.array([2.0, 3.0], dtype=np.float32)})
+    builder.add({'plot_id': 'c', 'Count': np.array([4])})
+
+    batch: pd.DataFrame = builder.to_dataframe()
+    assert batch['Dates'].dtype == np.dtype('datetime64[s]')
+    assert batch['Temp'].dtype == np.float32
+    assert batch['Count'].dtype == np.float64
+    assert batch['Dates'].isna().tolist() == [True, False, False, True]
+    # the padded batch can be concatenated with a batch whose dates are all present
+    other: pd.DataFrame = pd.DataFrame({'plot_id': ['d'], 'Dates': dates[:1], 'Temp': np.array([5.0], np.float32)})
+    assert pd.concat([batch, other], ignore_index=True)['Dates'].dtype == np.dtype('datetime64[s]')
+
+
+def test_a_location_with_arrays_of_different_lengths_is_rejected_without_partial_rows():
+    builder = ResultBuilder()
+    builder.add({'plot_id': 'a', 'Temp': [1.0]})
+
+    with pytest.raises(ValueError, match='same length'):
+        builder.add({'plot_id': 'b', 'Temp': [2.0, 3.0], 'Precipitation': [4.0]})
+
+    assert builder.row_count == 1
+    pd.testing.assert_frame_equal(builder.to_dataframe(), pd.DataFrame({'plot_id': ['a'], 'Temp': [1.0]}))
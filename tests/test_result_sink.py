@@ -0,0 +1,124 @@
+import csv
+import os
+
+import numpy as np
+import pytest
+
+from meteobe.code_registry import SOIL_LAYOUT, WEATHER_LAYOUT, CodeRegistry, ColumnOrder
+from meteobe.result_sink import CSV_ENCODING, CsvResultSink, ParquetOptions, PartitionedParquetResultSink, \
+    ResultSink, import_pyarrow
+
+CODE_REGISTRY = CodeRegistry([{'code': 11, 'variable': 'Temperature'}, {'code': 61, 'variable': 'Precipitation Total'},
+                              {'code': 735, 'variable': 'Wind Direction Dominant'},
+                              {'code': 721, 'variable': 'UV Radiation'}, {'code': 808, 'variable': 'Bulk Density'}])
+WEATHER_QUERIES: list = [
+    {'domain': 'NEMSGLOBAL', 'codes': [{'code': 11, 'aggregation': 'max'}, {'code': 11, 'aggregation': 'mean'}]},
+    {'domain': 'CHIRPS2', 'codes': [{'code': 61, 'aggregation': 'sum'}]},
+    {'domain': 'ERA5T', 'codes': [{'code': 735}]},
+    {'domain': 'ERA5', 'codes': [{'code': 721}],
+     'transformations': [{'type': 'aggregateDaily', 'aggregation': 'mean'}]}]
+
+
+def weather_column_order() -> ColumnOrder:
+    column_order = ColumnOrder(CODE_REGISTRY, WEATHER_LAYOUT, ['plot_id', 'lat', 'lon', 'Dates'])
+    column_order.add_queries(WEATHER_QUERIES)
+    return column_order
+
+
+def read_csv(file_path: str) -> list:
+    with open(file_path, encoding=CSV_ENCODING, newline='') as file:
+        return list(csv.reader(file))
+
+
+def test_columns_are_ranked_by_the_codes_of_the_queries():
+    column_order: ColumnOrder = weather_column_order()
+    columns: list = ['UV_Radiation_(Mean)_(Wh/m²)', 'Precipitation_Total_(Sum)_(mm)', 'Dates',
+                     'Temperature_(Mean)_(°C)', 'country_code', 'Wind_Direction_Dominant_(None)_(°)', 'plot_id',
+                     'Temperature_(Max)_(°C)']
+    assert sorted(columns, key=column_order.rank) == [
+        'plot_id', 'Dates', 'Temperature_(Max)_(°C)', 'Temperature_(Mean)_(°C)', 'Precipitation_Total_(Sum)_(mm)',
+        'Wind_Direction_Dominant_(None)_(°)', 'UV_Radiation_(Mean)_(Wh/m²)', 'country_code']
+
+
+def test_soil_columns_are_ranked_by_depth():
+    column_order = ColumnOrder(CODE_REGISTRY, SOIL_LAYOUT, ['plot_id'])
+    column_order.add_queries([{'codes': [{'code': 808, 'level': 'aggregated', 'startDepth': 0, 'endDepth': 30}]},
+                              {'codes': [{'code': 808, 'level': 'aggregated', 'startDepth': 0, 'endDepth': 60}]}])
+    assert sorted(['Bulk_Density_(0-60)_(cg/cm³)', 'plot_id', 'Bulk_Density_(0-30)_(cg/cm³)'],
+                  key=column_order.rank) == \
+        ['plot_id', 'Bulk_Density_(0-30)_(cg/cm³)', 'Bulk_Density_(0-60)_(cg/cm³)']
+
+
+def test_the_header_does_not_depend_on_the_first_record(tmp_path):
+    sink = CsvResultSink(str(tmp_path / 'weather'), flush_rows=1, column_order=weather_column_order())
+    # the precipitation domain failed for the first record, which is written before the second record arrives
+    sink.add({'plot_id': 'a', 'Temperature_(Max)_(°C)': np.array([1.0]), 'UV_Radiation_(Mean)_(Wh/m²)': [2.0]})
+    sink.add({'plot_id': 'b', 'Precipitation_Total_(Sum)_(mm)': [3.0], 'Temperature_(Max)_(°C)': [4.0],
+              'UV_Radiation_(Mean)_(Wh/m²)': [5.0]})
+    assert sink.close() == 2
+
+    assert read_csv(sink.file_path) == [
+        ['plot_id', 'Temperature_(Max)_(°C)', 'Precipitation_Total_(Sum)_(mm)', 'UV_Radiation_(Mean)_(Wh/m²)'],
+        ['a', '1.0', '', '2.0'], ['b', '4.0', '3.0', '5.0']]
+
+
+def test_a_sink_must_implement_the_part_files():
+    class IncompleteSink(ResultSink):
+        def open_part(self, part_file: str):
+            pass
+
+    with pytest.raises(TypeError):
+        IncompleteSink('weather')
+
+
+def partitioned_sink(file_path: str) -> PartitionedParquetResultSink:
+    try:
+        import_pyarrow()
+    except ImportError as error:
+        pytest.skip(f'pyarrow is not available: {error}')
+    return PartitionedParquetResultSink(file_path, flush_rows=2, id_col='plot_id',
+                                        options=ParquetOptions(float64_columns=['lat'], dates_col='Dates',
+                                                               partition_cols=['country_code', 'year']))
+
+
+def test_the_files_of_a_partitioned_dataset_get_one_schema(tmp_path):
+    sink = partitioned_sink(str(tmp_path / 'weather'))
+    # the precipitation column only arrives with the second batch
+    sink.add({'plot_id': 'a', 'country_code': 'US', 'lat': 10.0, 'Dates': ['2020-12-31', '2021-01-01'],
+              'Temp': [1.0, 2.0]})
+    sink.add({'plot_id': 'b', 'country_code': 'BR', 'lat': 11.0, 'Dates': ['2021-01-01', '2021-01-02'],
+              'Temp': [3.0, 4.0], 'Precipitation': [5.0, 6.0]})
+    assert sink.close() == 4
+
+    part_files: list = sorted(str(path.relative_to(tmp_path / 'weather.parquet'))
+                              for path in (tmp_path / 'weather.parquet').rglob('*.parquet'))
+    assert part_files == [os.path.join('country_code=BR', 'year=2021', 'part-00001.parquet'),
+                          os.path.join('country_code=US', 'year=2020', 'part-00000.parquet'),
+                          os.path.join('country_code=US', 'year=2021', 'part-00000.parquet')]
+    schemas: list = [import_pyarrow().parquet.read_schema(tmp_path / 'weather.parquet' / part_file)
+                     for part_file in part_files]
+    assert all(schema.equals(schemas[0]) for schema in schemas)
+    assert schemas[0].names == ['plot_id', 'lat', 'Dates', 'Temp', 'Precipitation']
+    assert [str(schemas[0].field(name).type) for name in ['lat', 'Temp', 'Precipitation']] == \
+        ['double', 'float', 'float']
+
+    table = import_pyarrow().parquet.read_table(tmp_path / 'weather.parquet').sort_by('Temp')
+    assert table.column('Precipitation').to_pylist() == [None, None, 5.0, 6.0]
+    assert table.column('country_code').to_pylist() == ['US', 'US', 'BR', 'BR']
+
+
+def test_a_partitioned_dataset_replaces_the_previous_output_when_it_is_finished(tmp_path):
+    previous_file = tmp_path / 'weather.parquet' / 'country_code=CA' / 'part-00000.parquet'
+    previous_file.parent.mkdir(parents=True)
+    previous_file.write_bytes(b'previous run')
+
+    sink = partitioned_sink(str(tmp_path / 'weather'))
+    sink.add({'plot_id': 'a', 'country_code': 'US', 'lat': 10.0, 'Dates': ['2021-01-01', '2021-01-02'],
+              'Temp': [1.0, 2.0]})
+    # the batch is written to the temporary directory, the previous output is untouched until the sink is closed
+    assert os.listdir(tmp_path / 'weather.parquet.tmp') == ['country_code=US']
+    assert previous_file.read_bytes() == b'previous run'
+
+    assert sink.close() == 2
+    assert not (tmp_path / 'weather.parquet.tmp').exists()
+    assert os.listdir(tmp_path / 'weather.parquet') == ['country_code=US']
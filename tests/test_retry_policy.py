@@ -0,0 +1,106 @@
+import asyncio
+
+import aiohttp
+
+from meteobe.retry_policy import CONNECTION_ERROR, FAILED, PERMANENT, SERVER_ERROR, SUCCEEDED, THROTTLED, TIMEOUT, \
+    HttpStatusError, RetryPolicy, classify_error, \
+    rejects_locations
+
+
+def failing_then_succeeding(errors: list, result='response'):
+    """A send_once coroutine function raising the given errors one after the other, then returning the result"""
+    remaining: list = list(errors)
+
+    async def send_once():
+        if remaining:
+            raise remaining.pop(0)
+        return result
+
+    return send_once
+
+
+def test_classify_error():
+    assert classify_error(HttpStatusError(429, 'too many requests')) == THROTTLED
+    assert classify_error(HttpStatusError(408, 'request timeout')) == SERVER_ERROR
+    assert classify_error(HttpStatusError(503, 'unavailable')) == SERVER_ERROR
+    assert classify_error(HttpStatusError(400, 'invalid query')) == PERMANENT
+    assert classify_error(asyncio.TimeoutError()) == TIMEOUT
+    assert classify_error(aiohttp.ServerTimeoutError()) == TIMEOUT
+    assert classify_error(ConnectionResetError()) == CONNECTION_ERROR
+    assert classify_error(ValueError('no coordinates')) == PERMANENT
+
+
+def test_rejects_locations():
+    assert rejects_locations(HttpStatusError(400, 'Invalid coordinates [200.0, 10.0]'))
+    assert rejects_locations(HttpStatusError(422, 'No data for location 3'))
+    assert not rejects_locations(HttpStatusError(400, 'unknown domain ERA6'))
+    assert not rejects_locations(HttpStatusError(401, 'invalid location key'))
+    assert not rejects_locations(HttpStatusError(403, 'forbidden'))
+    assert not rejects_locations(ValueError('no coordinates'))
+
+
+def test_backoff_delay_is_capped_exponentially():
+    policy = RetryPolicy(base_delay=1.0, max_delay=5.0)
+    for retry, cap in [(0, 1.0), (1, 2.0), (2, 4.0), (3, 5.0), (10, 5.0)]:
+        delays: list = [policy.backoff_delay(retry) for _ in range(200)]
+        assert all(0 <= delay <= cap for delay in delays)
+        # full jitter spreads the delays over the whole range below the cap
+        assert max(delays) > cap / 2
+
+
+def test_retryable_errors_are_retried_until_success():
+    policy = RetryPolicy(max_attempts=5, base_delay=0.001, max_delay=0.001)
+    send_once = failing_then_succeeding([HttpStatusError(429, 'slow down'), HttpStatusError(502, 'bad gateway'),
+                                         asyncio.TimeoutError()])
+
+    assert asyncio.run(policy.run(send_once, 'hash-a', 'request a')) == 'response'
+    record = policy.records[0]
+    assert (record.attempts, record.outcome) == (4, SUCCEEDED)
+    assert policy.failure_reason('hash-a') == ''
+
+
+def test_retries_wait_for_the_retry_after_delay_of_the_server():
+    policy = RetryPolicy(max_attempts=2, base_delay=0, max_delay=0)
+    send_once = failing_then_succeeding([HttpStatusError(429, 'slow down', retry_after=0.2)])
+
+    assert asyncio.run(policy.run(send_once, 'hash-a', 'request a')) == 'response'
+    assert policy.records[0].elapsed_seconds >= 0.2
+
+
+def test_permanent_errors_are_not_retried():
+    policy = RetryPolicy(max_attempts=5, base_delay=0.001)
+    send_once = failing_then_succeeding([HttpStatusError(400, 'invalid query')])
+
+    assert asyncio.run(policy.run(send_once, 'hash-a', 'request a')) is None
+    record = policy.records[0]
+    assert (record.attempts, record.outcome, record.error_class) == (1, FAILED, PERMANENT)
+    assert policy.failure_reason('hash-a') == 'permanent: HTTP 400: invalid query'
+
+
+def test_retries_stop_after_max_attempts():
+    policy = RetryPolicy(max_attempts=3, base_delay=0.001, max_delay=0.001)
+    send_once = failing_then_succeeding([HttpStatusError(503, 'unavailable')] * 5)
+
+    assert asyncio.run(policy.run(send_once, 'hash-a', 'request a')) is None
+    assert policy.records[0].attempts == 3
+    assert policy.failure_reason('hash-a') == 'server_error: HTTP 503: unavailable'
+
+
+def test_retries_stop_at_the_request_deadline():
+    policy = RetryPolicy(max_attempts=100, deadline=0.5)
+    # a retry after the backoff delay would start after the deadline, so the request is given up straight away
+    policy.backoff_delay = lambda retry: 1.0
+    send_once = failing_then_succeeding([HttpStatusError(503, 'unavailable')] * 5)
+
+    assert asyncio.run(policy.run(send_once, 'hash-a', 'request a')) is None
+    assert policy.records[0].attempts == 1
+
+
+def test_a_slow_attempt_times_out_at_the_deadline():
+    policy = RetryPolicy(max_attempts=1, deadline=0.05)
+
+    async def send_once():
+        await asyncio.sleep(10)
+
+    assert asyncio.run(policy.run(send_once, 'hash-a', 'request a')) is None
+    assert policy.records[0].error_class == TIMEOUT
@@ -0,0 +1,95 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+from meteobe.response_decoder import CodeInfo, GeometryBlock
+from meteobe.tile_cache import TileCache, missing_range
+
+DAY_SECONDS = 86400
+CODES: list = [CodeInfo(11, '2 m above gnd', 'mean', '°C', None, None),
+               CodeInfo(61, 'sfc', 'sum', 'mm', None, None)]
+FIRST_DAY: int = date(2021, 1, 1).toordinal()
+# 2021-01-01 00:00 UTC
+FIRST_TIMESTAMP = 1609459200
+
+
+def hourly_block(first_day: int, day_count: int, domain: str = 'ERA5T', stride: int = 3600) -> GeometryBlock:
+    """A single location block whose values are the hour since 2021-01-01 and its negative, for each code"""
+    start: int = FIRST_TIMESTAMP + (first_day - FIRST_DAY) * DAY_SECONDS
+    hours: np.ndarray = (start - FIRST_TIMESTAMP) / 3600 + np.arange(day_count * DAY_SECONDS // stride) * stride / 3600
+    values: np.ndarray = np.stack([hours, -hours], axis=-1)[np.newaxis]
+    return GeometryBlock.from_values(domain, [47.5], [7.5], start, start + day_count * DAY_SECONDS, stride, CODES,
+                                     values)
+
+
+@pytest.fixture
+def tile_cache(tmp_path):
+    cache = TileCache(str(tmp_path / 'tiles.sqlite'), {'DEFAULT': 1})
+    yield cache
+    cache.close()
+
+
+def test_missing_range_covers_every_missing_day():
+    assert missing_range(1, 5, set()) == (1, 5)
+    assert missing_range(1, 5, {1, 2}) == (3, 5)
+    # a cached day inside the range is fetched again rather than sending two requests
+    assert missing_range(1, 5, {1, 3, 5}) == (2, 4)
+    assert missing_range(1, 5, {1, 2, 3, 4, 5}) is None
+
+
+def test_tiles_of_two_requests_are_stitched_into_one_block(tile_cache):
+    location_key: str = TileCache.location_key(47.5, 7.5)
+    assert tile_cache.store_block(location_key, 'query-a', hourly_block(FIRST_DAY, 3), 0, FIRST_DAY, FIRST_DAY + 2)
+    assert tile_cache.store_block(location_key, 'query-a', hourly_block(FIRST_DAY + 3, 2), 0, FIRST_DAY + 3,
+                                  FIRST_DAY + 4)
+    assert tile_cache.cached_days(location_key, 'query-a', FIRST_DAY, FIRST_DAY + 9) == \
+        set(range(FIRST_DAY, FIRST_DAY + 5))
+
+    block: GeometryBlock = tile_cache.load_block(location_key, 'query-a', FIRST_DAY + 1, FIRST_DAY + 4)
+    expected: GeometryBlock = hourly_block(FIRST_DAY + 1, 4)
+    assert (block.domain, block.start, block.end, block.stride) == \
+        ('ERA5T', expected.start, expected.end, expected.stride)
+    assert (block.lats, block.lons, block.codes) == ([47.5], [7.5], CODES)
+    np.testing.assert_array_equal(block.location_values(0), expected.location_values(0))
+
+
+def test_a_missing_tile_fails_the_block(tile_cache):
+    location_key: str = TileCache.location_key(47.5, 7.5)
+    tile_cache.store_block(location_key, 'query-a', hourly_block(FIRST_DAY, 2), 0, FIRST_DAY, FIRST_DAY + 1)
+
+    assert tile_cache.load_block(location_key, 'query-a', FIRST_DAY, FIRST_DAY + 2) is None
+    assert tile_cache.load_block(location_key, 'query-b', FIRST_DAY, FIRST_DAY + 1) is None
+    assert tile_cache.load_block(TileCache.location_key(47.5, 7.6), 'query-a', FIRST_DAY, FIRST_DAY + 1) is None
+
+
+def test_blocks_that_do_not_split_into_days_are_not_stored(tile_cache):
+    location_key: str = TileCache.location_key(47.5, 7.5)
+    # e.g. a stride that does not divide a day
+    assert not tile_cache.store_block(location_key, 'query-a', hourly_block(FIRST_DAY, 2, stride=7 * 3600), 0,
+                                      FIRST_DAY, FIRST_DAY + 1)
+    # or a block that does not cover the requested days
+    assert not tile_cache.store_block(location_key, 'query-a', hourly_block(FIRST_DAY, 2), 0, FIRST_DAY,
+                                      FIRST_DAY + 2)
+    assert tile_cache.cached_days(location_key, 'query-a', FIRST_DAY, FIRST_DAY + 2) == set()
+
+
+def test_domains_without_time_to_live_are_not_stored(tmp_path):
+    cache = TileCache(str(tmp_path / 'tiles.sqlite'), {'ERA5T': 0, 'DEFAULT': 1})
+    assert not cache.store_block('47.5,7.5', 'query-a', hourly_block(FIRST_DAY, 1), 0, FIRST_DAY, FIRST_DAY)
+    assert cache.store_block('47.5,7.5', 'query-b', hourly_block(FIRST_DAY, 1, domain='CHIRPS2'), 0, FIRST_DAY,
+                             FIRST_DAY)
+    cache.close()
+
+
+def test_tiles_are_reused_by_a_later_run(tmp_path):
+    cache_file: str = str(tmp_path / 'tiles.sqlite')
+    first_run = TileCache(cache_file, {'DEFAULT': 1})
+    first_run.store_block('47.5,7.5', 'query-a', hourly_block(FIRST_DAY, 2), 0, FIRST_DAY, FIRST_DAY + 1)
+    first_run.close()
+
+    second_run = TileCache(cache_file, {'DEFAULT': 1})
+    block: GeometryBlock = second_run.load_block('47.5,7.5', 'query-a', FIRST_DAY, FIRST_DAY + 1)
+    assert block.codes == CODES
+    np.testing.assert_array_equal(block.location_values(0), hourly_block(FIRST_DAY, 2).location_values(0))
+    second_run.close()